@@ -2,6 +2,12 @@
 Gói ứng dụng chat E2EE
 - Mô-đun crypto: Xử lý mã hoá/giải mã
 - Mô-đun transport: Quản lý broker và chuyển tiếp tin nhắn
+- Mô-đun wire: Định dạng frame nhị phân cho bản mã
+- Mô-đun server: Broker server asyncio qua TCP/Unix socket
+- Mô-đun offline: Log lưu frame cho client offline
+- Mô-đun cluster: Broker chia shard trên nhiều process
+- Mô-đun history: Kho lịch sử chat SQLite theo từng danh tính
+- Mô-đun executor: Chạy tác vụ mã hoá ngoài luồng giao diện
 - Mô-đun ui: Giao diện người dùng
 - Mô-đun main: Entry point chính
 """
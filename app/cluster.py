@@ -0,0 +1,745 @@
+"""
+Broker chia shard trên nhiều process cho ứng dụng chat E2EE.
+
+Một InMemoryBroker chỉ định tuyến trên 1 core. Chế độ cluster chạy K process
+worker (mỗi process là 1 BrokerServer), client được gán vào worker theo
+consistent hashing của client_id:
+- Coordinator: BrokerServer giữ danh bạ presence (list_clients, presence)
+- Shard: BrokerServer + ShardBroker; frame tới client (hoặc phòng) của shard
+  khác được chuyển tiếp qua Unix socket nội bộ giữa các worker (kết nối
+  phải xác thực bằng khoá bí mật chung trong cluster.json)
+- ClusterBroker: phía client, đăng ký/phòng gửi tới shard sở hữu client_id
+  (hoặc room_id), frame gửi qua shard của người gửi (nơi server kiểm tra
+  người gửi thuộc kết nối), presence lấy từ coordinator
+- Vòng hash có CLUSTER_VNODES node ảo mỗi shard: thêm 1 shard vào K shard chỉ
+  chuyển khoảng 1/(K+1) client sang shard mới
+
+Sử dụng:
+    python -m app.cluster --shards 4 --dir /tmp/e2ee-cluster
+    E2EE_BROKER=cluster:///tmp/e2ee-cluster python -m app.main
+
+Lưu ý: Thay đổi số shard cần khởi động lại cluster; client đăng ký lại với
+cùng client_id sẽ về shard mới theo vòng hash.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+
+from .offline import OfflineLog
+from .server import BrokerServer
+from .transport import (
+    DELTA_JOIN,
+    DELTA_LEAVE,
+    DELTA_RESET,
+    DELTA_UPDATE,
+    Broker,
+    BrokerError,
+    BrokerMetrics,
+    ClientRegistration,
+    DeliveryQueue,
+    DeltaCallback,
+    DeltaEvent,
+    FrameDelivery,
+    InMemoryBroker,
+    OverflowPolicy,
+    QueueFull,
+    RemoteBroker,
+    _no_delivery,
+    parse_broker_url,
+)
+from .wire import OP_AUTH, OP_SEND, decode_frame, pack_message
+
+CLUSTER_VNODES = 128  # Số node ảo của mỗi shard trên vòng hash
+CLUSTER_CONFIG = "cluster.json"  # Tên file cấu hình trong thư mục cluster
+CLUSTER_URL_PREFIX = "cluster://"  # URL broker dạng cluster://<thư mục cluster>
+PEER_QUEUE_SIZE = 65536  # Số message tối đa chờ chuyển tiếp tới 1 shard khác
+CLUSTER_START_TIMEOUT = 10.0  # Thời gian chờ tối đa để các process sẵn sàng (giây)
+CLUSTER_RETRY = 0.5  # Thời gian chờ trước khi kết nối lại coordinator/shard khác (giây)
+PEER_SEND_ATTEMPTS = 3  # Số lần thử gửi 1 lô chuyển tiếp trước khi bỏ (mỗi lần mở lại kết nối)
+CLUSTER_SECRET_BYTES = 32  # Độ dài khoá bí mật chung xác thực kết nối giữa các shard
+
+
+def _ring_hash(key: str) -> int:
+    """Hash 64-bit ổn định giữa các process (không dùng hash() vì có salt)"""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Vòng consistent hashing ánh xạ key (client_id, room_id) -> tên shard
+    - Mỗi shard có vnodes điểm trên vòng, key thuộc điểm đầu tiên >= hash(key)
+    - Thêm/bớt 1 shard chỉ đổi chủ các key nằm giữa điểm của shard đó và
+      điểm liền trước, khoảng 1/K số key
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = CLUSTER_VNODES) -> None:
+        """
+        Khởi tạo vòng hash
+        Args:
+            nodes: Tên các shard
+            vnodes: Số node ảo mỗi shard
+        """
+        self.vnodes = vnodes
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        self._nodes: Set[str] = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    @property
+    def nodes(self) -> List[str]:
+        """Tên các shard (đã sắp xếp)"""
+        return sorted(self._nodes)
+
+    def add(self, node: str) -> None:
+        """
+        Thêm shard vào vòng
+        Args:
+            node: Tên shard
+        """
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.vnodes):
+            point = _ring_hash(f"{node}#{i}")
+            index = bisect.bisect_left(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str) -> None:
+        """
+        Xoá shard khỏi vòng
+        Args:
+            node: Tên shard
+        """
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        kept = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def node_for(self, key: str) -> str:
+        """
+        Shard sở hữu key
+        Args:
+            key: client_id hoặc room_id
+        Returns:
+            str: Tên shard
+        Raises:
+            LookupError: Nếu vòng chưa có shard nào
+        """
+        if not self._points:
+            raise LookupError("Vòng hash chưa có shard")
+        index = bisect.bisect_left(self._points, _ring_hash(key))
+        return self._owners[index % len(self._owners)]
+
+
+@dataclass
+class ClusterConfig:
+    """
+    Cấu hình cluster, lưu ở <thư mục>/cluster.json
+    - coordinator: URL của coordinator (danh bạ presence)
+    - shards: Tên shard -> URL lắng nghe
+    - peers: Tên shard -> URL lắng nghe nội bộ (chỉ shard khác chuyển tiếp
+      frame, không kiểm tra người gửi)
+    - secret: Khoá bí mật chung (hex) mà shard khác phải gửi khi kết nối tới
+      listener nội bộ; file cấu hình chỉ chủ sở hữu đọc được
+    - vnodes: Số node ảo mỗi shard trên vòng hash
+    """
+    coordinator: str
+    shards: Dict[str, str] = field(default_factory=dict)
+    peers: Dict[str, str] = field(default_factory=dict)
+    secret: str = ""
+    vnodes: int = CLUSTER_VNODES
+
+    @classmethod
+    def create(cls, directory: str, shards: int, vnodes: int = CLUSTER_VNODES) -> "ClusterConfig":
+        """
+        Tạo cấu hình dùng Unix socket trong thư mục cluster
+        Args:
+            directory: Thư mục cluster
+            shards: Số shard
+            vnodes: Số node ảo mỗi shard
+        Returns:
+            ClusterConfig: Cấu hình mới (chưa ghi ra đĩa)
+        """
+        directory = os.path.abspath(directory)
+        return cls(
+            coordinator=f"unix://{os.path.join(directory, 'coordinator.sock')}",
+            shards={f"shard-{i}": f"unix://{os.path.join(directory, f'shard-{i}.sock')}" for i in range(shards)},
+            peers={f"shard-{i}": f"unix://{os.path.join(directory, f'shard-{i}.peer.sock')}" for i in range(shards)},
+            secret=secrets.token_hex(CLUSTER_SECRET_BYTES),
+            vnodes=vnodes,
+        )
+
+    @classmethod
+    def load(cls, directory: str) -> "ClusterConfig":
+        """
+        Đọc cấu hình từ thư mục cluster
+        Args:
+            directory: Thư mục cluster
+        Returns:
+            ClusterConfig: Cấu hình đã lưu
+        """
+        with open(os.path.join(directory, CLUSTER_CONFIG), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            coordinator=data["coordinator"],
+            shards=dict(data["shards"]),
+            peers=dict(data.get("peers", {})),
+            secret=str(data.get("secret", "")),
+            vnodes=int(data.get("vnodes", CLUSTER_VNODES)),
+        )
+
+    def save(self, directory: str) -> None:
+        """
+        Ghi cấu hình vào thư mục cluster (ghi file tạm rồi đổi tên, quyền
+        0600 vì file chứa khoá bí mật của cluster)
+        Args:
+            directory: Thư mục cluster
+        """
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, CLUSTER_CONFIG)
+        if os.path.exists(path + ".tmp"):
+            os.unlink(path + ".tmp")
+        with os.fdopen(os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w", encoding="utf-8") as f:
+            json.dump({"coordinator": self.coordinator, "shards": self.shards, "peers": self.peers, "secret": self.secret, "vnodes": self.vnodes}, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def ring(self) -> HashRing:
+        """Vòng hash của các shard trong cấu hình"""
+        return HashRing(self.shards, self.vnodes)
+
+    @property
+    def peer_secret(self) -> Optional[bytes]:
+        """Khoá bí mật dạng bytes (None nếu cấu hình cũ không có khoá)"""
+        return bytes.fromhex(self.secret) if self.secret else None
+
+    def peer_url(self, shard: str) -> str:
+        """
+        URL shard khác dùng để chuyển tiếp frame tới shard (cấu hình cũ không
+        có peers hoặc secret: URL chính, không có listener nội bộ)
+        """
+        if not self.secret:
+            return self.shards[shard]
+        return self.peers.get(shard, self.shards[shard])
+
+
+class _PeerLink:
+    """
+    Kết nối chuyển tiếp frame tới 1 shard khác
+    - Message OP_SEND được xếp vào DeliveryQueue (REJECT khi đầy) và ghi ra
+      socket theo lô trên luồng riêng, event loop của shard không bao giờ
+      bị chặn chờ shard khác (2 shard gửi cho nhau không thể deadlock)
+    - Kết nối mở khi có frame đầu tiên (gửi OP_AUTH với khoá bí mật của
+      cluster trước mọi frame); gửi lỗi thì mở lại và gửi lại cả lô
+      (tối đa PEER_SEND_ATTEMPTS lần, frame đã tới trước khi lỗi có thể bị
+      giao 2 lần), hết lượt thử thì bỏ lô và đếm vào BrokerMetrics
+    """
+
+    def __init__(self, url: str, pool: ThreadPoolExecutor, metrics: Optional[BrokerMetrics] = None, secret: Optional[bytes] = None) -> None:
+        """
+        Khởi tạo kết nối (chưa mở socket)
+        Args:
+            url: URL của shard đích
+            pool: Thread pool ghi socket
+            metrics: Nơi đếm frame bị bỏ (None = không đếm)
+            secret: Khoá bí mật của cluster (None = listener không xác thực)
+        """
+        self.url = url
+        self.metrics = metrics
+        self._auth = pack_message(OP_AUTH, secret) if secret is not None else b""
+        self._sock: Optional[socket.socket] = None
+        self._queue = DeliveryQueue(self._send_one, pool, PEER_QUEUE_SIZE, OverflowPolicy.REJECT, deliver_many=self._send_many)
+
+    def forward(self, to_client_id: str, frame: bytes) -> None:
+        """
+        Xếp frame chờ chuyển tới shard đích
+        Args:
+            to_client_id: ID của client nhận
+            frame: Frame bản mã
+        Raises:
+            QueueFull: Nếu hàng chờ chuyển tiếp đầy
+        """
+        self._queue.put(bytes(pack_message(OP_SEND, to_client_id.encode("utf-8"), frame)))
+
+    def _send_one(self, message: bytes) -> None:
+        """Ghi 1 message (DeliveryQueue chỉ dùng khi không có deliver_many)"""
+        self._send_many([message])
+
+    def _send_many(self, messages: List[bytes]) -> None:
+        """Ghi cả lô message bằng 1 lần sendall (chạy trên luồng của pool)"""
+        data = b"".join(messages)
+        for attempt in range(PEER_SEND_ATTEMPTS):
+            if attempt:
+                time.sleep(CLUSTER_RETRY)
+            try:
+                if self._sock is None:
+                    family, address = parse_broker_url(self.url)
+                    sock = socket.socket(family, socket.SOCK_STREAM)
+                    sock.connect(address)
+                    sock.sendall(self._auth)
+                    self._sock = sock
+                self._sock.sendall(data)
+                return
+            except OSError:
+                # Shard đích chưa chạy, đang khởi động lại hoặc kết nối cũ đã đứt
+                if self._sock is not None:
+                    self._sock.close()
+                    self._sock = None
+        if self.metrics is not None:
+            self.metrics.on_forward_dropped(len(messages))
+
+    def close(self) -> None:
+        """Đóng kết nối, bỏ các message chưa gửi"""
+        self._queue.close()
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class ShardBroker(InMemoryBroker):
+    """
+    InMemoryBroker của 1 shard trong cluster
+    - Frame tới client không có ở shard này được chuyển tiếp tới shard sở hữu
+      client_id theo vòng hash (send_frame, send_frame_many, send_to_room)
+    - Frame tới phòng của shard khác được chuyển tiếp tới shard của phòng
+    - join_room/leave_room nhận ở shard của client (nơi server kiểm tra client
+      thuộc kết nối) và gửi tiếp tới shard của phòng qua listener nội bộ
+    - Frame tới client của chính shard mà client không online: log offline
+      như InMemoryBroker
+    - Thay đổi presence được đồng bộ lên coordinator trên luồng nền
+    """
+
+    def __init__(self, name: str, config: ClusterConfig, **kwargs: object) -> None:
+        """
+        Khởi tạo broker của shard
+        Args:
+            name: Tên shard (key trong config.shards)
+            config: Cấu hình cluster
+            **kwargs: Tham số của InMemoryBroker
+        """
+        super().__init__(**kwargs)  # type: ignore[arg-type]
+        self.name = name
+        self.config = config
+        self.ring = config.ring()
+        peers = [shard for shard in config.shards if shard != name]
+        self._forward_pool = ThreadPoolExecutor(max_workers=max(1, len(peers)), thread_name_prefix="cluster-forward")
+        self._peers = {shard: _PeerLink(config.peer_url(shard), self._forward_pool, self.metrics, config.peer_secret) for shard in peers}
+        self._mirror_events: "queue.SimpleQueue[Optional[DeltaEvent]]" = queue.SimpleQueue()
+        self._mirror_thread: Optional[threading.Thread] = None
+
+    def _undeliverable(self, to_client_id: str, frame: bytes) -> bool:
+        """
+        Client không có ở shard này: chuyển tiếp nếu thuộc shard khác
+        Returns:
+            bool: True nếu frame đã được xếp chờ chuyển tiếp hoặc lưu offline
+        """
+        owner = self.ring.node_for(to_client_id)
+        if owner == self.name:
+            return super()._undeliverable(to_client_id, frame)
+        try:
+            self._peers[owner].forward(to_client_id, frame)
+        except QueueFull:
+            if self.metrics is not None:
+                self.metrics.on_forward_dropped()
+            return False
+        return True
+
+    def _room_shard(self, room_id: str) -> Optional[RemoteBroker]:
+        """Kết nối nội bộ tới shard sở hữu phòng (None nếu phòng thuộc shard này)"""
+        owner = self.ring.node_for(room_id)
+        if owner == self.name:
+            return None
+        return RemoteBroker.connect(self.config.peer_url(owner), self.config.peer_secret)
+
+    def _may_join(self, client_id: str) -> bool:
+        """Client của shard khác đã được shard đó kiểm tra trước khi gửi tới đây"""
+        return self.ring.node_for(client_id) != self.name or super()._may_join(client_id)
+
+    def join_room(self, room_id: str, client_id: str) -> None:
+        """
+        Thêm client vào phòng (phòng của shard khác: gửi tiếp tới shard đó,
+        lời gọi chặn nên server chạy lệnh phòng ngoài event loop)
+        Raises:
+            BrokerError: Nếu phòng không tồn tại hoặc client chưa đăng ký
+        """
+        remote = self._room_shard(room_id)
+        if remote is None:
+            super().join_room(room_id, client_id)
+        else:
+            remote.join_room(room_id, client_id)
+
+    def leave_room(self, room_id: str, client_id: str) -> None:
+        """
+        Xoá client khỏi phòng (phòng của shard khác: gửi tiếp tới shard đó)
+        Raises:
+            BrokerError: Nếu phòng không tồn tại
+        """
+        remote = self._room_shard(room_id)
+        if remote is None:
+            super().leave_room(room_id, client_id)
+        else:
+            remote.leave_room(room_id, client_id)
+
+    def send_to_room(self, room_id: str, frame: bytes, exclude: Optional[str] = None) -> int:
+        """
+        Chuyển frame tới mọi thành viên phòng (phòng của shard khác: gửi tiếp
+        tới shard đó và chờ số client nhận, lời gọi chặn nên server chạy lệnh
+        phòng ngoài event loop)
+        Returns:
+            int: Số client đã nhận frame
+        Raises:
+            BrokerError: Nếu phòng không tồn tại hoặc người gửi không phải thành viên phòng
+        """
+        remote = self._room_shard(room_id)
+        if remote is None:
+            return super().send_to_room(room_id, frame, exclude=exclude)
+        return remote.send_to_room(room_id, frame, exclude=exclude)
+
+    def start_mirror(self) -> None:
+        """Bắt đầu đồng bộ presence lên coordinator"""
+        if self._mirror_thread is not None:
+            return
+        self._mirror_thread = threading.Thread(target=self._mirror_loop, name="cluster-mirror", daemon=True)
+        self._mirror_thread.start()
+
+    def _mirror_loop(self) -> None:
+        """
+        Luồng nền: áp các thay đổi presence của shard lên coordinator
+        Mất kết nối thì kết nối lại và đăng ký lại từ DELTA_RESET (coordinator
+        tự huỷ các đăng ký của kết nối cũ)
+        """
+        while True:
+            token = self.presence.subscribe(self._mirror_events.put)
+            mirrored: Set[str] = set()
+            directory: Optional[RemoteBroker] = None
+            try:
+                directory = RemoteBroker(self.config.coordinator)
+                while True:
+                    event = self._mirror_events.get()
+                    if event is None:
+                        return
+                    self._mirror(directory, mirrored, event)
+            except (OSError, BrokerError):
+                pass
+            finally:
+                self.presence.unsubscribe(token)
+                if directory is not None:
+                    directory.close()
+            # Bỏ các sự kiện của lần đăng ký cũ, lần sau bắt đầu bằng DELTA_RESET
+            while not self._mirror_events.empty():
+                if self._mirror_events.get() is None:
+                    return
+            time.sleep(CLUSTER_RETRY)
+
+    def _mirror(self, directory: RemoteBroker, mirrored: Set[str], event: DeltaEvent) -> None:
+        """Áp 1 sự kiện presence lên coordinator"""
+        if event.kind == DELTA_RESET:
+            snapshot: Dict[str, ClientRegistration] = event.value
+            for client_id in mirrored - snapshot.keys():
+                directory.unregister_client(client_id)
+            for client_id, registration in snapshot.items():
+                directory.register_client(registration.display_name, registration.public_key_bytes, _no_delivery, client_id=client_id)
+            mirrored.clear()
+            mirrored.update(snapshot)
+        elif event.kind == DELTA_JOIN:
+            registration = event.value
+            directory.register_client(registration.display_name, registration.public_key_bytes, _no_delivery, client_id=event.key)
+            mirrored.add(event.key)
+        elif event.kind == DELTA_UPDATE:
+            directory.update_public_key(event.key, event.value.public_key_bytes)
+        elif event.kind == DELTA_LEAVE:
+            directory.unregister_client(event.key)
+            mirrored.discard(event.key)
+
+    def close(self) -> None:
+        """Dừng đồng bộ presence và đóng các kết nối chuyển tiếp"""
+        self._mirror_events.put(None)
+        for link in self._peers.values():
+            link.close()
+        self._forward_pool.shutdown(wait=False)
+
+
+class ClusterBroker(Broker):
+    """
+    Broker client kết nối tới cluster (cùng giao diện với RemoteBroker)
+    - Lệnh theo client_id/room_id được gửi thẳng tới shard sở hữu key đó
+    - Frame được gửi qua shard của người gửi (kết nối đã đăng ký người gửi),
+      shard đó chuyển tiếp tới shard của người nhận hoặc phòng
+    - Danh sách client và presence lấy từ coordinator
+    - client_id được tạo ở phía client để biết shard trước khi đăng ký
+    """
+    _instances: Dict[str, "ClusterBroker"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, directory: str) -> None:
+        """
+        Đọc cấu hình cluster và kết nối tới coordinator
+        Args:
+            directory: Thư mục cluster (chứa cluster.json)
+        """
+        self.config = ClusterConfig.load(directory)
+        self.ring = self.config.ring()
+        self._directory = RemoteBroker.connect(self.config.coordinator)
+
+    @classmethod
+    def connect(cls, url: str) -> "ClusterBroker":
+        """
+        Lấy kết nối dùng chung tới cluster theo URL
+        Args:
+            url: "cluster://<thư mục cluster>"
+        Returns:
+            ClusterBroker: Kết nối dùng chung
+        """
+        with cls._instances_lock:
+            broker = cls._instances.get(url)
+            if broker is None:
+                broker = cls._instances[url] = ClusterBroker(url[len(CLUSTER_URL_PREFIX):])
+            return broker
+
+    def _shard(self, key: str) -> RemoteBroker:
+        """Kết nối tới shard sở hữu key"""
+        return RemoteBroker.connect(self.config.shards[self.ring.node_for(key)])
+
+    def _home(self, frame: bytes) -> RemoteBroker:
+        """Kết nối tới shard của người gửi frame"""
+        return self._shard(decode_frame(frame).sender_id)
+
+    def register_client(self, display_name: str, public_key_bytes: bytes, deliver: FrameDelivery, client_id: Optional[str] = None) -> str:
+        """
+        Đăng ký client với shard sở hữu client_id
+        Args:
+            display_name: Tên hiển thị của client
+            public_key_bytes: Khoá công khai X25519
+            deliver: Callback nhận frame (gọi trên luồng đọc socket của shard)
+            client_id: ID cũ khi đăng ký lại (None = tạo ID mới)
+        Returns:
+            str: Client ID
+        """
+        client_id = client_id or str(uuid.uuid4())
+        return self._shard(client_id).register_client(display_name, public_key_bytes, deliver, client_id=client_id)
+
+    def unregister_client(self, client_id: str) -> None:
+        """Hủy đăng ký client ở shard sở hữu client_id"""
+        self._shard(client_id).unregister_client(client_id)
+
+    def update_public_key(self, client_id: str, public_key_bytes: bytes) -> None:
+        """Cập nhật khoá công khai của client ở shard sở hữu client_id"""
+        self._shard(client_id).update_public_key(client_id, public_key_bytes)
+
+    def list_clients(self) -> Dict[str, ClientRegistration]:
+        """Danh sách client của cả cluster (từ coordinator)"""
+        return self._directory.list_clients()
+
+    def subscribe_presence(self, callback: DeltaCallback, since: Optional[int] = None) -> int:
+        """Đăng ký nhận thay đổi danh sách client của cả cluster (từ coordinator)"""
+        return self._directory.subscribe_presence(callback, since)
+
+    def unsubscribe_presence(self, token: int) -> None:
+        """Huỷ đăng ký nhận thay đổi danh sách client"""
+        self._directory.unsubscribe_presence(token)
+
+    def create_room(self, name: str = "", room_id: Optional[str] = None) -> str:
+        """
+        Tạo phòng trên shard sở hữu room_id
+        Args:
+            name: Tên phòng
+            room_id: ID mong muốn (None = tạo ID mới)
+        Returns:
+            str: ID của phòng
+        """
+        room_id = room_id or str(uuid.uuid4())
+        return self._shard(room_id).create_room(name, room_id)
+
+    def join_room(self, room_id: str, client_id: str) -> None:
+        """Thêm client vào phòng qua shard của client (shard đó gửi tiếp tới shard của phòng)"""
+        self._shard(client_id).join_room(room_id, client_id)
+
+    def leave_room(self, room_id: str, client_id: str) -> None:
+        """Xoá client khỏi phòng qua shard của client (shard đó gửi tiếp tới shard của phòng)"""
+        self._shard(client_id).leave_room(room_id, client_id)
+
+    def room_members(self, room_id: str) -> List[str]:
+        """Danh sách thành viên phòng (từ shard của phòng)"""
+        return self._shard(room_id).room_members(room_id)
+
+    def subscribe_room(self, room_id: str, callback: DeltaCallback, since: Optional[int] = None) -> int:
+        """Đăng ký nhận thay đổi thành viên phòng từ shard của phòng"""
+        return self._shard(room_id).subscribe_room(room_id, callback, since)
+
+    def unsubscribe_room(self, room_id: str, token: int) -> None:
+        """Huỷ đăng ký nhận thay đổi thành viên phòng"""
+        self._shard(room_id).unsubscribe_room(room_id, token)
+
+    def send_to_room(self, room_id: str, frame: bytes, exclude: Optional[str] = None) -> int:
+        """Gửi frame qua shard của người gửi, shard chuyển tiếp tới shard của phòng"""
+        return self._home(frame).send_to_room(room_id, frame, exclude=exclude)
+
+    def send_frame(self, to_client_id: str, frame: bytes) -> bool:
+        """Gửi frame qua shard của người gửi (không chờ xác nhận)"""
+        return self._home(frame).send_frame(to_client_id, frame)
+
+    def send_frame_many(self, to_client_ids: Iterable[str], frame: bytes, exclude: Optional[str] = None) -> int:
+        """
+        Gửi 1 frame tới nhiều client bằng 1 lệnh tới shard của người gửi,
+        shard đó chuyển tiếp tới người nhận ở shard khác
+        Returns:
+            int: Số client nhận đã yêu cầu
+        """
+        return self._home(frame).send_frame_many(to_client_ids, frame, exclude=exclude)
+
+
+async def _serve_ready(server: BrokerServer, url: str, ready: "multiprocessing.synchronize.Event", peer_url: Optional[str] = None, secret: Optional[bytes] = None) -> None:
+    """Mở listener (và listener nội bộ cho shard khác), báo sẵn sàng cho process cha rồi chạy server"""
+    await server.start(url)
+    if peer_url is not None and secret is not None:
+        await server.start(peer_url, trusted=True, secret=secret)
+    ready.set()
+    await server.serve_forever()
+
+
+def _run_coordinator(directory: str, ready: "multiprocessing.synchronize.Event") -> None:
+    """Entry point của process coordinator"""
+    config = ClusterConfig.load(directory)
+    # Danh bạ chỉ chứa đăng ký giữ chỗ, không giao frame
+    server = BrokerServer(InMemoryBroker(queue_size=0, overflow=OverflowPolicy.REJECT))
+    try:
+        asyncio.run(_serve_ready(server, config.coordinator, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+def _run_shard(directory: str, name: str, ready: "multiprocessing.synchronize.Event", offline_dir: Optional[str] = None, metrics_dir: Optional[str] = None) -> None:
+    """Entry point của process shard"""
+    config = ClusterConfig.load(directory)
+    offline = None
+    if offline_dir:
+        offline = OfflineLog(os.path.join(offline_dir, name))
+        offline.start()
+    metrics = BrokerMetrics() if metrics_dir else None
+    broker = ShardBroker(name, config, overflow=OverflowPolicy.REJECT, offline=offline, metrics=metrics)
+    if metrics is not None and metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        metrics.start_export(os.path.join(metrics_dir, f"{name}.prom"), broker.stats)
+    broker.start_mirror()
+    try:
+        peer_url = config.peers.get(name)
+        asyncio.run(_serve_ready(BrokerServer(broker), config.shards[name], ready, peer_url, config.peer_secret))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
+
+
+class Cluster:
+    """
+    Khởi chạy và dừng các process của cluster trên 1 máy
+    - start(): ghi cluster.json, chạy coordinator rồi K shard
+    - stop(): dừng mọi process
+    """
+
+    def __init__(self, directory: str, shards: int, vnodes: int = CLUSTER_VNODES, offline_dir: Optional[str] = None, metrics_dir: Optional[str] = None) -> None:
+        """
+        Khởi tạo cluster (chưa chạy process nào)
+        Args:
+            directory: Thư mục cluster (cấu hình và Unix socket)
+            shards: Số shard (thường = số core)
+            vnodes: Số node ảo mỗi shard
+            offline_dir: Thư mục log offline (mỗi shard 1 thư mục con, None = không lưu)
+            metrics_dir: Thư mục file số liệu Prometheus (mỗi shard 1 file <tên>.prom, None = tắt đo)
+        Raises:
+            ValueError: Nếu shards < 1
+        """
+        if shards < 1:
+            raise ValueError("Số shard phải >= 1")
+        self.directory = os.path.abspath(directory)
+        self.config = ClusterConfig.create(self.directory, shards, vnodes)
+        self.offline_dir = offline_dir
+        self.metrics_dir = metrics_dir
+        self.url = CLUSTER_URL_PREFIX + self.directory
+        self._processes: List[multiprocessing.process.BaseProcess] = []
+
+    def start(self, timeout: float = CLUSTER_START_TIMEOUT) -> None:
+        """
+        Chạy coordinator và các shard, chờ tới khi tất cả đang lắng nghe
+        Args:
+            timeout: Thời gian chờ tối đa (giây)
+        Raises:
+            RuntimeError: Nếu có process không sẵn sàng kịp
+        """
+        self.config.save(self.directory)
+        ctx = multiprocessing.get_context("spawn")
+        targets = [(_run_coordinator, (self.directory,), "e2ee-coordinator")]
+        targets += [(_run_shard, (self.directory, name), f"e2ee-{name}") for name in self.config.shards]
+        events = []
+        for target, args, name in targets:
+            ready = ctx.Event()
+            extra = (self.offline_dir, self.metrics_dir) if target is _run_shard else ()
+            process = ctx.Process(target=target, args=args + (ready,) + extra, name=name, daemon=True)
+            process.start()
+            self._processes.append(process)
+            events.append((name, ready))
+        deadline = time.monotonic() + timeout
+        for name, ready in events:
+            if not ready.wait(max(0.0, deadline - time.monotonic())):
+                self.stop()
+                raise RuntimeError(f"Process {name} không sẵn sàng sau {timeout:g}s")
+
+    def stop(self) -> None:
+        """Dừng mọi process của cluster"""
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join()
+        self._processes.clear()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Entry point của cluster
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(description="Broker chia shard trên nhiều process cho ứng dụng chat E2EE")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1, help="Số process shard (mặc định = số core)")
+    parser.add_argument("--dir", default="data/cluster", help="Thư mục cấu hình và Unix socket của cluster")
+    parser.add_argument("--vnodes", type=int, default=CLUSTER_VNODES, help=f"Số node ảo mỗi shard (mặc định {CLUSTER_VNODES})")
+    parser.add_argument("--offline-dir", help="Thư mục lưu frame cho client offline (bỏ trống = không lưu)")
+    parser.add_argument("--metrics-dir", help="Thư mục ghi số liệu Prometheus của từng shard (bỏ trống = tắt đo)")
+    args = parser.parse_args(argv)
+    cluster = Cluster(args.dir, args.shards, args.vnodes, args.offline_dir, args.metrics_dir)
+    cluster.start()
+    print(f"🚀 Cluster {args.shards} shard đang chạy: E2EE_BROKER={cluster.url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -15,9 +15,16 @@ Bảo mật:
 
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Tuple
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import struct
+import threading
 
+from cryptography.exceptions import InvalidTag
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
 from cryptography.hazmat.primitives.asymmetric.x25519 import (
     X25519PrivateKey,
     X25519PublicKey,
@@ -31,8 +38,25 @@ import os
 # Các hằng số cho HKDF và AES
 HKDF_SALT = b"e2ee-mini-chat-hkdf-salt"  # Salt cho HKDF
 HKDF_INFO = b"e2ee-mini-chat-session-key"  # Info cho HKDF
+HKDF_STREAM_INFO = b"e2ee-mini-chat-stream-key"  # Info cho khoá con của luồng
+SENDER_KEY_AAD = b"e2ee-mini-chat-sender-key"  # AAD khi phân phối sender key
 AES_KEY_BYTES = 32  # 256-bit AES key
 NONCE_BYTES = 12  # 96-bit nonce cho AES-GCM
+SESSION_CACHE_SIZE = 256  # Số khoá phiên tối đa giữ trong cache
+TAG_BYTES = 16  # 128-bit authentication tag của AES-GCM
+NONCE_PREFIX_BYTES = 4  # Phần ngẫu nhiên của nonce, 8 bytes còn lại là bộ đếm
+MAX_MESSAGES_PER_KEY = 2 ** 32  # Giới hạn an toàn số tin nhắn cho 1 khoá AES-GCM
+GROUP_ID_BYTES = 16  # ID nhóm ngẫu nhiên 128-bit
+SIGNING_KEY_BYTES = 32  # Khoá công khai Ed25519 của người gửi trong gói sender key
+SIGNATURE_BYTES = 64  # Chữ ký Ed25519 ở cuối mỗi bản mã nhóm
+STREAM_CHUNK_BYTES = 64 * 1024  # Kích thước mỗi đoạn khi mã hoá theo luồng
+MAX_STREAM_SEGMENTS = 2 ** 32 - 1  # Số đoạn tối đa của một luồng
+KEYPAIR_POOL_SIZE = 32  # Số cặp khoá tạo sẵn tối đa trong pool
+KEYPAIR_POOL_LOW_WATER = 8  # Dưới mức này thì luồng nền tạo thêm cặp khoá
+BATCH_MIN_PER_WORKER = 64  # Số phần tử tối thiểu cho mỗi luồng khi xử lý theo lô
+
+# Dữ liệu đầu vào dạng bytes-like được chấp nhận bởi Session
+Buffer = Union[bytes, bytearray, memoryview]
 
 
 @dataclass
@@ -67,6 +91,15 @@ class KeyPair:
         public_key = private_key.public_key()
         return KeyPair(private_key=private_key, public_key=public_key)
 
+    @staticmethod
+    def acquire() -> "KeyPair":
+        """
+        Lấy cặp khoá đã tạo sẵn từ pool dùng chung (không chờ tạo khoá)
+        Returns:
+            KeyPair: Cặp khoá mới, chưa từng được cấp cho ai khác
+        """
+        return default_keypair_pool().acquire()
+
     def public_bytes(self) -> bytes:
         """
         Chuyển đổi khoá công khai thành bytes
@@ -76,6 +109,93 @@ class KeyPair:
         return self.public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
 
 
+class KeyPairPool:
+    """
+    Pool cặp khoá X25519 tạo sẵn bởi luồng nền
+    - acquire() lấy ngay 1 cặp khoá, không tốn thời gian tạo khoá
+    - Khi số khoá còn lại dưới low_water, luồng nền tạo thêm tới capacity
+    - Pool rỗng thì acquire() tự tạo khoá (không bao giờ trả lỗi)
+    """
+
+    def __init__(self, capacity: int = KEYPAIR_POOL_SIZE, low_water: int = KEYPAIR_POOL_LOW_WATER) -> None:
+        """
+        Khởi tạo pool rỗng (luồng nền chạy khi gọi start() hoặc acquire())
+        Args:
+            capacity: Số cặp khoá tối đa giữ sẵn
+            low_water: Ngưỡng kích hoạt tạo thêm khoá
+        """
+        if not 0 <= low_water <= capacity:
+            raise ValueError("Cần 0 <= low_water <= capacity")
+        self.capacity = capacity
+        self.low_water = low_water
+        self._ready: "deque[KeyPair]" = deque()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    def start(self) -> None:
+        """Chạy luồng nền và bắt đầu làm đầy pool"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._fill_loop, name="keypair-pool", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def stop(self) -> None:
+        """Dừng luồng nền (các khoá đã tạo vẫn được giữ)"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopped = True
+        self._wake.set()
+        if thread is not None:
+            thread.join()
+
+    def acquire(self) -> KeyPair:
+        """
+        Lấy 1 cặp khoá từ pool
+        Returns:
+            KeyPair: Cặp khoá mới
+        """
+        if self._thread is None and not self._stopped:
+            self.start()
+        try:
+            key_pair = self._ready.popleft()
+        except IndexError:
+            key_pair = KeyPair.generate()
+        if len(self._ready) < self.low_water:
+            self._wake.set()
+        return key_pair
+
+    def _fill_loop(self) -> None:
+        """Luồng nền: chờ được đánh thức rồi tạo khoá tới capacity"""
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopped:
+                return
+            while len(self._ready) < self.capacity and not self._stopped:
+                self._ready.append(KeyPair.generate())
+
+
+# Pool cặp khoá dùng chung cho toàn ứng dụng
+_default_keypair_pool = KeyPairPool()
+
+
+def default_keypair_pool() -> KeyPairPool:
+    """
+    Lấy pool cặp khoá dùng chung
+    Returns:
+        KeyPairPool: Pool dùng bởi KeyPair.acquire()
+    """
+    return _default_keypair_pool
+
+
 def public_key_bytes(pub: X25519PublicKey) -> bytes:
     """
     Chuyển đổi khoá công khai X25519 thành bytes
@@ -144,3 +264,658 @@ def decrypt_message(aes_key: bytes, nonce: bytes, ciphertext: bytes, aad: bytes
     """
     aesgcm = AESGCM(aes_key)
     return aesgcm.decrypt(nonce, ciphertext, aad)
+
+
+def _zeroize(buf: bytearray) -> None:
+    """Ghi đè toàn bộ buffer bằng 0 để xoá khoá khỏi bộ nhớ"""
+    for i in range(len(buf)):
+        buf[i] = 0
+
+
+class SessionKeyCache:
+    """
+    Cache khoá phiên AES theo từng đối tác (LRU có giới hạn)
+    - Khoá cache: (khoá công khai của mình, khoá công khai đối tác)
+    - Mỗi cặp chỉ tốn 1 lần ECDH + HKDF thay vì mỗi tin nhắn
+    - Khoá bị loại khỏi cache được ghi đè bằng 0; get trả về bản sao nên
+      khoá caller đang giữ không bị xoá theo
+    - Mỗi khoá có 1 NonceSequence chiều gửi dùng chung cho mọi Session tạo
+      từ khoá đó (session()), nên bộ đếm và giới hạn tin nhắn tính theo khoá
+    """
+
+    def __init__(self, max_entries: int = SESSION_CACHE_SIZE) -> None:
+        """
+        Khởi tạo cache rỗng
+        Args:
+            max_entries: Số khoá phiên tối đa được giữ lại
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries phải >= 1")
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[bytes, bytes], Tuple[bytearray, NonceSequence]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key_pair: KeyPair, peer_public_key_bytes: bytes) -> bytearray:
+        """
+        Lấy khoá AES cho cặp (key_pair, đối tác), tạo mới nếu chưa có
+        Args:
+            key_pair: Cặp khoá của mình
+            peer_public_key_bytes: Khoá công khai đối tác (32 bytes)
+        Returns:
+            bytearray: Bản sao khoá AES 256-bit thuộc về caller (caller tự xoá
+                khi không dùng nữa)
+        """
+        return self.session(key_pair, peer_public_key_bytes)[0]
+
+    def session(self, key_pair: KeyPair, peer_public_key_bytes: bytes) -> Tuple[bytearray, NonceSequence]:
+        """
+        Lấy khoá AES và bộ sinh nonce chiều gửi của khoá đó, tạo mới nếu chưa có
+        - Bit cao của prefix nonce theo thứ tự 2 khoá công khai: hai chiều
+          dùng chung khoá nhưng nonce của hai bên không bao giờ trùng nhau
+        Args:
+            key_pair: Cặp khoá của mình
+            peer_public_key_bytes: Khoá công khai đối tác (32 bytes)
+        Returns:
+            Tuple[bytearray, NonceSequence]: Bản sao khoá AES thuộc về caller và
+                bộ sinh nonce dùng chung của khoá
+        """
+        cache_key = (key_pair.public_bytes(), bytes(peer_public_key_bytes))
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                return bytearray(entry[0]), entry[1]
+
+        # ECDH + HKDF chạy ngoài lock, chỉ 1 lần cho mỗi đối tác
+        peer_public = X25519PublicKey.from_public_bytes(cache_key[1])
+        aes_key = bytearray(derive_shared_key(key_pair.private_key, peer_public))
+        prefix = bytearray(os.urandom(NONCE_PREFIX_BYTES))
+        if cache_key[0] < cache_key[1]:
+            prefix[0] |= 0x80
+        else:
+            prefix[0] &= 0x7F
+
+        with self._lock:
+            existing = self._entries.get(cache_key)
+            if existing is not None:
+                # Luồng khác đã tạo trước, bỏ bản vừa tạo
+                _zeroize(aes_key)
+                self._entries.move_to_end(cache_key)
+                return bytearray(existing[0]), existing[1]
+            nonces = NonceSequence(bytes(prefix))
+            self._entries[cache_key] = (aes_key, nonces)
+            while len(self._entries) > self.max_entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                _zeroize(evicted)
+            return bytearray(aes_key), nonces
+
+    def invalidate(self, key_pair: Optional[KeyPair] = None, peer_public_key_bytes: Optional[bytes] = None) -> None:
+        """
+        Xoá khoá phiên khỏi cache (và ghi đè bằng 0)
+        Args:
+            key_pair: Chỉ xoá khoá của cặp khoá này (None = mọi cặp khoá)
+            peer_public_key_bytes: Chỉ xoá khoá với đối tác này (None = mọi đối tác)
+        """
+        own = key_pair.public_bytes() if key_pair is not None else None
+        peer = bytes(peer_public_key_bytes) if peer_public_key_bytes is not None else None
+        with self._lock:
+            for cache_key in list(self._entries):
+                if own is not None and cache_key[0] != own:
+                    continue
+                if peer is not None and cache_key[1] != peer:
+                    continue
+                _zeroize(self._entries.pop(cache_key)[0])
+
+    def clear(self) -> None:
+        """Xoá toàn bộ cache"""
+        self.invalidate()
+
+
+class RekeyRequired(Exception):
+    """Khoá phiên đã dùng hết giới hạn tin nhắn an toàn, cần tạo khoá mới"""
+
+
+class SessionClosed(Exception):
+    """Phiên mã hoá đã đóng (khoá đã bị xoá), không dùng được nữa"""
+
+
+_NONCE_STRUCT = struct.Struct(">4sQ")  # prefix 4 bytes + bộ đếm 64-bit big-endian
+
+
+class NonceSequence:
+    """
+    Bộ sinh nonce tuần tự cho một khoá: prefix ngẫu nhiên + bộ đếm 64-bit
+    - Không gọi os.urandom cho mỗi tin nhắn (chỉ 1 lần khi tạo)
+    - Bộ đếm cũng là số thứ tự tin nhắn phía nhận có thể dùng
+    - Vượt quá giới hạn an toàn sẽ báo RekeyRequired
+    """
+
+    def __init__(self, prefix: Optional[bytes] = None, limit: int = MAX_MESSAGES_PER_KEY) -> None:
+        """
+        Khởi tạo bộ sinh nonce
+        Args:
+            prefix: Prefix 4 bytes (None = ngẫu nhiên)
+            limit: Số nonce tối đa được sinh ra với khoá này
+        """
+        if prefix is None:
+            prefix = os.urandom(NONCE_PREFIX_BYTES)
+        if len(prefix) != NONCE_PREFIX_BYTES:
+            raise ValueError(f"Prefix nonce phải dài {NONCE_PREFIX_BYTES} bytes")
+        self.prefix = bytes(prefix)
+        self.limit = limit
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    @property
+    def counter(self) -> int:
+        """Số nonce đã sinh ra (cũng là số thứ tự của tin nhắn kế tiếp)"""
+        return self._counter
+
+    @property
+    def remaining(self) -> int:
+        """Số nonce còn có thể sinh ra trước khi phải đổi khoá"""
+        return self.limit - self._counter
+
+    def next(self) -> bytes:
+        """
+        Sinh nonce kế tiếp
+        Returns:
+            bytes: Nonce 12 bytes
+        Raises:
+            RekeyRequired: Nếu đã đạt giới hạn tin nhắn cho khoá này
+        """
+        with self._lock:
+            counter = self._counter
+            if counter >= self.limit:
+                raise RekeyRequired(f"Đã dùng {counter} nonce, cần đổi khoá phiên")
+            self._counter = counter + 1
+        return _NONCE_STRUCT.pack(self.prefix, counter)
+
+
+def nonce_sequence_number(nonce: Buffer) -> int:
+    """
+    Lấy số thứ tự tin nhắn (bộ đếm) từ nonce do NonceSequence sinh ra
+    Args:
+        nonce: Nonce 12 bytes
+    Returns:
+        int: Giá trị bộ đếm 64-bit
+    """
+    return _NONCE_STRUCT.unpack(bytes(nonce))[1]
+
+
+# Cache dùng chung cho toàn ứng dụng
+_default_session_cache = SessionKeyCache()
+
+
+def get_session_key(key_pair: KeyPair, peer_public_key_bytes: bytes) -> bytearray:
+    """
+    Lấy khoá AES với đối tác từ cache dùng chung (ECDH chỉ chạy lần đầu)
+    Args:
+        key_pair: Cặp khoá của mình
+        peer_public_key_bytes: Khoá công khai đối tác (32 bytes)
+    Returns:
+        bytearray: Bản sao khoá AES 256-bit (không bị xoá khi cache loại khoá)
+    """
+    return _default_session_cache.get(key_pair, peer_public_key_bytes)
+
+
+def forget_session_keys(key_pair: KeyPair) -> None:
+    """
+    Xoá mọi khoá phiên của một cặp khoá khỏi cache dùng chung
+    Args:
+        key_pair: Cặp khoá cần xoá khoá phiên (vd: khi đóng cửa sổ)
+    """
+    _default_session_cache.invalidate(key_pair=key_pair)
+
+
+class Session:
+    """
+    Phiên mã hoá với một đối tác, giữ sẵn ngữ cảnh AES-GCM đã khởi tạo
+    - Key schedule chỉ thiết lập 1 lần khi tạo Session
+    - encrypt/decrypt nhận bytes, bytearray hoặc memoryview
+    - Có thể ghi kết quả vào buffer do caller cấp (tham số out)
+    - Nonce sinh tuần tự bằng NonceSequence thay vì os.urandom mỗi tin
+    - Sau close() mọi thao tác báo SessionClosed
+    """
+
+    def __init__(self, aes_key: Buffer, nonces: Optional[NonceSequence] = None) -> None:
+        """
+        Khởi tạo phiên với khoá AES
+        Args:
+            aes_key: Khoá AES 256-bit (vd: từ get_session_key)
+            nonces: Bộ sinh nonce cho chiều gửi (None = prefix ngẫu nhiên)
+        """
+        if len(aes_key) != AES_KEY_BYTES:
+            raise ValueError(f"Khoá AES phải dài {AES_KEY_BYTES} bytes")
+        self._key = bytearray(aes_key)
+        self._aead: Optional[AESGCM] = AESGCM(self._key)
+        # Backend mới hỗ trợ ghi trực tiếp vào buffer, backend cũ thì copy
+        self._encrypt_into = getattr(self._aead, "encrypt_into", None)
+        self._decrypt_into = getattr(self._aead, "decrypt_into", None)
+        self.nonces = nonces if nonces is not None else NonceSequence()
+
+    @classmethod
+    def for_peer(cls, key_pair: KeyPair, peer_public_key_bytes: bytes) -> "Session":
+        """
+        Tạo phiên với đối tác, khoá và bộ sinh nonce lấy từ cache khoá phiên
+        dùng chung: mọi Session với cùng đối tác dùng chung bộ đếm nonce và
+        giới hạn MAX_MESSAGES_PER_KEY của khoá
+        Args:
+            key_pair: Cặp khoá của mình
+            peer_public_key_bytes: Khoá công khai đối tác (32 bytes)
+        Returns:
+            Session: Phiên mã hoá với đối tác
+        """
+        aes_key, nonces = _default_session_cache.session(key_pair, peer_public_key_bytes)
+        try:
+            return cls(aes_key, nonces)
+        finally:
+            # Session giữ bản sao riêng, xoá bản trung gian
+            _zeroize(aes_key)
+
+    @property
+    def key(self) -> bytes:
+        """Khoá AES của phiên (dùng cho panel E2EE)"""
+        self._context()
+        return bytes(self._key)
+
+    def derive_key(self, salt: Buffer, info: bytes) -> bytes:
+        """
+        Suy ra khoá con từ khoá phiên bằng HKDF-SHA256 (khoá phiên không rời Session)
+        Args:
+            salt: Salt của HKDF (vd: header của luồng)
+            info: Nhãn mục đích của khoá con
+        Returns:
+            bytes: Khoá con AES_KEY_BYTES bytes
+        Raises:
+            SessionClosed: Nếu phiên đã đóng
+        """
+        self._context()
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=AES_KEY_BYTES, salt=bytes(salt), info=info)
+        return hkdf.derive(bytes(self._key))
+
+    def _context(self) -> AESGCM:
+        """
+        Ngữ cảnh AES-GCM của phiên
+        Raises:
+            SessionClosed: Nếu phiên đã đóng
+        """
+        aead = self._aead
+        if aead is None:
+            raise SessionClosed("Phiên mã hoá đã đóng")
+        return aead
+
+    def encrypt(self, plaintext: Buffer, aad: Optional[Buffer] = None, out: Optional[Union[bytearray, memoryview]] = None) -> Tuple[bytes, Union[bytes, memoryview]]:
+        """
+        Mã hoá tin nhắn bằng ngữ cảnh AES-GCM của phiên
+        Args:
+            plaintext: Tin nhắn gốc cần mã hoá
+            aad: Additional Authenticated Data (tùy chọn)
+            out: Buffer nhận bản mã, dài ít nhất len(plaintext) + TAG_BYTES (tùy chọn)
+        Returns:
+            Tuple: (nonce, ciphertext) - ciphertext là memoryview trên out nếu có out
+        Raises:
+            RekeyRequired: Nếu khoá đã dùng hết giới hạn tin nhắn an toàn
+            SessionClosed: Nếu phiên đã đóng
+        """
+        self._context()
+        nonce = self.nonces.next()
+        return nonce, self._seal(nonce, plaintext, aad, out)
+
+    def decrypt(self, nonce: Buffer, ciphertext: Buffer, aad: Optional[Buffer] = None, out: Optional[Union[bytearray, memoryview]] = None) -> Union[bytes, memoryview]:
+        """
+        Giải mã tin nhắn bằng ngữ cảnh AES-GCM của phiên
+        Args:
+            nonce: Nonce đã sử dụng khi mã hoá
+            ciphertext: Bản mã cần giải mã
+            aad: Additional Authenticated Data (tùy chọn)
+            out: Buffer nhận bản rõ, dài ít nhất len(ciphertext) - TAG_BYTES (tùy chọn)
+        Returns:
+            bytes | memoryview: Bản rõ (memoryview trên out nếu có out)
+        Raises:
+            InvalidTag: Nếu xác thực thất bại (tin nhắn bị sửa đổi hoặc ngắn hơn tag)
+            SessionClosed: Nếu phiên đã đóng
+        """
+        aead = self._context()
+        if out is None:
+            return aead.decrypt(nonce, ciphertext, aad)
+        size = len(ciphertext) - TAG_BYTES
+        if size < 0:
+            raise InvalidTag()
+        target = memoryview(out)[:size]
+        decrypt_into = self._decrypt_into
+        if decrypt_into is not None:
+            decrypt_into(nonce, ciphertext, aad, target)
+        else:
+            target[:] = aead.decrypt(nonce, ciphertext, aad)
+        return target
+
+    def _seal(self, nonce: Buffer, plaintext: Buffer, aad: Optional[Buffer], out: Optional[Union[bytearray, memoryview]]) -> Union[bytes, memoryview]:
+        """Mã hoá với nonce cho trước, ghi vào out nếu được cấp"""
+        aead = self._context()
+        if out is None:
+            return aead.encrypt(nonce, plaintext, aad)
+        size = len(plaintext) + TAG_BYTES
+        target = memoryview(out)[:size]
+        encrypt_into = self._encrypt_into
+        if encrypt_into is not None:
+            encrypt_into(nonce, plaintext, aad, target)
+        else:
+            target[:] = aead.encrypt(nonce, plaintext, aad)
+        return target
+
+    def close(self) -> None:
+        """Xoá khoá và bỏ ngữ cảnh AES-GCM của phiên (gọi nhiều lần không sao)"""
+        self._aead = None
+        self._encrypt_into = None
+        self._decrypt_into = None
+        _zeroize(self._key)
+
+
+@dataclass
+class BatchResult:
+    """
+    Kết quả xử lý theo lô (encrypt_many / decrypt_many)
+
+    Attributes:
+        results (list): Kết quả theo đúng thứ tự đầu vào, None nếu phần tử lỗi
+        failures (list): Danh sách (chỉ số, exception) của các phần tử lỗi
+    """
+    results: List[Any] = field(default_factory=list)
+    failures: List[Tuple[int, Exception]] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        """True nếu mọi phần tử đều thành công"""
+        return not self.failures
+
+
+def _run_batch(func: Callable[[Any], Any], items: Sequence[Any], workers: int) -> BatchResult:
+    """
+    Chạy func trên từng phần tử, lỗi của phần tử nào chỉ ghi nhận cho phần tử đó
+    - workers > 1: chia lô thành các đoạn liên tiếp chạy song song
+      (backend cryptography nhả GIL khi mã hoá/giải mã)
+    """
+    count = len(items)
+    results: List[Any] = [None] * count
+
+    def run_range(start: int, stop: int) -> List[Tuple[int, Exception]]:
+        failed: List[Tuple[int, Exception]] = []
+        for i in range(start, stop):
+            try:
+                results[i] = func(items[i])
+            except Exception as exc:  # noqa: BLE001
+                failed.append((i, exc))
+        return failed
+
+    workers = max(1, min(workers, count // BATCH_MIN_PER_WORKER or 1))
+    if workers == 1:
+        return BatchResult(results=results, failures=run_range(0, count))
+
+    step = -(-count // workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_range, start, min(start + step, count)) for start in range(0, count, step)]
+        failures = [failure for future in futures for failure in future.result()]
+    return BatchResult(results=results, failures=failures)
+
+
+def encrypt_many(session: Session, items: Sequence[Tuple[Buffer, Optional[Buffer]]], workers: int = 1) -> BatchResult:
+    """
+    Mã hoá nhiều tin nhắn trong một lần gọi (vd: gửi hàng loạt)
+    Args:
+        session: Phiên mã hoá với đối tác
+        items: Danh sách (plaintext, aad)
+        workers: Số luồng tối đa dùng để chia lô
+    Returns:
+        BatchResult: results là các (nonce, ciphertext) theo thứ tự đầu vào
+    """
+    return _run_batch(lambda item: session.encrypt(item[0], item[1]), items, workers)
+
+
+def decrypt_many(session: Session, items: Sequence[Tuple[Buffer, Buffer, Optional[Buffer]]], workers: int = 1) -> BatchResult:
+    """
+    Giải mã nhiều bản mã trong một lần gọi (vd: nhận dồn khi kết nối lại)
+    - Một bản mã sai tag không làm hỏng các bản mã còn lại
+    Args:
+        session: Phiên mã hoá với đối tác
+        items: Danh sách (nonce, ciphertext, aad)
+        workers: Số luồng tối đa dùng để chia lô
+    Returns:
+        BatchResult: results là các plaintext, lỗi nằm trong failures
+    """
+    return _run_batch(lambda item: session.decrypt(item[0], item[1], item[2]), items, workers)
+
+
+class StreamError(Exception):
+    """Luồng mã hoá không hợp lệ (bị cắt cụt, thừa đoạn hoặc thiếu header)"""
+
+
+# Nonce của mỗi đoạn: 7 bytes 0 + chỉ số đoạn 32-bit + cờ đoạn cuối
+_SEGMENT_NONCE = struct.Struct(">7xIB")
+
+
+def _stream_cipher(session: Session, header: Buffer) -> AESGCM:
+    """Tạo AES-GCM với khoá con riêng cho luồng, suy ra từ khoá phiên + header"""
+    return AESGCM(session.derive_key(header, HKDF_STREAM_INFO))
+
+
+def _iter_chunks(source: Any, chunk_size: int) -> Iterator[Buffer]:
+    """
+    Đọc dữ liệu nguồn thành từng đoạn không quá chunk_size
+    - bytes/bytearray/memoryview/mmap (buffer protocol): cắt bằng memoryview
+      từ đầu buffer, không copy (kiểm tra trước read vì mmap cũng có read)
+    - File object có readinto: đọc vào 1 buffer dùng lại (memoryview)
+    - File object chỉ có read: đọc từng đoạn từ vị trí hiện tại
+    - Iterable các đoạn bytes-like: chia nhỏ đoạn quá lớn
+    """
+    try:
+        parts: Optional[Iterable[Any]] = (memoryview(source),)
+    except TypeError:
+        parts = None
+    if parts is None and hasattr(source, "readinto"):
+        view = memoryview(bytearray(chunk_size))
+        while True:
+            n = source.readinto(view)
+            if not n:
+                return
+            yield view[:n]
+    elif parts is None and hasattr(source, "read"):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        for part in parts if parts is not None else source:
+            view = memoryview(part).cast("B")
+            for start in range(0, len(view), chunk_size):
+                yield view[start:start + chunk_size]
+
+
+def encrypt_stream(session: Session, source: Any, chunk_size: int = STREAM_CHUNK_BYTES, aad: Optional[Buffer] = None) -> Iterator[bytes]:
+    """
+    Mã hoá dữ liệu lớn (vd: tệp đính kèm) thành chuỗi đoạn có xác thực
+    - Đoạn đầu tiên là header 12 bytes (lấy từ bộ sinh nonce của phiên)
+    - Mỗi đoạn dữ liệu được mã hoá với nonce theo chỉ số đoạn
+    - Đoạn cuối rỗng mang cờ kết thúc để phát hiện bị cắt cụt
+    - Bộ nhớ dùng tối đa khoảng 1 đoạn, bất kể kích thước dữ liệu
+    Args:
+        session: Phiên mã hoá với đối tác
+        source: File object, bytes-like/mmap hoặc iterable các đoạn bytes
+        chunk_size: Kích thước tối đa mỗi đoạn bản rõ
+        aad: Additional Authenticated Data cho mọi đoạn (tùy chọn)
+    Yields:
+        bytes: Header, sau đó là các đoạn bản mã theo thứ tự
+    Raises:
+        RekeyRequired: Nếu khoá phiên đã hết nonce
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size phải > 0")
+    header = session.nonces.next()
+    aead = _stream_cipher(session, header)
+    yield header
+
+    index = 0
+    for chunk in _iter_chunks(source, chunk_size):
+        if not len(chunk):
+            continue
+        if index >= MAX_STREAM_SEGMENTS:
+            raise StreamError("Luồng vượt quá số đoạn tối đa")
+        yield aead.encrypt(_SEGMENT_NONCE.pack(index, 0), chunk, aad)
+        index += 1
+    yield aead.encrypt(_SEGMENT_NONCE.pack(index, 1), b"", aad)
+
+
+def decrypt_stream(session: Session, segments: Iterable[Buffer], aad: Optional[Buffer] = None) -> Iterator[bytes]:
+    """
+    Giải mã chuỗi đoạn do encrypt_stream tạo ra (đối xứng với encrypt_stream)
+    Args:
+        session: Phiên mã hoá với đối tác
+        segments: Iterable các đoạn: header rồi đến các đoạn bản mã
+        aad: Additional Authenticated Data đã dùng khi mã hoá
+    Yields:
+        bytes: Bản rõ của từng đoạn theo thứ tự
+    Raises:
+        InvalidTag: Nếu một đoạn bị sửa đổi hoặc sai thứ tự
+        StreamError: Nếu luồng bị cắt cụt hoặc có dữ liệu sau đoạn cuối
+    """
+    it = iter(segments)
+    header = next(it, None)
+    if header is None or len(header) != NONCE_BYTES:
+        raise StreamError("Thiếu header của luồng")
+    aead = _stream_cipher(session, header)
+
+    index = 0
+    finished = False
+    for segment in it:
+        if finished:
+            raise StreamError("Có dữ liệu sau đoạn cuối của luồng")
+        if len(segment) == TAG_BYTES:
+            # Đoạn rỗng chỉ có tag: đoạn kết thúc
+            aead.decrypt(_SEGMENT_NONCE.pack(index, 1), segment, aad)
+            finished = True
+            continue
+        yield aead.decrypt(_SEGMENT_NONCE.pack(index, 0), segment, aad)
+        index += 1
+    if not finished:
+        raise StreamError("Luồng bị cắt cụt (thiếu đoạn kết thúc)")
+
+
+class SenderKey:
+    """
+    Sender key cho chat nhóm: mã hoá 1 lần, gửi cho N thành viên
+    - Người gửi tạo khoá nhóm ngẫu nhiên và gửi cho từng thành viên 1 lần
+      qua kênh X25519 từng cặp (seal_for / open)
+    - Sau đó mỗi tin nhắn chỉ mã hoá 1 lần (AAD = group_id), chi phí O(1)
+    - Nonce tuần tự như Session; hết giới hạn thì tạo SenderKey mới
+    - Khoá nhóm là khoá đối xứng mọi thành viên cùng giữ, nên mỗi bản mã còn
+      được người gửi ký Ed25519 (nonce || bản mã AES-GCM); khoá công khai
+      Ed25519 đi kèm gói phân phối. Thành viên khác giữ khoá nhóm vẫn không
+      giả mạo được tin của người gửi
+    """
+
+    def __init__(self, group_id: bytes, chain_key: Buffer, verify_key: Union[Ed25519PublicKey, bytes], signing_key: Optional[Ed25519PrivateKey] = None) -> None:
+        """
+        Khởi tạo sender key
+        Args:
+            group_id: ID của nhóm (GROUP_ID_BYTES bytes)
+            chain_key: Khoá nhóm 256-bit
+            verify_key: Khoá công khai Ed25519 của người gửi
+            signing_key: Khoá ký Ed25519 (chỉ phía người gửi, None = chỉ giải mã)
+        """
+        if len(group_id) != GROUP_ID_BYTES:
+            raise ValueError(f"group_id phải dài {GROUP_ID_BYTES} bytes")
+        self.group_id = bytes(group_id)
+        self.session = Session(chain_key)
+        if not isinstance(verify_key, Ed25519PublicKey):
+            verify_key = Ed25519PublicKey.from_public_bytes(bytes(verify_key))
+        self.verify_key = verify_key
+        self._signing_key = signing_key
+
+    @classmethod
+    def generate(cls, group_id: Optional[bytes] = None) -> "SenderKey":
+        """
+        Tạo sender key mới với khoá nhóm và khoá ký ngẫu nhiên
+        Args:
+            group_id: ID nhóm (None = tạo ngẫu nhiên)
+        Returns:
+            SenderKey: Sender key mới (có khoá ký)
+        """
+        if group_id is None:
+            group_id = os.urandom(GROUP_ID_BYTES)
+        signing_key = Ed25519PrivateKey.generate()
+        return cls(group_id, AESGCM.generate_key(bit_length=AES_KEY_BYTES * 8), signing_key.public_key(), signing_key)
+
+    def seal_for(self, pairwise: Session) -> Tuple[bytes, bytes]:
+        """
+        Đóng gói sender key để gửi cho 1 thành viên qua phiên từng cặp
+        Args:
+            pairwise: Session X25519 với thành viên đó
+        Returns:
+            Tuple[bytes, bytes]: (nonce, ciphertext) chứa group_id + khoá nhóm
+                + khoá công khai Ed25519 của người gửi
+        """
+        verify_key = self.verify_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+        return pairwise.encrypt(self.group_id + self.session.key + verify_key, SENDER_KEY_AAD)
+
+    @classmethod
+    def open(cls, pairwise: Session, nonce: Buffer, ciphertext: Buffer) -> "SenderKey":
+        """
+        Mở sender key nhận được từ người gửi
+        Args:
+            pairwise: Session X25519 với người gửi
+            nonce: Nonce của gói phân phối
+            ciphertext: Bản mã của gói phân phối
+        Returns:
+            SenderKey: Sender key chỉ dùng để giải mã tin nhắn nhóm của người gửi
+        Raises:
+            InvalidTag: Nếu gói phân phối bị sửa đổi
+            ValueError: Nếu gói phân phối sai độ dài
+        """
+        payload = pairwise.decrypt(nonce, ciphertext, SENDER_KEY_AAD)
+        if len(payload) != GROUP_ID_BYTES + AES_KEY_BYTES + SIGNING_KEY_BYTES:
+            raise ValueError("Gói sender key không hợp lệ")
+        key_end = GROUP_ID_BYTES + AES_KEY_BYTES
+        return cls(bytes(payload[:GROUP_ID_BYTES]), payload[GROUP_ID_BYTES:key_end], bytes(payload[key_end:]))
+
+    def encrypt(self, plaintext: Buffer) -> Tuple[bytes, bytes]:
+        """
+        Mã hoá và ký tin nhắn nhóm (1 lần cho mọi thành viên)
+        Args:
+            plaintext: Tin nhắn gốc
+        Returns:
+            Tuple[bytes, bytes]: (nonce, bản mã AES-GCM + chữ ký SIGNATURE_BYTES bytes)
+        Raises:
+            RekeyRequired: Nếu sender key đã hết nonce
+            ValueError: Nếu sender key không có khoá ký (nhận qua open)
+        """
+        if self._signing_key is None:
+            raise ValueError("Chỉ người gửi (có khoá ký) mới mã hoá được bằng sender key")
+        nonce, ciphertext = self.session.encrypt(plaintext, self.group_id)
+        return nonce, ciphertext + self._signing_key.sign(nonce + ciphertext)
+
+    def decrypt(self, nonce: Buffer, ciphertext: Buffer) -> bytes:
+        """
+        Kiểm tra chữ ký người gửi rồi giải mã tin nhắn nhóm
+        Args:
+            nonce: Nonce của tin nhắn
+            ciphertext: Bản mã kèm chữ ký (kết quả của encrypt)
+        Returns:
+            bytes: Tin nhắn gốc
+        Raises:
+            InvalidTag: Nếu chữ ký sai hoặc xác thực AES-GCM thất bại
+        """
+        body = bytes(ciphertext[:-SIGNATURE_BYTES])
+        try:
+            self.verify_key.verify(bytes(ciphertext[-SIGNATURE_BYTES:]), bytes(nonce) + body)
+        except InvalidSignature:
+            raise InvalidTag() from None
+        return self.session.decrypt(nonce, body, self.group_id)
+
+    def close(self) -> None:
+        """Xoá khoá nhóm khỏi bộ nhớ và bỏ khoá ký"""
+        self._signing_key = None
+        self.session.close()
@@ -0,0 +1,233 @@
+"""
+Bộ thực thi tác vụ mã hoá ngoài luồng giao diện (GUI thread).
+
+Cung cấp:
+- Thread pool chạy trao đổi khoá, mã hoá, giải mã (backend cryptography nhả GIL)
+- Process pool tùy chọn cho tác vụ nặng (hàm và tham số phải pickle được)
+- Trả kết quả về luồng GUI qua Qt signal
+- Giữ thứ tự kết quả trong cùng một "lane" (vd: mỗi cửa sổ chat)
+- Thống kê độ dài hàng đợi và độ trễ tác vụ
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Hashable, Optional
+import os
+import sys
+import threading
+import time
+
+from PySide6 import QtCore
+
+LATENCY_SAMPLES = 512  # Số mẫu độ trễ gần nhất giữ lại để thống kê
+
+
+@dataclass
+class ExecutorStats:
+    """
+    Thống kê của CryptoExecutor
+
+    Attributes:
+        queue_depth (int): Số tác vụ đã gửi nhưng chưa trả kết quả về GUI
+        submitted (int): Tổng số tác vụ đã gửi
+        completed (int): Tổng số tác vụ thành công
+        failed (int): Tổng số tác vụ lỗi
+        latency_avg_ms (float): Độ trễ trung bình (gửi → kết quả tới GUI)
+        latency_p50_ms (float): Độ trễ trung vị
+        latency_p99_ms (float): Độ trễ phân vị 99
+        latency_max_ms (float): Độ trễ lớn nhất trong các mẫu gần nhất
+    """
+    queue_depth: int
+    submitted: int
+    completed: int
+    failed: int
+    latency_avg_ms: float
+    latency_p50_ms: float
+    latency_p99_ms: float
+    latency_max_ms: float
+
+
+@dataclass
+class _Task:
+    """Tác vụ đang chờ kết quả"""
+    lane: Optional[Hashable]
+    seq: int
+    submitted_at: float
+    on_done: Optional[Callable[[Any], None]]
+    on_error: Optional[Callable[[BaseException], None]]
+    result: Any = None
+    error: Optional[BaseException] = None
+
+
+class CryptoExecutor(QtCore.QObject):
+    """
+    Thực thi tác vụ mã hoá trên thread pool, kết quả trả về GUI thread
+    - submit(): gửi tác vụ, callback on_done/on_error chạy trên GUI thread
+    - Cùng lane: callback được gọi đúng thứ tự submit
+    - Singleton dùng chung cho mọi cửa sổ chat (instance())
+    """
+    _instance: Optional["CryptoExecutor"] = None
+
+    # Tín hiệu nội bộ: worker thread → GUI thread (queued connection)
+    _task_finished = QtCore.Signal(object)
+
+    def __init__(self, max_workers: Optional[int] = None, use_processes: bool = False, parent: Optional[QtCore.QObject] = None) -> None:
+        """
+        Khởi tạo executor
+        Args:
+            max_workers: Số luồng tối đa (None = theo số CPU)
+            use_processes: Tạo thêm process pool cho tác vụ submit(process=True)
+            parent: QObject cha
+        """
+        super().__init__(parent)
+        workers = max_workers or min(8, (os.cpu_count() or 1) + 1)
+        self._threads = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crypto")
+        self._processes: Optional[Executor] = ProcessPoolExecutor() if use_processes else None
+        self._task_finished.connect(self._deliver)
+
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._pending = 0
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        # Mỗi lane: số thứ tự kế tiếp được phép trả về và các kết quả đến sớm
+        self._lane_next: Dict[Hashable, int] = {}
+        self._lane_seq: Dict[Hashable, int] = {}
+        self._lane_ready: Dict[Hashable, Dict[int, _Task]] = {}
+
+    @classmethod
+    def instance(cls) -> "CryptoExecutor":
+        """
+        Lấy executor dùng chung (tạo trên GUI thread ở lần gọi đầu)
+        Returns:
+            CryptoExecutor: Executor dùng chung
+        """
+        if cls._instance is None:
+            cls._instance = CryptoExecutor()
+        return cls._instance
+
+    def submit(
+        self,
+        fn: Callable[..., Any],
+        *args: Any,
+        lane: Optional[Hashable] = None,
+        on_done: Optional[Callable[[Any], None]] = None,
+        on_error: Optional[Callable[[BaseException], None]] = None,
+        process: bool = False,
+    ) -> None:
+        """
+        Gửi tác vụ chạy ngoài GUI thread
+        Args:
+            fn: Hàm cần chạy
+            *args: Tham số của fn
+            lane: Khoá giữ thứ tự kết quả (None = không cần thứ tự)
+            on_done: Callback nhận kết quả (chạy trên GUI thread)
+            on_error: Callback nhận exception (chạy trên GUI thread)
+            process: Chạy trên process pool (cần use_processes=True)
+        """
+        pool: Executor = self._threads
+        if process:
+            if self._processes is None:
+                raise RuntimeError("Executor không được tạo với use_processes=True")
+            pool = self._processes
+
+        with self._lock:
+            seq = 0
+            if lane is not None:
+                seq = self._lane_seq.get(lane, 0)
+                self._lane_seq[lane] = seq + 1
+            self._submitted += 1
+            self._pending += 1
+        task = _Task(lane=lane, seq=seq, submitted_at=time.perf_counter(), on_done=on_done, on_error=on_error)
+
+        def finished(future: Future) -> None:
+            # Chạy trên worker thread: chỉ lưu kết quả và phát signal
+            try:
+                task.result = future.result()
+            except BaseException as exc:  # noqa: BLE001
+                task.error = exc
+            self._task_finished.emit(task)
+
+        pool.submit(fn, *args).add_done_callback(finished)
+
+    def _deliver(self, task: _Task) -> None:
+        """Nhận kết quả trên GUI thread, gọi callback theo thứ tự lane"""
+        if task.lane is None:
+            self._finish(task)
+            return
+        ready = self._lane_ready.setdefault(task.lane, {})
+        ready[task.seq] = task
+        next_seq = self._lane_next.get(task.lane, 0)
+        while next_seq in ready:
+            self._finish(ready.pop(next_seq))
+            next_seq += 1
+        if not ready:
+            self._lane_ready.pop(task.lane, None)
+        with self._lock:
+            if self._lane_seq.get(task.lane) == next_seq:
+                # Lane không còn tác vụ đang chạy: xoá để lane dùng 1 lần (vd: mỗi
+                # cửa sổ chat đã đóng) không tích tụ, submit sau bắt đầu lại từ 0
+                del self._lane_seq[task.lane]
+                self._lane_next.pop(task.lane, None)
+            else:
+                self._lane_next[task.lane] = next_seq
+
+    def _finish(self, task: _Task) -> None:
+        """Cập nhật thống kê và gọi callback của tác vụ (exception của callback được báo qua sys.excepthook)"""
+        with self._lock:
+            self._pending -= 1
+            self._latencies.append(time.perf_counter() - task.submitted_at)
+            if task.error is None:
+                self._completed += 1
+            else:
+                self._failed += 1
+        try:
+            if task.error is None:
+                if task.on_done is not None:
+                    task.on_done(task.result)
+            elif task.on_error is not None:
+                task.on_error(task.error)
+        except Exception:  # noqa: BLE001
+            # Lỗi của callback không được làm kẹt lane: báo như slot Qt lỗi
+            # rồi tiếp tục giao các kết quả kế tiếp
+            sys.excepthook(*sys.exc_info())
+
+    def stats(self) -> ExecutorStats:
+        """
+        Lấy thống kê hiện tại
+        Returns:
+            ExecutorStats: Độ dài hàng đợi, số tác vụ và độ trễ (ms)
+        """
+        with self._lock:
+            samples = sorted(self._latencies)
+            pending, submitted, completed, failed = self._pending, self._submitted, self._completed, self._failed
+
+        def pct(p: float) -> float:
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000.0
+
+        return ExecutorStats(
+            queue_depth=pending,
+            submitted=submitted,
+            completed=completed,
+            failed=failed,
+            latency_avg_ms=(sum(samples) / len(samples) * 1000.0) if samples else 0.0,
+            latency_p50_ms=pct(0.50),
+            latency_p99_ms=pct(0.99),
+            latency_max_ms=(samples[-1] * 1000.0) if samples else 0.0,
+        )
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Dừng các pool
+        Args:
+            wait: Chờ các tác vụ đang chạy hoàn tất
+        """
+        self._threads.shutdown(wait=wait)
+        if self._processes is not None:
+            self._processes.shutdown(wait=wait)
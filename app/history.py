@@ -0,0 +1,502 @@
+"""
+Kho lưu lịch sử chat theo từng danh tính (SQLite, chế độ WAL).
+
+Mỗi danh tính có 1 file <tên>.db trong thư mục data:
+- Mỗi tin nhắn được ghi ngay khi gửi/nhận, không đợi tới lúc đóng cửa sổ;
+  process bị dừng đột ngột chỉ mất các tin chưa kịp commit (vài ms cuối)
+- Ghi theo group commit: append() chỉ xếp tin vào hàng đợi rồi trả về,
+  luồng ghi nền gom các tin tới trong GROUP_COMMIT_WINDOW thành 1 transaction
+- ID tin nhắn tăng dần, được cấp ngay khi append() (trước khi ghi xuống đĩa)
+- Đọc theo trang trên khoá chính id (latest/before/after): mở kho và tải
+  N tin mới nhất tốn thời gian như nhau dù lịch sử dài bao nhiêu; các hàm
+  đọc gọi được từ luồng nền
+- File HTML chỉ còn là bản xuất xem bằng trình duyệt (export_html); file
+  <tên>.html cũ (bản xuất có khối JSON hoặc bản QTextBrowser.toHtml) được
+  chuyển vào kho ở lần mở đầu tiên
+
+Sử dụng:
+    python -m app.history data/alice.db -o alice.html
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import html as py_html
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+STORE_SUFFIX = ".db"  # Phần mở rộng file kho lịch sử
+EXPORT_SUFFIX = ".html"  # Phần mở rộng file HTML (bản xuất hoặc lịch sử cũ)
+GROUP_COMMIT_WINDOW = 0.005  # Thời gian luồng ghi chờ gom thêm tin trước khi commit (giây)
+WRITE_ATTEMPTS = 3  # Số lần thử ghi 1 lô trước khi bỏ lô (đĩa đầy, file bị khoá...)
+WRITE_RETRY_DELAY = 0.2  # Thời gian chờ giữa 2 lần thử ghi (giây)
+# Khối JSON chứa tin nhắn dạng cấu trúc trong file HTML xuất ra
+HISTORY_JSON_ID = "e2ee-history"
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS messages ("
+    " id INTEGER PRIMARY KEY,"
+    " sender TEXT NOT NULL,"
+    " body TEXT NOT NULL,"
+    " outgoing INTEGER NOT NULL,"
+    " timestamp TEXT NOT NULL)"
+)
+_INSERT = "INSERT OR REPLACE INTO messages (id, sender, body, outgoing, timestamp) VALUES (?, ?, ?, ?, ?)"
+_SELECT = "SELECT id, sender, body, outgoing, timestamp FROM messages"
+
+_Row = Tuple[int, str, str, int, str]
+
+
+class HistoryWriteError(Exception):
+    """Lỗi khi tin nhắn đã append không ghi được vào kho"""
+
+
+# Bảng style dùng chung của file HTML xuất ra: mỗi bubble chỉ mang class
+EXPORT_STYLESHEET = (
+    "body{background:#f0f2f5;color:#1c1e21;font-family:'Segoe UI','Helvetica Neue',Arial,sans-serif}"
+    ".msg{display:flex;margin:2px 0;padding:0 12px}"
+    ".msg.out{justify-content:flex-end}"
+    ".msg.in{justify-content:flex-start}"
+    ".bubble{max-width:70%;padding:10px 14px;font-size:14px;line-height:1.4;box-shadow:0 1px 2px rgba(0,0,0,0.1)}"
+    ".out .bubble{background:#0084ff;color:#ffffff;border-radius:18px 18px 4px 18px}"
+    ".in .bubble{background:#e4e6ea;color:#1c1e21;border-radius:18px 18px 18px 4px}"
+    ".text{white-space:pre-wrap;margin-bottom:4px}"
+    ".time{text-align:right;font-size:11px;opacity:.7;margin-top:4px;font-weight:normal}"
+)
+# Template bubble dựng sẵn theo chiều tin (True = tin gửi đi): tin gửi màu xanh
+# căn phải, tin nhận màu xám căn trái (style nằm trong EXPORT_STYLESHEET).
+# Cắt sẵn thành các đoạn cố định quanh chỗ điền nhãn, nội dung và thời gian.
+_BUBBLE_HTML = (
+    '<div class="msg %s"><div class="bubble" title="{}">'
+    '<div class="text">{}</div><div class="time">{}</div></div></div>'
+)
+_BUBBLE_PARTS = {True: tuple((_BUBBLE_HTML % "out").split("{}")), False: tuple((_BUBBLE_HTML % "in").split("{}"))}
+SENDER_LABEL_CACHE = 1024  # Số nhãn người gửi đã escape được giữ lại
+
+_sender_labels: Dict[str, str] = {}
+_timestamp_cache: Tuple[int, str] = (-1, "")  # (phút epoch, chuỗi đã định dạng)
+
+
+def _format_timestamp() -> str:
+    """Định dạng thời gian hiện tại theo dd/MM/yyyy HH:mm (chỉ định dạng lại khi sang phút mới)"""
+    global _timestamp_cache
+    minute = int(time.time() // 60)
+    cached_minute, text = _timestamp_cache
+    if minute != cached_minute:
+        text = datetime.datetime.fromtimestamp(minute * 60).strftime("%d/%m/%Y %H:%M")
+        _timestamp_cache = (minute, text)
+    return text
+
+
+def _escape_sender(sender: str) -> str:
+    """Escape nhãn người gửi (mỗi đối tác chỉ escape 1 lần)"""
+    label = _sender_labels.get(sender)
+    if label is None:
+        if len(_sender_labels) >= SENDER_LABEL_CACHE:
+            _sender_labels.clear()
+        label = _sender_labels[sender] = py_html.escape(sender)
+    return label
+
+
+def _format_bubble(sender: str, text: str, outgoing: bool, timestamp: Optional[str] = None) -> str:
+    """
+    Tạo HTML cho bubble tin nhắn theo style Messenger từ template dựng sẵn
+    - Style lấy từ class trong EXPORT_STYLESHEET
+    - Nhãn người gửi nằm ở tooltip (title) của bubble
+    """
+    head, body, time_tag, tail = _BUBBLE_PARTS[outgoing]
+    # Nội dung nằm trong thẻ (không trong thuộc tính) nên chỉ cần escape & < >
+    safe_text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return f"{head}{_escape_sender(sender)}{body}{safe_text}{time_tag}{timestamp or _format_timestamp()}{tail}"
+
+
+@dataclass(eq=False)
+class ChatMessage:
+    """
+    Một tin nhắn trong khung chat
+
+    Attributes:
+        sender (str): Nhãn người gửi (vd: "Bạn → Bob")
+        text (str): Nội dung đã giải mã
+        outgoing (bool): True nếu là tin gửi đi
+        timestamp (str): Thời gian dạng dd/MM/yyyy HH:mm
+        id (int): ID trong kho lịch sử (0 = chưa lưu)
+    """
+    sender: str
+    text: str
+    outgoing: bool
+    timestamp: str
+    id: int = 0
+
+
+def _export_history_html(messages: List[ChatMessage]) -> str:
+    """
+    Xuất lịch sử chat ra HTML xem được bằng trình duyệt
+    - Mỗi tin nhắn là 1 bubble (_format_bubble)
+    - Kèm khối JSON (HISTORY_JSON_ID) để đọc lại tin nhắn dạng cấu trúc
+    """
+    data = json.dumps(
+        [{"sender": m.sender, "text": m.text, "outgoing": m.outgoing, "timestamp": m.timestamp} for m in messages],
+        ensure_ascii=False,
+    ).replace("</", "<\\/")
+    bubbles = "\n".join(_format_bubble(m.sender, m.text, m.outgoing, m.timestamp) for m in messages)
+    return (
+        f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><style>{EXPORT_STYLESHEET}</style></head><body>\n"
+        f"{bubbles}\n"
+        f"<script type=\"application/json\" id=\"{HISTORY_JSON_ID}\">{data}</script>\n"
+        "</body></html>\n"
+    )
+
+
+_HISTORY_JSON_RE = re.compile(r'<script type="application/json" id="%s">(.*?)</script>' % HISTORY_JSON_ID, re.S)
+_LEGACY_PARAGRAPH_RE = re.compile(r"<p[^>]*>(.*?)</p>", re.S)
+_LEGACY_SPAN_RE = re.compile(r'<span style="([^"]*)">(.*?)</span>', re.S)
+
+
+def _parse_history_html(html_content: str) -> List[ChatMessage]:
+    """
+    Đọc lại tin nhắn từ file HTML lịch sử
+    - File mới: đọc khối JSON
+    - File cũ (QTextBrowser.toHtml): mỗi đoạn 14px là 1 dòng nội dung, đoạn
+      11px là thời gian kết thúc 1 tin nhắn; chữ trắng là tin gửi đi
+    """
+    match = _HISTORY_JSON_RE.search(html_content)
+    if match is not None:
+        try:
+            items = json.loads(match.group(1))
+            return [ChatMessage(str(i["sender"]), str(i["text"]), bool(i["outgoing"]), str(i["timestamp"])) for i in items]
+        except (ValueError, KeyError, TypeError):
+            return []
+    messages: List[ChatMessage] = []
+    lines: List[str] = []
+    outgoing = False
+    for paragraph in _LEGACY_PARAGRAPH_RE.findall(html_content):
+        spans = _LEGACY_SPAN_RE.findall(paragraph)
+        if not spans:
+            continue
+        text = py_html.unescape(re.sub(r"<br\s*/?>", "\n", "".join(body for _, body in spans))).rstrip(" ")
+        if "font-size:11px" in spans[0][0]:
+            if lines:
+                messages.append(ChatMessage("", "\n".join(lines), outgoing, text))
+            lines = []
+            continue
+        if not lines:
+            outgoing = "color:#ffffff" in spans[0][0]
+        lines.append(text)
+    return messages
+
+
+def _message_from_row(row: _Row) -> ChatMessage:
+    """Chuyển 1 dòng của bảng messages thành ChatMessage"""
+    return ChatMessage(row[1], row[2], bool(row[3]), row[4], row[0])
+
+
+def list_histories(directory: str) -> List[str]:
+    """
+    Liệt kê các danh tính có lịch sử trong thư mục
+    - Kho <tên>.db và file <tên>.html cũ chưa chuyển vào kho
+    Args:
+        directory: Thư mục data
+    Returns:
+        List[str]: Tên file (không có phần mở rộng), đã sắp xếp
+    """
+    if not os.path.isdir(directory):
+        return []
+    names = set()
+    for filename in os.listdir(directory):
+        stem, ext = os.path.splitext(filename)
+        if ext in (STORE_SUFFIX, EXPORT_SUFFIX) and stem:
+            names.add(stem)
+    return sorted(names)
+
+
+class MessageStore:
+    """
+    Kho tin nhắn SQLite (WAL) của 1 danh tính
+    - append(): xếp tin vào hàng đợi ghi, trả về ngay
+    - flush(): chờ mọi tin đã append được commit (HistoryWriteError nếu có tin bị mất)
+    - latest()/before()/after(): đọc 1 trang tin (từ bất kỳ luồng nào)
+    - messages()/count(): đọc toàn bộ tin đã commit
+    - export_html(): xuất bản HTML xem bằng trình duyệt
+    - close(): ghi nốt hàng đợi rồi đóng kho
+    """
+
+    def __init__(
+        self,
+        path: str,
+        legacy_html: Optional[str] = None,
+        commit_window: float = GROUP_COMMIT_WINDOW,
+        on_error: Optional[Callable[[HistoryWriteError], None]] = None,
+    ) -> None:
+        """
+        Mở (hoặc tạo) kho lịch sử
+        Args:
+            path: Đường dẫn file .db
+            legacy_html: File HTML lịch sử cũ, được chuyển vào kho nếu kho mới tạo
+            commit_window: Thời gian gom tin trước mỗi commit (giây)
+            on_error: Callback khi 1 lô tin bị bỏ sau WRITE_ATTEMPTS lần ghi lỗi
+                (gọi trên luồng ghi)
+        """
+        self.path = path
+        self.commit_window = commit_window
+        self.on_error = on_error
+        self._lock = threading.Lock()
+        self._committed_cond = threading.Condition(self._lock)
+        self._pending: List[_Row] = []
+        self._submitted = 0  # Số tin đã append
+        self._committed = 0  # Số tin đã commit (hoặc bị bỏ do lỗi ghi)
+        self._flushed = 0  # Số tin flush() đã báo kết quả
+        self._lost: List[Tuple[int, int]] = []  # Các khoảng (đầu, cuối] số thứ tự tin bị bỏ do lỗi ghi
+        self._wake = threading.Event()
+        self._stop = False
+        self.last_error: Optional[sqlite3.Error] = None
+        # Kết nối đọc dùng chung cho mọi luồng, tuần tự hoá bằng _read_lock
+        self._read_lock = threading.Lock()
+
+        created = not os.path.exists(path)
+        self._db = self._connect(check_same_thread=False)
+        self._db.execute(_SCHEMA)
+        self._db.commit()
+        if created and legacy_html and os.path.exists(legacy_html):
+            self._migrate(legacy_html)
+        self._next_id = (self._db.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0) + 1
+
+        self._thread = threading.Thread(target=self._writer_loop, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        """Mở 1 kết nối tới kho (WAL, fsync khi checkpoint)"""
+        db = sqlite3.connect(self.path, check_same_thread=check_same_thread)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _migrate(self, legacy_html: str) -> None:
+        """Chép tin nhắn từ file HTML lịch sử cũ vào kho (file cũ giữ nguyên)"""
+        try:
+            with open(legacy_html, "r", encoding="utf-8") as f:
+                messages = _parse_history_html(f.read())
+        except (OSError, UnicodeDecodeError):
+            return
+        with self._db:
+            self._db.executemany(
+                _INSERT,
+                ((i, m.sender, m.text, int(m.outgoing), m.timestamp) for i, m in enumerate(messages, 1)),
+            )
+
+    # ------------------------------------------------------------------
+    # Ghi
+    # ------------------------------------------------------------------
+
+    def append(self, message: ChatMessage) -> ChatMessage:
+        """
+        Lưu tin nhắn (ghi bất đồng bộ theo group commit)
+        Args:
+            message: Tin nhắn cần lưu, được gán id mới
+        Returns:
+            ChatMessage: Chính message
+        """
+        with self._lock:
+            if self._stop:
+                raise RuntimeError("Kho lịch sử đã đóng")
+            message.id = self._next_id
+            self._next_id += 1
+            self._pending.append((message.id, message.sender, message.text, int(message.outgoing), message.timestamp))
+            self._submitted += 1
+        self._wake.set()
+        return message
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Chờ mọi tin đã append được commit
+        Args:
+            timeout: Thời gian chờ tối đa (giây, None = chờ mãi)
+        Returns:
+            bool: True nếu đã commit hết, False nếu hết thời gian chờ
+        Raises:
+            HistoryWriteError: Nếu có tin append từ lần flush trước tới nay bị bỏ do lỗi ghi
+        """
+        with self._committed_cond:
+            start, target = self._flushed, self._submitted
+            if not self._wait_committed(target, timeout):
+                return False
+            self._flushed = max(self._flushed, target)
+            lost = sum(min(end, target) - max(begin, start) for begin, end in self._lost if begin < target and end > start)
+        if lost:
+            raise HistoryWriteError(f"{lost} tin nhắn không ghi được vào kho: {self.last_error}")
+        return True
+
+    def _wait_committed(self, target: int, timeout: Optional[float] = None) -> bool:
+        """Chờ luồng ghi xử lý xong target tin đầu tiên (gọi khi giữ _committed_cond)"""
+        return self._committed_cond.wait_for(lambda: self._committed >= target, timeout)
+
+    def _drain(self) -> None:
+        """Chờ ghi nốt hàng đợi trước khi đọc (tin bị mất đã được báo qua flush/on_error)"""
+        with self._committed_cond:
+            self._wait_committed(self._submitted)
+
+    def _writer_loop(self) -> None:
+        """Luồng ghi: mỗi vòng gom các tin đang chờ thành 1 transaction"""
+        db = self._connect()
+        try:
+            while True:
+                self._wake.wait()
+                if self.commit_window and not self._stop:
+                    # Chờ thêm 1 chút để các tin tới liền nhau chung 1 commit
+                    time.sleep(self.commit_window)
+                with self._lock:
+                    self._wake.clear()
+                    batch, self._pending = self._pending, []
+                    stop = self._stop
+                if batch:
+                    written = self._write_batch(db, batch)
+                    with self._committed_cond:
+                        if not written:
+                            self._lost.append((self._committed, self._committed + len(batch)))
+                        self._committed += len(batch)
+                        self._committed_cond.notify_all()
+                    if not written and self.on_error is not None:
+                        try:
+                            self.on_error(HistoryWriteError(f"{len(batch)} tin nhắn không ghi được vào kho: {self.last_error}"))
+                        except Exception:  # noqa: BLE001
+                            # Lỗi của callback không được làm dừng luồng ghi
+                            pass
+                if stop:
+                    with self._lock:
+                        if not self._pending:
+                            break
+        finally:
+            db.close()
+
+    def _write_batch(self, db: sqlite3.Connection, batch: List[_Row]) -> bool:
+        """
+        Ghi 1 lô trong 1 transaction, thử lại tối đa WRITE_ATTEMPTS lần
+        Returns:
+            bool: False nếu mọi lần thử đều lỗi (lỗi cuối ở last_error)
+        """
+        for attempt in range(WRITE_ATTEMPTS):
+            if attempt:
+                time.sleep(WRITE_RETRY_DELAY)
+            try:
+                with db:
+                    db.executemany(_INSERT, batch)
+                return True
+            except sqlite3.Error as exc:
+                self.last_error = exc
+        return False
+
+    # ------------------------------------------------------------------
+    # Đọc
+    # ------------------------------------------------------------------
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[ChatMessage]:
+        """Chạy câu SELECT trên kết nối đọc"""
+        with self._read_lock:
+            return [_message_from_row(row) for row in self._db.execute(sql, params)]
+
+    def latest(self, limit: int) -> List[ChatMessage]:
+        """
+        Trang tin mới nhất (chỉ gồm tin đã commit)
+        Args:
+            limit: Số tin tối đa
+        Returns:
+            List[ChatMessage]: Tin theo thứ tự gửi/nhận
+        """
+        page = self._query(_SELECT + " ORDER BY id DESC LIMIT ?", (limit,))
+        page.reverse()
+        return page
+
+    def before(self, message_id: int, limit: int) -> List[ChatMessage]:
+        """
+        Trang tin ngay trước message_id (ghi nốt hàng đợi trước khi đọc)
+        Args:
+            message_id: ID tin cũ nhất đang có
+            limit: Số tin tối đa
+        Returns:
+            List[ChatMessage]: Tin theo thứ tự gửi/nhận (rỗng = hết tin cũ)
+        """
+        self._drain()
+        page = self._query(_SELECT + " WHERE id < ? ORDER BY id DESC LIMIT ?", (message_id, limit))
+        page.reverse()
+        return page
+
+    def after(self, message_id: int, limit: int) -> List[ChatMessage]:
+        """
+        Trang tin ngay sau message_id (ghi nốt hàng đợi trước khi đọc)
+        Args:
+            message_id: ID tin mới nhất đang có
+            limit: Số tin tối đa
+        Returns:
+            List[ChatMessage]: Tin theo thứ tự gửi/nhận (rỗng = hết tin mới)
+        """
+        self._drain()
+        return self._query(_SELECT + " WHERE id > ? ORDER BY id LIMIT ?", (message_id, limit))
+
+    def count(self) -> int:
+        """Số tin nhắn đã commit"""
+        with self._read_lock:
+            return self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def messages(self) -> List[ChatMessage]:
+        """Mọi tin nhắn đã commit, theo thứ tự gửi/nhận"""
+        return self._query(_SELECT + " ORDER BY id")
+
+    def export_html(self, path: str) -> int:
+        """
+        Xuất toàn bộ lịch sử ra file HTML (ghi nốt hàng đợi trước)
+        Args:
+            path: File HTML đích
+        Returns:
+            int: Số tin nhắn đã xuất
+        """
+        self._drain()
+        messages = self.messages()
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(_export_history_html(messages))
+        os.replace(tmp, path)
+        return len(messages)
+
+    def close(self) -> None:
+        """Ghi nốt các tin đang chờ, dừng luồng ghi và đóng kho"""
+        with self._lock:
+            if self._stop:
+                return
+            self._stop = True
+        self._wake.set()
+        self._thread.join()
+        with self._read_lock:
+            self._db.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Xuất kho lịch sử ra HTML
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(description="Xuất kho lịch sử chat (.db) ra file HTML")
+    parser.add_argument("store", help="File kho lịch sử (data/<tên>.db)")
+    parser.add_argument("-o", "--output", help="File HTML đích (mặc định cạnh file kho)")
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.store):
+        parser.error(f"Không tìm thấy kho lịch sử: {args.store}")
+    output = args.output or os.path.splitext(args.store)[0] + EXPORT_SUFFIX
+    store = MessageStore(args.store)
+    try:
+        count = store.export_html(output)
+    finally:
+        store.close()
+    print(f"✅ Đã xuất {count} tin nhắn vào {output}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,6 +5,7 @@ Thực hiện các tác vụ khởi tạo:
 - Khởi tạo QApplication với cấu hình phù hợp
 - Thiết lập môi trường tiếng Việt (locale, font)
 - Tải font tùy chỉnh từ thư mục fonts/
+- Tạo sẵn pool cặp khoá X25519 ở luồng nền
 - Khởi chạy giao diện launcher chính
 
 Hỗ trợ đa nền tảng: Windows, Linux, macOS
@@ -15,6 +16,7 @@ from __future__ import annotations
 import sys
 import os
 from PySide6 import QtWidgets, QtCore, QtGui
+from .crypto import default_keypair_pool
 from .ui import Launcher
 
 # Thư mục chứa font tùy chỉnh
@@ -91,6 +93,9 @@ def main() -> int:
         else:
             os.environ["QT_QPA_PLATFORM"] = "xcb"
     
+    # Tạo sẵn cặp khoá ở luồng nền để mở cửa sổ chat không phải chờ
+    default_keypair_pool().start()
+
     # Khởi tạo QApplication
     app = QtWidgets.QApplication(sys.argv)
     
@@ -0,0 +1,431 @@
+"""
+Hàng đợi tin nhắn offline (store-and-forward) cho broker.
+
+Frame gửi tới client đang offline được ghi vào log chỉ-ghi-thêm trên đĩa:
+- Log chia thành các segment (NNNNNNNN.seg), chỉ ghi vào segment mới nhất
+- Mỗi record: header cố định + client nhận + frame bản mã nguyên vẹn
+- Mỗi frame có số thứ tự (seq) tăng dần theo thứ tự gửi; thứ tự giao và
+  ACK dựa trên seq chứ không dựa trên vị trí trong file (nén log có thể chép
+  frame cũ ra sau frame mới hơn)
+- Chỉ mục theo client nhận (vị trí các frame chờ) giữ trong bộ nhớ,
+  dựng lại khi khởi động bằng cách quét segment qua mmap
+- Khi client đăng ký lại, broker lấy toàn bộ backlog (take) và ghi
+  record ACK (seq lớn nhất đã lấy) để lần khởi động sau không giao lại
+- Luồng nền xoá segment cũ đã giao hết, chép frame còn chờ của segment
+  thưa sang segment mới rồi xoá segment cũ
+- Log nhớ khoá công khai của mọi client đã đăng ký (record KEY): broker chỉ
+  lưu frame cho client đã biết và chỉ trả backlog cho đúng khoá đó
+- Mỗi client nhận giữ tối đa max_pending_bytes bytes frame chờ, vượt thì
+  frame mới bị bỏ
+
+Đảm bảo giao nhiều nhất 1 lần (at-most-once): ACK được ghi ngay khi take()
+trả backlog cho broker, trước khi frame thực sự tới client; process bị dừng
+giữa lúc đó thì backlog đã lấy bị mất.
+
+Log chỉ chứa frame bản mã: broker vẫn không bao giờ thấy bản rõ.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import mmap
+import os
+import struct
+import threading
+import time
+
+SEGMENT_BYTES = 16 * 1024 * 1024  # Kích thước tối đa 1 segment trước khi mở segment mới
+COMPACT_INTERVAL = 30.0  # Chu kỳ chạy nén log (giây)
+COMPACT_LIVE_RATIO = 0.5  # Segment cũ nhất có tỷ lệ dữ liệu còn chờ dưới ngưỡng này thì được chép lại
+OFFLINE_TTL = 7 * 24 * 3600.0  # Frame chờ quá lâu (giây) bị bỏ khi nén
+OFFLINE_MAX_BYTES = 16 * 1024 * 1024  # Tổng bytes frame chờ tối đa của 1 client nhận
+SEGMENT_SUFFIX = ".seg"
+
+REC_FRAME = 1  # Frame chờ giao cho 1 client
+REC_ACK = 2  # Client đã nhận mọi frame tới vị trí (segment, offset)
+REC_KEY = 3  # Khoá công khai mới nhất của client đã đăng ký
+
+# type, recipient_len, payload_len, timestamp (ms), seq
+_RECORD = struct.Struct(">BHIQQ")
+_ACK = struct.Struct(">Q")  # seq lớn nhất đã giao cho client
+# Segment là dữ liệu nhị phân: tắt chuyển đổi xuống dòng (Windows)
+_O_BINARY = getattr(os, "O_BINARY", 0)
+
+
+
+class _Entry(NamedTuple):
+    """Vị trí một frame đang chờ trong log"""
+    segment: int
+    offset: int
+    size: int  # Tổng số bytes của record
+    data_offset: int  # Offset của frame trong segment
+    data_size: int
+    timestamp: float
+    seq: int  # Số thứ tự gửi
+
+
+class _KeyEntry(NamedTuple):
+    """Record KEY mới nhất của 1 client"""
+    segment: int
+    size: int  # Tổng số bytes của record
+    timestamp: float  # Lần đăng ký gần nhất
+    public_key: bytes
+
+class OfflineLog:
+    """
+    Log chỉ-ghi-thêm lưu frame cho client offline
+    - append(): ghi frame chờ giao
+    - take(): lấy và xác nhận toàn bộ backlog của 1 client
+    - remember()/public_key(): ghi/đọc khoá công khai của client đã đăng ký
+    - start()/close(): chạy/dừng luồng nén nền
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = SEGMENT_BYTES, ttl: Optional[float] = OFFLINE_TTL, max_pending_bytes: int = OFFLINE_MAX_BYTES) -> None:
+        """
+        Mở (hoặc tạo) log trong thư mục
+        Args:
+            directory: Thư mục chứa các segment
+            segment_bytes: Kích thước tối đa 1 segment
+            ttl: Thời gian giữ frame (và khoá của client không còn frame chờ) tối đa (None = giữ mãi)
+            max_pending_bytes: Tổng bytes frame chờ tối đa của 1 client nhận
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.ttl = ttl
+        self.max_pending_bytes = max_pending_bytes
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[_Entry]] = {}
+        self._pending_bytes: Dict[str, int] = {}  # client -> tổng bytes frame chờ
+        self._keys: Dict[str, _KeyEntry] = {}
+        self._acked: Dict[str, int] = {}  # Chỉ dùng khi khôi phục: seq đã ACK của mỗi client
+        self._seq = 0  # seq của frame ghi gần nhất
+        self._live: Dict[int, int] = {}  # segment -> số bytes record còn chờ
+        self._sizes: Dict[int, int] = {}  # segment -> kích thước file
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._wake = threading.Event()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._acked.clear()
+        self._active = max(self._sizes, default=0) + 1
+        self._open_active()
+
+    # ------------------------------------------------------------------
+    # Segment
+    # ------------------------------------------------------------------
+
+    def _path(self, segment: int) -> str:
+        """Đường dẫn file của segment"""
+        return os.path.join(self.directory, f"{segment:08d}{SEGMENT_SUFFIX}")
+
+    def _open_active(self) -> None:
+        """Mở segment mới để ghi"""
+        self._fd = os.open(self._path(self._active), os.O_WRONLY | os.O_CREAT | os.O_APPEND | _O_BINARY, 0o600)
+        self._sizes[self._active] = 0
+        self._live[self._active] = 0
+
+    def _roll(self) -> None:
+        """Đóng segment đang ghi, mở segment kế tiếp"""
+        os.close(self._fd)
+        self._active += 1
+        self._open_active()
+        self._wake.set()
+
+    def _map(self, segment: int) -> mmap.mmap:
+        """mmap chỉ đọc của segment (segment đang ghi được map lại theo kích thước hiện tại)"""
+        view = self._maps.get(segment)
+        if view is not None and len(view) >= self._sizes[segment]:
+            return view
+        if view is not None:
+            view.close()
+        with open(self._path(segment), "rb") as f:
+            view = self._maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return view
+
+    def _drop_segment(self, segment: int) -> None:
+        """Xoá segment khỏi đĩa và bộ nhớ"""
+        view = self._maps.pop(segment, None)
+        if view is not None:
+            view.close()
+        self._sizes.pop(segment, None)
+        self._live.pop(segment, None)
+        try:
+            os.unlink(self._path(segment))
+        except FileNotFoundError:
+            pass
+
+    def _recover(self) -> None:
+        """Quét các segment có sẵn, dựng lại chỉ mục frame còn chờ"""
+        segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+        )
+        for segment in segments:
+            size = os.path.getsize(self._path(segment))
+            self._sizes[segment] = size
+            self._live[segment] = 0
+            if size:
+                self._scan(segment, self._map(segment))
+        # Khôi phục thứ tự gửi; bỏ bản sao trùng seq (nén bị dừng giữa lúc
+        # chép frame sang segment mới và xoá segment cũ)
+        for recipient, entries in list(self._pending.items()):
+            entries.sort(key=lambda e: e.seq)
+            unique: List[_Entry] = []
+            for e in entries:
+                if unique and unique[-1].seq == e.seq:
+                    self._live[e.segment] -= e.size
+                    continue
+                unique.append(e)
+            self._pending[recipient] = unique
+            self._pending_bytes[recipient] = sum(e.data_size for e in unique)
+
+    def _scan(self, segment: int, view: mmap.mmap) -> None:
+        """Đọc các record của 1 segment (cắt bỏ record ghi dở ở cuối)"""
+        pos = 0
+        end = len(view)
+        while pos + _RECORD.size <= end:
+            rtype, rlen, plen, ts_ms, seq = _RECORD.unpack_from(view, pos)
+            data_offset = pos + _RECORD.size + rlen
+            if data_offset + plen > end or rtype not in (REC_FRAME, REC_ACK, REC_KEY):
+                break
+            recipient = str(view[pos + _RECORD.size:data_offset], "utf-8")
+            size = data_offset + plen - pos
+            self._seq = max(self._seq, seq)
+            if rtype == REC_FRAME:
+                if seq > self._acked.get(recipient, 0):
+                    self._pending.setdefault(recipient, []).append(
+                        _Entry(segment, pos, size, data_offset, plen, ts_ms / 1000.0, seq)
+                    )
+                    self._live[segment] += size
+            elif rtype == REC_KEY:
+                self._set_key(recipient, _KeyEntry(segment, size, ts_ms / 1000.0, bytes(view[data_offset:data_offset + plen])))
+            else:
+                self._apply_ack(recipient, _ACK.unpack_from(view, data_offset)[0])
+            pos += size
+        if pos < end:
+            # Record cuối ghi dở (process bị dừng giữa chừng): bỏ phần thừa
+            view.close()
+            del self._maps[segment]
+            os.truncate(self._path(segment), pos)
+            self._sizes[segment] = pos
+
+    def _apply_ack(self, recipient: str, acked: int) -> None:
+        """Bỏ các frame của client có seq <= acked (gọi khi khôi phục)"""
+        self._acked[recipient] = max(acked, self._acked.get(recipient, 0))
+        entries = self._pending.get(recipient)
+        if not entries:
+            return
+        keep = [e for e in entries if e.seq > acked]
+        for e in entries:
+            if e.seq <= acked:
+                self._live[e.segment] -= e.size
+        self._keep(recipient, keep)
+
+    def _keep(self, recipient: str, keep: List[_Entry]) -> None:
+        """Thay danh sách frame chờ của client (rỗng = bỏ client khỏi chỉ mục)"""
+        if keep:
+            self._pending[recipient] = keep
+            self._pending_bytes[recipient] = sum(e.data_size for e in keep)
+        else:
+            self._pending.pop(recipient, None)
+            self._pending_bytes.pop(recipient, None)
+
+    def _set_key(self, recipient: str, entry: _KeyEntry) -> None:
+        """Ghi nhận record KEY mới nhất của client, record cũ không còn cần giữ"""
+        previous = self._keys.get(recipient)
+        if previous is not None:
+            self._live[previous.segment] -= previous.size
+        self._keys[recipient] = entry
+        self._live[entry.segment] += entry.size
+
+    def _write(self, rtype: int, recipient: bytes, payload: bytes, timestamp: float, seq: int) -> Tuple[int, int, int]:
+        """
+        Ghi 1 record vào segment đang ghi (gọi khi giữ lock)
+        Returns:
+            Tuple[int, int, int]: (segment, offset, kích thước record)
+        """
+        if self._sizes[self._active] >= self.segment_bytes:
+            self._roll()
+        record = bytearray(_RECORD.size + len(recipient) + len(payload))
+        _RECORD.pack_into(record, 0, rtype, len(recipient), len(payload), int(timestamp * 1000), seq)
+        record[_RECORD.size:_RECORD.size + len(recipient)] = recipient
+        record[_RECORD.size + len(recipient):] = payload
+        offset = self._sizes[self._active]
+        os.write(self._fd, record)
+        self._sizes[self._active] = offset + len(record)
+        return self._active, offset, len(record)
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+
+    def append(self, recipient: str, frame: bytes) -> bool:
+        """
+        Lưu frame chờ giao cho client offline
+        Args:
+            recipient: ID của client nhận
+            frame: Frame bản mã
+        Returns:
+            bool: False nếu frame bị bỏ do client đã có max_pending_bytes bytes chờ
+        """
+        encoded = recipient.encode("utf-8")
+        now = time.time()
+        with self._lock:
+            queued = self._pending_bytes.get(recipient, 0)
+            if queued + len(frame) > self.max_pending_bytes:
+                return False
+            self._pending_bytes[recipient] = queued + len(frame)
+            self._seq += 1
+            segment, offset, size = self._write(REC_FRAME, encoded, frame, now, self._seq)
+            data_offset = offset + _RECORD.size + len(encoded)
+            self._pending.setdefault(recipient, []).append(
+                _Entry(segment, offset, size, data_offset, len(frame), now, self._seq)
+            )
+            self._live[segment] += size
+        return True
+
+    def remember(self, recipient: str, public_key: bytes) -> None:
+        """
+        Ghi khoá công khai của client vừa đăng ký (hoặc đổi khoá)
+        Args:
+            recipient: ID của client
+            public_key: Khoá công khai X25519
+        """
+        now = time.time()
+        with self._lock:
+            segment, _, size = self._write(REC_KEY, recipient.encode("utf-8"), public_key, now, 0)
+            self._set_key(recipient, _KeyEntry(segment, size, now, bytes(public_key)))
+
+    def public_key(self, recipient: str) -> Optional[bytes]:
+        """
+        Khoá công khai ghi gần nhất của client
+        Args:
+            recipient: ID của client
+        Returns:
+            Optional[bytes]: None nếu client chưa từng đăng ký (hoặc đã hết hạn)
+        """
+        entry = self._keys.get(recipient)
+        return entry.public_key if entry is not None else None
+
+    def pending(self, recipient: str) -> int:
+        """
+        Số frame đang chờ giao cho client
+        Args:
+            recipient: ID của client nhận
+        Returns:
+            int: Số frame chờ
+        """
+        return len(self._pending.get(recipient, ()))
+
+    def take(self, recipient: str) -> List[bytes]:
+        """
+        Lấy toàn bộ backlog của client (theo thứ tự gửi) và ghi ACK
+        Args:
+            recipient: ID của client nhận
+        Returns:
+            List[bytes]: Các frame chờ giao
+        """
+        with self._lock:
+            entries = self._pending.pop(recipient, None)
+            self._pending_bytes.pop(recipient, None)
+            if not entries:
+                return []
+            frames = []
+            for e in entries:
+                view = self._map(e.segment)
+                frames.append(view[e.data_offset:e.data_offset + e.data_size])
+                self._live[e.segment] -= e.size
+            # Danh sách giữ thứ tự seq, nên frame cuối có seq lớn nhất
+            self._write(REC_ACK, recipient.encode("utf-8"), _ACK.pack(entries[-1].seq), time.time(), 0)
+        self._wake.set()
+        return frames
+
+    def compact(self) -> int:
+        """
+        Nén log: bỏ frame hết hạn, xoá/chép lại các segment cũ nhất
+        Chỉ xoá segment theo thứ tự từ cũ nhất, nên record ACK trong segment
+        bị xoá không bao giờ cần tới nữa.
+        Returns:
+            int: Số segment đã xoá
+        """
+        removed = 0
+        with self._lock:
+            if self.ttl is not None:
+                self._expire(time.time() - self.ttl)
+            for segment in sorted(self._sizes):
+                if segment == self._active:
+                    break
+                live = self._live.get(segment, 0)
+                if live and live >= self._sizes[segment] * COMPACT_LIVE_RATIO:
+                    break
+                if live:
+                    self._rewrite(segment)
+                self._drop_segment(segment)
+                removed += 1
+        return removed
+
+    def _expire(self, cutoff: float) -> None:
+        """Bỏ các frame ghi trước cutoff (gọi khi giữ lock)"""
+        for recipient, entries in list(self._pending.items()):
+            if entries[0].timestamp >= cutoff:
+                continue
+            keep = [e for e in entries if e.timestamp >= cutoff]
+            for e in entries:
+                if e.timestamp < cutoff:
+                    self._live[e.segment] -= e.size
+            self._keep(recipient, keep)
+        # Client không đăng ký lại trong ttl và không còn frame chờ: quên khoá
+        for recipient, key in list(self._keys.items()):
+            if key.timestamp < cutoff and recipient not in self._pending:
+                self._live[key.segment] -= key.size
+                del self._keys[recipient]
+
+    def _rewrite(self, segment: int) -> None:
+        """Chép các frame còn chờ và record KEY còn dùng của segment sang segment đang ghi (gọi khi giữ lock)"""
+        view = self._map(segment)
+        for recipient, entries in self._pending.items():
+            encoded = recipient.encode("utf-8")
+            for i, e in enumerate(entries):
+                if e.segment != segment:
+                    continue
+                frame = view[e.data_offset:e.data_offset + e.data_size]
+                new_segment, offset, size = self._write(REC_FRAME, encoded, frame, e.timestamp, e.seq)
+                entries[i] = _Entry(new_segment, offset, size, offset + _RECORD.size + len(encoded), e.data_size, e.timestamp, e.seq)
+                self._live[new_segment] += size
+        for recipient, key in self._keys.items():
+            if key.segment == segment:
+                new_segment, _, size = self._write(REC_KEY, recipient.encode("utf-8"), key.public_key, key.timestamp, 0)
+                self._keys[recipient] = key._replace(segment=new_segment, size=size)
+                self._live[new_segment] += size
+
+    def start(self) -> None:
+        """Chạy luồng nén nền (gọi nhiều lần không sao)"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._compact_loop, name="offline-compactor", daemon=True)
+        self._thread.start()
+
+    def _compact_loop(self) -> None:
+        """Luồng nền: nén khi có segment mới đóng, frame được lấy, hoặc theo chu kỳ"""
+        while not self._stop:
+            self._wake.wait(COMPACT_INTERVAL)
+            self._wake.clear()
+            if self._stop:
+                break
+            self.compact()
+
+    def close(self) -> None:
+        """Dừng luồng nén và đóng file"""
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            for view in self._maps.values():
+                view.close()
+            self._maps.clear()
+            os.close(self._fd)
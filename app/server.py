@@ -0,0 +1,451 @@
+"""
+Broker server chạy asyncio cho ứng dụng chat E2EE.
+
+Đưa InMemoryBroker ra mạng để client chạy ở nhiều process/máy khác nhau:
+- Lắng nghe trên TCP và/hoặc Unix domain socket
+- Giữ nguyên ngữ nghĩa register/unregister/list/send của InMemoryBroker
+- Frame bản mã được đẩy về client dưới dạng message OP_DELIVER
+- Client dùng RemoteBroker (app.transport) để kết nối
+
+Sử dụng:
+    python -m app.server --listen tcp://127.0.0.1:8765 --listen unix:///tmp/e2ee.sock
+    E2EE_BROKER=tcp://127.0.0.1:8765 python -m app.main
+
+Với --offline-dir, frame gửi tới client offline được lưu (app.offline) và
+giao lại khi client đăng ký lại với cùng client_id và khoá công khai.
+
+Lưu ý: Server chỉ chuyển tiếp frame, không thể giải mã tin nhắn.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hmac
+import os
+import socket
+import struct
+import threading
+from functools import partial
+from typing import Callable, Dict, List, Optional, Set
+
+from .offline import OfflineLog
+from .transport import (
+    METRICS_EXPORT_INTERVAL,
+    BrokerError,
+    BrokerMetrics,
+    DeltaEvent,
+    InMemoryBroker,
+    OverflowPolicy,
+    QueueFull,
+    encode_presence_event,
+    encode_room_event,
+    parse_broker_url,
+)
+from .wire import (
+    MSG_LENGTH_BYTES,
+    OP_AUTH,
+    OP_CREATE_ROOM,
+    OP_DELIVER,
+    OP_ERROR,
+    OP_EVENT,
+    OP_JOIN_ROOM,
+    OP_LEAVE_ROOM,
+    OP_LIST,
+    OP_REGISTER,
+    OP_REPLY,
+    OP_ROOM_MEMBERS,
+    OP_SEND,
+    OP_SEND_MANY,
+    OP_SEND_ROOM,
+    OP_SEND_ROOM_REQ,
+    OP_SUBSCRIBE,
+    OP_UNREGISTER,
+    OP_UNSUBSCRIBE,
+    OP_UPDATE_KEY,
+    TOPIC_PRESENCE,
+    TOPIC_ROOM_PREFIX,
+    FrameError,
+    decode_frame,
+    pack_message,
+    read_message_length,
+    unpack_message,
+)
+
+DEFAULT_LISTEN = "tcp://127.0.0.1:8765"  # Địa chỉ lắng nghe mặc định
+WRITE_HIGH_WATER = 1024 * 1024  # Chờ drain khi buffer ghi của client vượt ngưỡng này
+DELIVERY_BUFFER_LIMIT = 16 * 1024 * 1024  # Buffer ghi tối đa của client nhận, vượt thì từ chối frame
+REQ_ID_BYTES = 4  # Độ dài req_id của RemoteBroker (">I")
+
+# Số trường tối thiểu của từng lệnh
+_MIN_FIELDS = {
+    OP_SEND: 2,  # to, frame
+    OP_SEND_ROOM: 3,  # room_id, exclude, frame
+    OP_SEND_ROOM_REQ: 4,  # req_id, room_id, exclude, frame
+    OP_SEND_MANY: 2,  # exclude, frame, to...
+    OP_REGISTER: 3,  # req_id, name, public_key[, client_id]
+    OP_UNREGISTER: 1,  # client_id
+    OP_UPDATE_KEY: 2,  # client_id, public_key
+    OP_SUBSCRIBE: 3,  # token, topic, since
+    OP_UNSUBSCRIBE: 1,  # token
+    OP_CREATE_ROOM: 3,  # req_id, name, room_id
+    OP_JOIN_ROOM: 3,  # req_id, room_id, client_id
+    OP_LEAVE_ROOM: 3,  # req_id, room_id, client_id
+    OP_ROOM_MEMBERS: 2,  # req_id, room_id
+    OP_LIST: 1,  # req_id
+}
+# Lệnh có req_id ở trường đầu, client chờ OP_REPLY/OP_ERROR
+_REQUEST_OPS = frozenset({OP_REGISTER, OP_SEND_ROOM_REQ, OP_CREATE_ROOM, OP_JOIN_ROOM, OP_LEAVE_ROOM, OP_ROOM_MEMBERS, OP_LIST})
+
+
+class _Connection:
+    """
+    Một kết nối từ client tới server
+    - Có thể chứa nhiều client đăng ký (nhiều cửa sổ chat trong 1 process)
+    - Ghi frame về client an toàn cả khi deliver được gọi từ luồng khác
+    - Kết nối trusted (listener nội bộ của cluster) được gửi frame thay
+      người gửi bất kỳ
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop, trusted: bool = False) -> None:
+        self.writer = writer
+        self.loop = loop
+        self.trusted = trusted
+        self.loop_thread = threading.get_ident()
+        self.client_ids: Set[str] = set()
+        self.subscriptions: Dict[bytes, Callable[[], None]] = {}  # token của client -> hàm huỷ đăng ký
+
+    def write(self, message: bytes) -> None:
+        """Ghi message về client (chuyển về event loop nếu đang ở luồng khác)"""
+        if self.writer.is_closing():
+            return
+        if threading.get_ident() == self.loop_thread:
+            self.writer.write(message)
+        else:
+            self.loop.call_soon_threadsafe(self.write, message)
+
+
+class _Deliverer:
+    """
+    Callback deliver của 1 client ở xa: đẩy frame về kết nối qua OP_DELIVER
+    - Buffer ghi của socket đóng vai trò hàng đợi giao frame có giới hạn
+    """
+
+    def __init__(self, conn: _Connection) -> None:
+        self.conn = conn
+        self.client_id = b""  # Gán sau khi broker cấp client_id
+
+    def __call__(self, frame: bytes) -> None:
+        if self.conn.writer.transport.get_write_buffer_size() > DELIVERY_BUFFER_LIMIT:
+            raise QueueFull("Client nhận đọc không kịp")
+        self.conn.write(pack_message(OP_DELIVER, self.client_id, frame))
+
+
+class BrokerServer:
+    """
+    Broker server asyncio bọc quanh một InMemoryBroker
+    - start(url): mở listener TCP hoặc Unix socket
+    - serve_forever(): chạy tới khi bị huỷ
+    """
+
+    def __init__(self, broker: Optional[InMemoryBroker] = None) -> None:
+        """
+        Khởi tạo server
+        Args:
+            broker: Broker dùng để định tuyến (None = tạo broker riêng)
+
+        Client ở xa được giao frame thẳng vào buffer ghi của socket (không
+        qua hàng đợi của broker), giới hạn bởi DELIVERY_BUFFER_LIMIT. Broker
+        mặc định dùng OverflowPolicy.REJECT để event loop không bao giờ bị
+        chặn chờ hàng đợi của client chạy trong cùng process.
+        """
+        self.broker = broker if broker is not None else InMemoryBroker(overflow=OverflowPolicy.REJECT)
+        self._servers: List[asyncio.AbstractServer] = []
+        # client_id -> kết nối đã đăng ký ID đó (chỉ kết nối này được dùng/huỷ ID)
+        self._owners: Dict[str, _Connection] = {}
+
+    async def start(self, url: str, trusted: bool = False, secret: Optional[bytes] = None) -> None:
+        """
+        Mở listener mới
+        Args:
+            url: "tcp://host:port" hoặc "unix:///đường/dẫn.sock"
+            trusted: True = không kiểm tra người gửi của frame (chỉ dùng cho
+                listener nội bộ giữa các shard, không mở cho client)
+            secret: Khoá bí mật chung của cluster; kết nối phải gửi OP_AUTH
+                đúng khoá làm message đầu tiên (bắt buộc khi trusted)
+        Raises:
+            ValueError: Nếu trusted mà không có secret
+        """
+        if trusted and not secret:
+            raise ValueError("Listener trusted cần secret để xác thực shard khác")
+        handle = partial(self._handle, trusted=trusted, secret=secret)
+        family, address = parse_broker_url(url)
+        if family == socket.AF_UNIX:
+            path = str(address)
+            if os.path.exists(path):
+                os.unlink(path)
+            server = await asyncio.start_unix_server(handle, path=path)
+        else:
+            host, port = address  # type: ignore[misc]
+            server = await asyncio.start_server(handle, host=host, port=port)
+        self._servers.append(server)
+
+    @property
+    def addresses(self) -> List[str]:
+        """Các URL đang lắng nghe (hữu ích khi dùng port 0)"""
+        urls = []
+        for server in self._servers:
+            for sock in server.sockets:
+                name = sock.getsockname()
+                if sock.family == socket.AF_UNIX:
+                    urls.append(f"unix://{name}")
+                else:
+                    urls.append(f"tcp://{name[0]}:{name[1]}")
+        return urls
+
+    async def serve_forever(self) -> None:
+        """Chạy server tới khi bị huỷ"""
+        await asyncio.gather(*(server.serve_forever() for server in self._servers))
+
+    async def close(self) -> None:
+        """Đóng mọi listener"""
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers.clear()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, trusted: bool = False, secret: Optional[bytes] = None) -> None:
+        """Xử lý một kết nối: xác thực (nếu listener có secret), đọc message và thực thi lệnh"""
+        conn = _Connection(writer, asyncio.get_running_loop())
+        sock = writer.get_extra_info("socket")
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            if secret is not None:
+                header = await reader.readexactly(MSG_LENGTH_BYTES)
+                op, fields = unpack_message(await reader.readexactly(read_message_length(header)))
+                if op != OP_AUTH or not fields or not hmac.compare_digest(bytes(fields[0]), secret):
+                    # Sai khoá: ngắt ngay, không trả lời để không lộ thông tin
+                    return
+            conn.trusted = trusted
+            while True:
+                header = await reader.readexactly(MSG_LENGTH_BYTES)
+                body = await reader.readexactly(read_message_length(header))
+                op, fields = unpack_message(body)
+                try:
+                    self._dispatch(conn, op, fields)
+                except BrokerError:
+                    # Hàng đợi client nhận đầy: bỏ frame, giữ kết nối người gửi
+                    pass
+                except (ValueError, IndexError) as exc:
+                    # Message sai định dạng (thiếu trường, UTF-8 hỏng...): báo lỗi
+                    # nếu lệnh có req_id, giữ kết nối
+                    self._reply_error(conn, op, fields, f"Message không hợp lệ: {exc}")
+                if writer.transport.get_write_buffer_size() > WRITE_HIGH_WATER:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, FrameError):
+            pass
+        finally:
+            # Client mất kết nối: hủy mọi đăng ký của kết nối này
+            for cancel in conn.subscriptions.values():
+                cancel()
+            for client_id in conn.client_ids:
+                self._release(conn, client_id)
+            writer.close()
+
+    def _release(self, conn: _Connection, client_id: str) -> None:
+        """Huỷ đăng ký client_id nếu đăng ký hiện tại vẫn thuộc kết nối conn"""
+        if self._owners.get(client_id) is conn:
+            del self._owners[client_id]
+            self.broker.unregister_client(client_id)
+
+    @staticmethod
+    def _owns_sender(conn: _Connection, frame: memoryview) -> bool:
+        """
+        Kiểm tra người gửi ghi trong header frame là client của kết nối này
+        (chặn client giả danh người khác); chỉ đọc header, không giải mã
+        """
+        if conn.trusted:
+            return True
+        try:
+            return decode_frame(frame).sender_id in conn.client_ids
+        except (FrameError, UnicodeDecodeError):
+            return False
+
+    @staticmethod
+    def _reply_error(conn: _Connection, op: int, fields: List[memoryview], message: str) -> None:
+        """Trả OP_ERROR cho lệnh có req_id hợp lệ (lệnh gửi frame/huỷ đăng ký: bỏ im lặng)"""
+        if (op in _REQUEST_OPS or op not in _MIN_FIELDS) and fields and len(fields[0]) == REQ_ID_BYTES:
+            conn.write(pack_message(OP_ERROR, fields[0], message.encode("utf-8")))
+
+    def _dispatch(self, conn: _Connection, op: int, fields: List[memoryview]) -> None:
+        """
+        Thực thi một lệnh từ client
+        Raises:
+            ValueError: Nếu message thiếu trường hoặc trường không phải UTF-8
+            BrokerError: Nếu broker từ chối frame (hàng đợi đầy)
+        """
+        if len(fields) < _MIN_FIELDS.get(op, 0):
+            raise ValueError(f"lệnh {op} cần {_MIN_FIELDS[op]} trường, nhận {len(fields)}")
+        if op == OP_SEND:
+            if self._owns_sender(conn, fields[1]):
+                self.broker.send_frame(str(fields[0], "utf-8"), fields[1])
+        elif op in (OP_SEND_ROOM, OP_SEND_ROOM_REQ):
+            if not self._owns_sender(conn, fields[-1]):
+                self._reply_error(conn, op, fields, "Người gửi không thuộc kết nối này")
+                return
+            # Phòng có thể thuộc shard khác (lời gọi chặn): chạy như lệnh phòng
+            conn.loop.run_in_executor(None, self._dispatch_room, conn, op, fields)
+        elif op == OP_SEND_MANY:
+            if self._owns_sender(conn, fields[1]):
+                exclude = str(fields[0], "utf-8") or None
+                self.broker.send_frame_many((str(f, "utf-8") for f in fields[2:]), fields[1], exclude=exclude)
+        elif op == OP_REGISTER:
+            req_id, name, public_key = fields[:3]
+            deliver = _Deliverer(conn)
+            client_id = str(fields[3], "utf-8") if len(fields) > 3 else None
+            if client_id is not None:
+                # Chỉ kết nối đang giữ ID (hoặc ID không còn online) được đăng ký lại:
+                # không cho kết nối khác chiếm ID; ID offline thì broker đòi đúng
+                # khoá công khai đã ghi trong log offline trước khi trả backlog
+                owner = self._owners.get(client_id)
+                if owner is not conn and (owner is not None or client_id in self.broker.clients):
+                    conn.write(pack_message(OP_ERROR, req_id, f"Client ID đang được dùng: {client_id}".encode("utf-8")))
+                    return
+                deliver.client_id = fields[3].tobytes()
+            try:
+                client_id = self.broker.register_client(str(name, "utf-8"), bytes(public_key), deliver, client_id=client_id, queue_size=0)
+            except BrokerError as exc:
+                conn.write(pack_message(OP_ERROR, req_id, str(exc).encode("utf-8")))
+                return
+            deliver.client_id = client_id.encode("utf-8")
+            self._owners[client_id] = conn
+            conn.client_ids.add(client_id)
+            conn.write(pack_message(OP_REPLY, req_id, client_id.encode("utf-8")))
+        elif op == OP_UNREGISTER:
+            client_id = str(fields[0], "utf-8")
+            if client_id in conn.client_ids:
+                conn.client_ids.discard(client_id)
+                self._release(conn, client_id)
+        elif op == OP_UPDATE_KEY:
+            client_id = str(fields[0], "utf-8")
+            if client_id in conn.client_ids:
+                self.broker.update_public_key(client_id, bytes(fields[1]))
+        elif op == OP_SUBSCRIBE:
+            self._subscribe(conn, bytes(fields[0]), bytes(fields[1]), fields[2])
+        elif op == OP_UNSUBSCRIBE:
+            cancel = conn.subscriptions.pop(bytes(fields[0]), None)
+            if cancel is not None:
+                cancel()
+        elif op in (OP_CREATE_ROOM, OP_JOIN_ROOM, OP_LEAVE_ROOM, OP_ROOM_MEMBERS):
+            if op in (OP_JOIN_ROOM, OP_LEAVE_ROOM) and not conn.trusted and str(fields[2], "utf-8") not in conn.client_ids:
+                self._reply_error(conn, op, fields, "Chỉ được thêm/xoá client đã đăng ký trên kết nối này")
+                return
+            # Chạy ngoài event loop: broker của cluster có thể phải hỏi shard
+            # sở hữu phòng (lời gọi chặn), event loop vẫn phục vụ kết nối khác
+            conn.loop.run_in_executor(None, self._dispatch_room, conn, op, fields)
+        elif op == OP_LIST:
+            entries: List[bytes] = []
+            for client_id, reg in self.broker.list_clients().items():
+                entries += [client_id.encode("utf-8"), reg.display_name.encode("utf-8"), reg.public_key_bytes]
+            conn.write(pack_message(OP_REPLY, fields[0], *entries))
+        else:
+            self._reply_error(conn, op, fields, f"Lệnh không hỗ trợ: {op}")
+
+    def _subscribe(self, conn: _Connection, token: bytes, topic: bytes, since: memoryview) -> None:
+        """Đăng ký đẩy sự kiện của topic về kết nối qua OP_EVENT"""
+        if token in conn.subscriptions:
+            return
+        start = int.from_bytes(since, "big") if len(since) else None
+        if topic == TOPIC_PRESENCE:
+            encode = encode_presence_event
+        elif topic.startswith(TOPIC_ROOM_PREFIX):
+            encode = encode_room_event
+        else:
+            return
+
+        def push(event: DeltaEvent) -> None:
+            conn.write(pack_message(OP_EVENT, token, *encode(event)))
+
+        if topic == TOPIC_PRESENCE:
+            subscription = self.broker.subscribe_presence(push, start)
+            conn.subscriptions[token] = lambda: self.broker.unsubscribe_presence(subscription)
+            return
+        room_id = str(topic[len(TOPIC_ROOM_PREFIX):], "utf-8")
+        try:
+            subscription = self.broker.subscribe_room(room_id, push, start)
+        except BrokerError:
+            return
+        conn.subscriptions[token] = lambda: self.broker.unsubscribe_room(room_id, subscription)
+
+    def _dispatch_room(self, conn: _Connection, op: int, fields: List[memoryview]) -> None:
+        """Thực thi lệnh phòng (trên thread pool), lỗi được trả về client qua OP_ERROR"""
+        if op == OP_SEND_ROOM:
+            # Không có req_id: lỗi bị bỏ im lặng như OP_SEND
+            try:
+                self.broker.send_to_room(str(fields[0], "utf-8"), fields[2], exclude=str(fields[1], "utf-8") or None)
+            except (BrokerError, ValueError):
+                pass
+            return
+        req_id = fields[0]
+        try:
+            if op == OP_SEND_ROOM_REQ:
+                room_id, exclude = str(fields[1], "utf-8"), str(fields[2], "utf-8") or None
+                delivered = self.broker.send_to_room(room_id, fields[3], exclude=exclude)
+                conn.write(pack_message(OP_REPLY, req_id, struct.pack(">I", delivered)))
+                return
+            args = [str(f, "utf-8") for f in fields[1:]]
+            if op == OP_CREATE_ROOM:
+                reply = [self.broker.create_room(args[0], args[1] or None).encode("utf-8")]
+            elif op == OP_JOIN_ROOM:
+                self.broker.join_room(args[0], args[1])
+                reply = []
+            elif op == OP_LEAVE_ROOM:
+                self.broker.leave_room(args[0], args[1])
+                reply = []
+            else:
+                reply = [client_id.encode("utf-8") for client_id in self.broker.room_members(args[0])]
+        except (BrokerError, ValueError) as exc:
+            conn.write(pack_message(OP_ERROR, req_id, str(exc).encode("utf-8")))
+            return
+        conn.write(pack_message(OP_REPLY, req_id, *reply))
+
+
+async def _serve(urls: List[str], offline_dir: Optional[str] = None, metrics_file: Optional[str] = None, metrics_interval: float = METRICS_EXPORT_INTERVAL) -> None:
+    """Mở các listener và chạy server"""
+    offline = None
+    if offline_dir:
+        offline = OfflineLog(offline_dir)
+        offline.start()
+    metrics = BrokerMetrics() if metrics_file else None
+    broker = InMemoryBroker(overflow=OverflowPolicy.REJECT, offline=offline, metrics=metrics)
+    if metrics is not None:
+        metrics.start_export(metrics_file, broker.stats, metrics_interval)  # type: ignore[arg-type]
+    server = BrokerServer(broker)
+    for url in urls:
+        await server.start(url)
+    print("🚀 Broker server đang lắng nghe: " + ", ".join(server.addresses), flush=True)
+    await server.serve_forever()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Entry point của broker server
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(description="Broker server cho ứng dụng chat E2EE")
+    parser.add_argument("--listen", action="append", help=f"URL lắng nghe, có thể lặp lại (mặc định {DEFAULT_LISTEN})")
+    parser.add_argument("--offline-dir", help="Thư mục lưu frame cho client offline (bỏ trống = không lưu)")
+    parser.add_argument("--metrics-file", help="Ghi số liệu định dạng Prometheus ra file này (bỏ trống = tắt đo)")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_EXPORT_INTERVAL, help=f"Chu kỳ ghi file số liệu, giây (mặc định {METRICS_EXPORT_INTERVAL:g})")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve(args.listen or [DEFAULT_LISTEN], args.offline_dir, args.metrics_file, args.metrics_interval))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
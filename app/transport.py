@@ -3,51 +3,1258 @@ Mô-đun transport và message broker cho ứng dụng chat E2EE.
 
 Cung cấp hệ thống chuyển tiếp tin nhắn an toàn:
 - Quản lý broker trong bộ nhớ (InMemoryBroker)
+- Kết nối tới broker server qua TCP/Unix socket (RemoteBroker, app.server)
 - Đăng ký/hủy đăng ký client với public key
-- Chuyển tiếp bản mã giữa các client
+- Chuyển tiếp frame bản mã (app.wire) giữa các client
+- Lưu frame cho client offline và giao lại khi đăng ký lại (app.offline)
+- Phòng chat: chỉ mục thành viên và gửi 1 frame tới cả phòng trong 1 lệnh
+- Số liệu vận hành (BrokerMetrics): bộ đếm, histogram độ trễ, file Prometheus
 - Singleton pattern để đảm bảo tính nhất quán
 
-Lưu ý: Broker chỉ chuyển tiếp bản mã, không thể giải mã tin nhắn.
+Lưu ý: Broker chỉ chuyển tiếp frame như bytes, không thể giải mã tin nhắn.
 """
 
 from __future__ import annotations
 
-from typing import Callable, Dict, Optional
-from dataclasses import dataclass
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from enum import Enum
+from typing import Any, Callable, Deque, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+from array import array
+from dataclasses import dataclass, field
+import bisect
+import heapq
+import itertools
+import os
+import socket
+import struct
+import threading
+import time
 import uuid
 
-# Type alias cho callback nhận tin nhắn mã hoá
-CipherDelivery = Callable[[str, bytes, bytes, bytes], None]
-# Signature: from_client_id, peer_public_key_bytes, nonce, ciphertext
+from .offline import OfflineLog
+from .wire import (
+    MSG_LENGTH_BYTES,
+    OP_AUTH,
+    OP_CREATE_ROOM,
+    OP_DELIVER,
+    OP_ERROR,
+    OP_EVENT,
+    OP_JOIN_ROOM,
+    OP_LEAVE_ROOM,
+    OP_LIST,
+    OP_REGISTER,
+    OP_REPLY,
+    OP_ROOM_MEMBERS,
+    OP_SEND,
+    OP_SEND_MANY,
+    OP_SEND_ROOM_REQ,
+    OP_SUBSCRIBE,
+    OP_UNREGISTER,
+    OP_UNSUBSCRIBE,
+    OP_UPDATE_KEY,
+    TOPIC_PRESENCE,
+    TOPIC_ROOM_PREFIX,
+    decode_frame,
+    encode_frame,
+    pack_message,
+    read_message_length,
+    unpack_message,
+)
+
+# Biến môi trường chọn broker: "tcp://host:port", "unix:///path", "cluster:///thư/mục" hoặc "memory"
+BROKER_URL_ENV = "E2EE_BROKER"
+REQUEST_TIMEOUT = 10.0  # Thời gian chờ tối đa cho yêu cầu tới broker server (giây)
+DELIVERY_QUEUE_SIZE = 1024  # Số frame tối đa chờ giao cho mỗi client
+DELIVERY_BLOCK_TIMEOUT = 1.0  # Thời gian người gửi chờ tối đa khi hàng đợi đầy (BLOCK)
+DELIVERY_WORKERS = 4  # Số luồng giao frame dùng chung của broker
+DELIVERY_BATCH = 64  # Số frame giao liên tiếp cho 1 client trước khi nhường luồng
+COALESCE_WINDOW = 0.005  # Thời gian gom frame tối đa mặc định trước khi giao lô (giây)
+REGISTRY_SHARDS = 64  # Số shard của registry client (luỹ thừa của 2)
+DELTA_HISTORY = 4096  # Số sự kiện gần nhất giữ lại để subscriber nối lại (resume)
+# Ngưỡng (giây) các bucket của histogram độ trễ giao frame
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+METRICS_EXPORT_INTERVAL = 15.0  # Chu kỳ ghi file số liệu Prometheus (giây)
+METRICS_PREFIX = "e2ee_broker"  # Tiền tố tên số liệu Prometheus
+
+# Loại sự kiện của DeltaStream
+DELTA_JOIN = 1  # Thêm phần tử (value = giá trị mới)
+DELTA_LEAVE = 2  # Xoá phần tử (value = None)
+DELTA_UPDATE = 3  # Cập nhật phần tử (value = giá trị mới)
+DELTA_RESET = 4  # Toàn bộ trạng thái (key = "", value = snapshot)
+
+# Type alias cho callback nhận frame bản mã
+FrameDelivery = Callable[[bytes], None]
+# Signature: frame (xem app.wire.decode_frame)
+
+# Type alias cho callback nhận cả lô frame (chế độ gom frame)
+BatchDelivery = Callable[[List[bytes]], None]
+# Signature: các frame theo thứ tự nhận
+
+
+class Coalescing(NamedTuple):
+    """
+    Cấu hình gom frame của 1 client: frame được giữ lại tối đa window giây
+    hoặc tới khi đủ max_frames rồi giao 1 lần qua BatchDelivery
+
+    Attributes:
+        window (float): Thời gian giữ frame đầu tiên của lô (giây)
+        max_frames (int): Số frame tối đa mỗi lô (đủ thì giao ngay)
+    """
+    window: float = COALESCE_WINDOW
+    max_frames: int = DELIVERY_BATCH
+
+
+class DeltaEvent(NamedTuple):
+    """
+    Một thay đổi trong DeltaStream
+
+    Attributes:
+        version (int): Phiên bản sau thay đổi (tăng dần, bắt đầu từ 1)
+        kind (int): DELTA_JOIN / DELTA_LEAVE / DELTA_UPDATE / DELTA_RESET
+        key (str): Khoá của phần tử thay đổi (vd: client_id)
+        value (Any): Giá trị mới, None với DELTA_LEAVE, snapshot với DELTA_RESET
+    """
+    version: int
+    kind: int
+    key: str
+    value: Any
+
+
+# Type alias cho callback nhận sự kiện delta
+DeltaCallback = Callable[[DeltaEvent], None]
+
+
+class DeltaStream:
+    """
+    Luồng thay đổi có phiên bản (presence, thành viên phòng, ...)
+    - publish(): tăng phiên bản và gửi sự kiện tới mọi subscriber
+    - subscribe(since): phát lại các sự kiện sau since nếu còn trong lịch sử,
+      ngược lại gửi 1 sự kiện DELTA_RESET chứa snapshot hiện tại
+    - Callback được gọi đúng thứ tự phiên bản, trên luồng gây ra thay đổi,
+      nên phải nhanh (vd: emit Qt signal, ghi socket)
+    - Sự kiện có tính idempotent: JOIN/UPDATE ghi đè, LEAVE bỏ qua nếu không có
+    """
+
+    def __init__(self, snapshot: Callable[[], Any], history: int = DELTA_HISTORY) -> None:
+        """
+        Khởi tạo luồng thay đổi
+        Args:
+            snapshot: Hàm lấy trạng thái hiện tại (dùng cho DELTA_RESET)
+            history: Số sự kiện gần nhất giữ lại để resume
+        """
+        self._snapshot = snapshot
+        self._history: Deque[DeltaEvent] = deque(maxlen=history)
+        self._subscribers: Dict[int, DeltaCallback] = {}
+        self._tokens = itertools.count(1)
+        self._lock = threading.RLock()
+        self.version = 0
+
+    def publish(self, kind: int, key: str, value: Any = None) -> DeltaEvent:
+        """
+        Ghi nhận một thay đổi và gửi tới subscriber
+        Args:
+            kind: Loại sự kiện DELTA_*
+            key: Khoá của phần tử
+            value: Giá trị mới (None với DELTA_LEAVE)
+        Returns:
+            DeltaEvent: Sự kiện đã phát
+        """
+        with self._lock:
+            self.version += 1
+            event = DeltaEvent(self.version, kind, key, value)
+            self._history.append(event)
+            for callback in list(self._subscribers.values()):
+                callback(event)
+        return event
+
+    def subscribe(self, callback: DeltaCallback, since: Optional[int] = None) -> int:
+        """
+        Đăng ký nhận thay đổi
+        Args:
+            callback: Hàm nhận DeltaEvent
+            since: Phiên bản cuối đã biết (None = nhận snapshot trước)
+        Returns:
+            int: Token để huỷ đăng ký
+        """
+        with self._lock:
+            if since is not None and since == self.version:
+                pass
+            elif since is not None and self._history and self._history[0].version <= since + 1 and since < self.version:
+                for event in self._history:
+                    if event.version > since:
+                        callback(event)
+            else:
+                callback(DeltaEvent(self.version, DELTA_RESET, "", self._snapshot()))
+            token = next(self._tokens)
+            self._subscribers[token] = callback
+        return token
+
+    def unsubscribe(self, token: int) -> None:
+        """
+        Huỷ đăng ký
+        Args:
+            token: Token trả về từ subscribe()
+        """
+        with self._lock:
+            self._subscribers.pop(token, None)
+
+
+class BrokerError(Exception):
+    """Lỗi do broker server trả về hoặc mất kết nối tới server"""
+
+
+class QueueFull(BrokerError):
+    """Hàng đợi giao frame của client nhận đã đầy"""
+
+
+class OverflowPolicy(Enum):
+    """
+    Cách xử lý khi hàng đợi giao frame của client nhận đã đầy
+    - BLOCK: người gửi chờ tới khi có chỗ (quá thời gian thì QueueFull)
+    - DROP_OLDEST: bỏ frame cũ nhất để nhận frame mới
+    - REJECT: từ chối frame mới ngay bằng QueueFull
+    """
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    REJECT = "reject"
+
+
+class Histogram:
+    """
+    Histogram với các bucket cố định (không cấp phát khi ghi nhận)
+    Không tự khoá: BrokerMetrics gọi khi đang giữ lock của nó
+    """
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """
+        Khởi tạo histogram rỗng
+        Args:
+            bounds: Ngưỡng trên của các bucket (tăng dần), thêm 1 bucket +Inf
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Ghi nhận 1 giá trị"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """
+        Số mẫu luỹ kế theo ngưỡng (định dạng bucket của Prometheus)
+        Returns:
+            List[Tuple[float, int]]: (ngưỡng, số mẫu <= ngưỡng), ngưỡng cuối là +Inf
+        """
+        result = []
+        running = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+
+class ClientCounters:
+    """Bộ đếm của 1 client nhận"""
+    __slots__ = ("frames", "bytes", "dropped")
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
 
 
 @dataclass
+class BrokerStats:
+    """
+    Ảnh chụp số liệu của InMemoryBroker
+
+    Attributes:
+        registered_clients (int): Số client đang đăng ký
+        rooms (int): Số phòng
+        frames_sent (int): Số frame người gửi đưa vào broker (tính theo client nhận)
+        bytes_sent (int): Tổng bytes tương ứng
+        frames_delivered (int): Số frame đã giao tới callback của client
+        bytes_delivered (int): Tổng bytes đã giao
+        dropped (int): Frame bị bỏ do hàng đợi đầy (REJECT/BLOCK quá hạn/DROP_OLDEST)
+        unknown_recipient (int): Frame tới client không tồn tại (không có log
+            offline, hoặc client chưa từng đăng ký)
+        offline_stored (int): Frame được lưu vào log offline
+        offline_dropped (int): Frame tới client offline bị bỏ do client đã đủ bytes chờ
+        forward_dropped (int): Frame bị bỏ khi chuyển tiếp sang shard khác (cluster)
+        latency_buckets (list): (ngưỡng giây, số mẫu luỹ kế) của độ trễ giao frame
+        latency_sum (float): Tổng độ trễ (giây)
+        latency_count (int): Số mẫu độ trễ
+        per_client (dict): client_id -> {"frames", "bytes", "dropped"}
+    """
+    registered_clients: int = 0
+    rooms: int = 0
+    frames_sent: int = 0
+    bytes_sent: int = 0
+    frames_delivered: int = 0
+    bytes_delivered: int = 0
+    dropped: int = 0
+    unknown_recipient: int = 0
+    offline_stored: int = 0
+    offline_dropped: int = 0
+    forward_dropped: int = 0
+    latency_buckets: List[Tuple[float, int]] = field(default_factory=list)
+    latency_sum: float = 0.0
+    latency_count: int = 0
+    per_client: Dict[str, Dict[str, int]] = field(default_factory=dict)
+
+
+class BrokerMetrics:
+    """
+    Số liệu vận hành của InMemoryBroker
+    - Bộ đếm toàn broker và theo từng client nhận
+    - Histogram độ trễ giao frame (từ lúc vào hàng đợi tới khi callback trả về)
+    - Broker tạo với metrics=None thì mọi điểm đo chỉ còn 1 phép so sánh
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        """
+        Khởi tạo bộ đếm
+        Args:
+            buckets: Ngưỡng bucket (giây) của histogram độ trễ
+        """
+        self._lock = threading.Lock()
+        self.latency = Histogram(buckets)
+        self.clients: Dict[str, ClientCounters] = {}
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.frames_delivered = 0
+        self.bytes_delivered = 0
+        self.dropped = 0
+        self.unknown_recipient = 0
+        self.offline_stored = 0
+        self.offline_dropped = 0
+        self.forward_dropped = 0
+        self._export_stop = threading.Event()
+        self._export_thread: Optional[threading.Thread] = None
+
+    def on_send(self, size: int) -> None:
+        """Frame được đưa vào broker cho 1 client nhận"""
+        with self._lock:
+            self.frames_sent += 1
+            self.bytes_sent += size
+
+    def on_delivered(self, client_id: str, size: int, latency: float) -> None:
+        """Frame đã giao tới callback của client"""
+        with self._lock:
+            self.frames_delivered += 1
+            self.bytes_delivered += size
+            self.latency.observe(latency)
+            counters = self.clients.get(client_id)
+            if counters is None:
+                counters = self.clients[client_id] = ClientCounters()
+            counters.frames += 1
+            counters.bytes += size
+
+    def on_dropped(self, client_id: str) -> None:
+        """Frame bị bỏ do hàng đợi của client đầy"""
+        with self._lock:
+            self.dropped += 1
+            counters = self.clients.get(client_id)
+            if counters is None:
+                counters = self.clients[client_id] = ClientCounters()
+            counters.dropped += 1
+
+    def on_unknown(self) -> None:
+        """Frame tới client không tồn tại và bị bỏ"""
+        with self._lock:
+            self.unknown_recipient += 1
+
+    def on_offline(self) -> None:
+        """Frame tới client offline được lưu vào log"""
+        with self._lock:
+            self.offline_stored += 1
+
+    def on_offline_dropped(self) -> None:
+        """Frame tới client offline bị bỏ (log của client đã đầy)"""
+        with self._lock:
+            self.offline_dropped += 1
+
+    def on_forward_dropped(self, count: int = 1) -> None:
+        """Frame chuyển tiếp sang shard khác bị bỏ (hàng chờ đầy hoặc shard đích không nhận)"""
+        with self._lock:
+            self.forward_dropped += count
+
+    def forget(self, client_id: str) -> None:
+        """Bỏ bộ đếm của client đã huỷ đăng ký"""
+        with self._lock:
+            self.clients.pop(client_id, None)
+
+    def snapshot(self, registered_clients: int = 0, rooms: int = 0) -> BrokerStats:
+        """
+        Chụp số liệu hiện tại
+        Args:
+            registered_clients: Số client đang đăng ký
+            rooms: Số phòng
+        Returns:
+            BrokerStats: Ảnh chụp số liệu
+        """
+        with self._lock:
+            return BrokerStats(
+                registered_clients=registered_clients,
+                rooms=rooms,
+                frames_sent=self.frames_sent,
+                bytes_sent=self.bytes_sent,
+                frames_delivered=self.frames_delivered,
+                bytes_delivered=self.bytes_delivered,
+                dropped=self.dropped,
+                unknown_recipient=self.unknown_recipient,
+                offline_stored=self.offline_stored,
+                offline_dropped=self.offline_dropped,
+                forward_dropped=self.forward_dropped,
+                latency_buckets=self.latency.cumulative(),
+                latency_sum=self.latency.total,
+                latency_count=self.latency.count,
+                per_client={
+                    client_id: {"frames": c.frames, "bytes": c.bytes, "dropped": c.dropped}
+                    for client_id, c in self.clients.items()
+                },
+            )
+
+    def start_export(self, path: str, stats: Callable[[], BrokerStats], interval: float = METRICS_EXPORT_INTERVAL) -> None:
+        """
+        Ghi số liệu ra file Prometheus (textfile collector) theo chu kỳ
+        Args:
+            path: Đường dẫn file .prom
+            stats: Hàm lấy BrokerStats (vd: InMemoryBroker.stats)
+            interval: Chu kỳ ghi (giây)
+        """
+        if self._export_thread is not None:
+            return
+
+        def loop() -> None:
+            while True:
+                write_prometheus(path, stats())
+                if self._export_stop.wait(interval):
+                    return
+
+        self._export_thread = threading.Thread(target=loop, name="broker-metrics", daemon=True)
+        self._export_thread.start()
+
+    def stop_export(self) -> None:
+        """Dừng luồng ghi file số liệu"""
+        self._export_stop.set()
+        if self._export_thread is not None:
+            self._export_thread.join()
+            self._export_thread = None
+
+
+def _prom_label(value: str) -> str:
+    """Escape giá trị nhãn Prometheus"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_prometheus(stats: BrokerStats) -> str:
+    """
+    Định dạng số liệu theo text exposition format của Prometheus
+    Args:
+        stats: Ảnh chụp số liệu
+    Returns:
+        str: Nội dung file .prom
+    """
+    p = METRICS_PREFIX
+    lines: List[str] = []
+
+    def metric(name: str, kind: str, help_text: str, samples: List[Tuple[str, float]]) -> None:
+        lines.append(f"# HELP {p}_{name} {help_text}")
+        lines.append(f"# TYPE {p}_{name} {kind}")
+        for suffix, value in samples:
+            lines.append(f"{p}_{name}{suffix} {value}")
+
+    metric("registered_clients", "gauge", "Số client đang đăng ký", [("", stats.registered_clients)])
+    metric("rooms", "gauge", "Số phòng", [("", stats.rooms)])
+    metric("frames_sent_total", "counter", "Frame đưa vào broker", [("", stats.frames_sent)])
+    metric("bytes_sent_total", "counter", "Bytes đưa vào broker", [("", stats.bytes_sent)])
+    metric("frames_delivered_total", "counter", "Frame đã giao", [("", stats.frames_delivered)])
+    metric("bytes_delivered_total", "counter", "Bytes đã giao", [("", stats.bytes_delivered)])
+    metric("dropped_total", "counter", "Frame bị bỏ do hàng đợi đầy", [("", stats.dropped)])
+    metric("unknown_recipient_total", "counter", "Frame tới client không tồn tại", [("", stats.unknown_recipient)])
+    metric("offline_stored_total", "counter", "Frame lưu vào log offline", [("", stats.offline_stored)])
+    metric("offline_dropped_total", "counter", "Frame tới client offline bị bỏ do log của client đầy", [("", stats.offline_dropped)])
+    metric("forward_dropped_total", "counter", "Frame bị bỏ khi chuyển tiếp sang shard khác", [("", stats.forward_dropped)])
+
+    buckets = [("_bucket{le=\"+Inf\"}" if bound == float("inf") else f"_bucket{{le=\"{bound}\"}}", count) for bound, count in stats.latency_buckets]
+    metric("delivery_latency_seconds", "histogram", "Độ trễ giao frame", buckets + [("_sum", stats.latency_sum), ("_count", stats.latency_count)])
+
+    for name, key, help_text in (
+        ("client_frames_delivered_total", "frames", "Frame đã giao theo client"),
+        ("client_bytes_delivered_total", "bytes", "Bytes đã giao theo client"),
+        ("client_dropped_total", "dropped", "Frame bị bỏ theo client"),
+    ):
+        metric(name, "counter", help_text, [
+            (f"{{client_id=\"{_prom_label(client_id)}\"}}", counters[key])
+            for client_id, counters in stats.per_client.items()
+        ])
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str, stats: BrokerStats) -> None:
+    """
+    Ghi số liệu ra file (ghi file tạm rồi đổi tên để collector không đọc file dở)
+    Args:
+        path: Đường dẫn file .prom
+        stats: Ảnh chụp số liệu
+    """
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(format_prometheus(stats))
+    os.replace(tmp, path)
+
+
+class FlushTimer:
+    """
+    Luồng hẹn giờ dùng chung cho mọi hàng đợi gom frame của broker
+    (1 heap deadline thay vì 1 threading.Timer cho mỗi lô)
+    """
+
+    def __init__(self) -> None:
+        """Khởi tạo timer (luồng nền chạy khi có lịch đầu tiên)"""
+        self._heap: List[Tuple[float, int, Callable[[], None]]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def call_later(self, delay: float, fn: Callable[[], None]) -> None:
+        """
+        Gọi fn trên luồng timer sau delay giây (fn phải chạy nhanh)
+        Args:
+            delay: Thời gian chờ (giây)
+            fn: Hàm cần gọi
+        """
+        with self._cond:
+            if self._closed:
+                return
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="broker-flush", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self) -> None:
+        """Luồng nền: gọi các hàm tới hạn theo thứ tự deadline"""
+        while True:
+            with self._cond:
+                while not self._closed:
+                    now = time.monotonic()
+                    if self._heap and self._heap[0][0] <= now:
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                if self._closed:
+                    return
+                _, _, fn = heapq.heappop(self._heap)
+            try:
+                fn()
+            except Exception:  # noqa: BLE001
+                pass
+
+    def close(self) -> None:
+        """Dừng timer, bỏ các lịch chưa tới hạn"""
+        with self._cond:
+            self._closed = True
+            self._heap.clear()
+            self._cond.notify()
+
+
+class DeliveryQueue:
+    """
+    Hàng đợi giao frame có giới hạn của một client
+    - Người gửi chỉ đưa frame vào hàng đợi rồi trả về ngay
+    - Mỗi hàng đợi có tối đa 1 tác vụ tiêu thụ chạy trên pool của broker,
+      nên frame được giao đúng thứ tự và client chậm không làm chậm người gửi
+    - Chế độ gom frame (có deliver_many + coalesce): frame đầu tiên của lô
+      hẹn giờ flush sau coalesce.window, đủ coalesce.max_frames thì flush
+      ngay; mỗi lô là 1 lần gọi deliver_many
+    """
+
+    def __init__(self, deliver: FrameDelivery, pool: ThreadPoolExecutor, maxsize: int, overflow: OverflowPolicy, block_timeout: float = DELIVERY_BLOCK_TIMEOUT, metrics: Optional[BrokerMetrics] = None, client_id: str = "", deliver_many: Optional[BatchDelivery] = None, coalesce: Optional[Coalescing] = None, timer: Optional[FlushTimer] = None) -> None:
+        """
+        Khởi tạo hàng đợi
+        Args:
+            deliver: Callback giao frame cho client
+            pool: Thread pool chạy tác vụ tiêu thụ
+            maxsize: Số frame tối đa trong hàng đợi
+            overflow: Chính sách khi hàng đợi đầy
+            block_timeout: Thời gian chờ tối đa với chính sách BLOCK
+            metrics: Nơi ghi số liệu (None = không đo)
+            client_id: ID client nhận (nhãn của số liệu)
+            deliver_many: Callback giao cả lô frame (None = giao từng frame)
+            coalesce: Cấu hình gom frame (None = giao ngay, lô là những gì đang chờ)
+            timer: Timer hẹn giờ flush (bắt buộc khi coalesce.window > 0)
+        Raises:
+            ValueError: Nếu coalesce thiếu deliver_many hoặc timer
+        """
+        if coalesce is not None and (deliver_many is None or (coalesce.window > 0 and timer is None)):
+            raise ValueError("Gom frame cần deliver_many và FlushTimer")
+        self.deliver = deliver
+        self.deliver_many = deliver_many
+        self.coalesce = coalesce
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self._pool = pool
+        self._frames: Deque[bytes] = deque()
+        self._metrics = metrics
+        self._client_id = client_id
+        # Thời điểm vào hàng đợi của từng frame (chỉ khi có metrics)
+        self._stamps: Optional[Deque[float]] = deque() if metrics is not None else None
+        self._cond = threading.Condition()
+        self._scheduled = False
+        self._closed = False
+        self._timer = timer
+        # Thế hệ của lịch flush đang chờ (0 = không có); lịch cũ bị bỏ qua
+        self._armed = 0
+        self._generation = 0
+        self._batch = coalesce.max_frames if coalesce is not None else DELIVERY_BATCH
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def _schedule(self) -> bool:
+        """
+        Lên lịch tiêu thụ sau khi thêm frame (gọi khi giữ lock)
+        Returns:
+            bool: True nếu người gọi cần submit _drain lên pool
+        """
+        coalesce = self.coalesce
+        if self._scheduled:
+            if self._armed and len(self._frames) >= self._batch:
+                # Đủ lô trước khi hết thời gian gom: flush ngay
+                self._armed = 0
+                return True
+            return False
+        self._scheduled = True
+        if coalesce is not None and coalesce.window > 0 and len(self._frames) < self._batch:
+            self._arm()
+            return False
+        return True
+
+    def _arm(self) -> None:
+        """Hẹn giờ flush lô hiện tại (gọi khi giữ lock)"""
+        self._generation += 1
+        generation = self._armed = self._generation
+        self._timer.call_later(self.coalesce.window, lambda: self._flush(generation))  # type: ignore[union-attr]
+
+    def _flush(self, generation: int) -> None:
+        """Hết thời gian gom (chạy trên luồng timer): giao lô trên pool"""
+        with self._cond:
+            if self._armed != generation or self._closed:
+                return
+            self._armed = 0
+        self._pool.submit(self._drain)
+
+    def put(self, frame: bytes) -> None:
+        """
+        Đưa frame vào hàng đợi và lên lịch tiêu thụ nếu cần
+        Args:
+            frame: Frame bản mã
+        Raises:
+            QueueFull: Nếu hàng đợi đầy (REJECT, hoặc BLOCK quá thời gian chờ)
+        """
+        with self._cond:
+            if self._closed:
+                return
+            if len(self._frames) >= self.maxsize:
+                if self.overflow is OverflowPolicy.DROP_OLDEST:
+                    self._frames.popleft()
+                    self.dropped += 1
+                    if self._stamps is not None:
+                        self._stamps.popleft()
+                        self._metrics.on_dropped(self._client_id)  # type: ignore[union-attr]
+                elif self.overflow is OverflowPolicy.REJECT:
+                    raise QueueFull("Hàng đợi của client nhận đã đầy")
+                elif not self._cond.wait_for(lambda: len(self._frames) < self.maxsize or self._closed, self.block_timeout):
+                    raise QueueFull("Hết thời gian chờ hàng đợi của client nhận")
+                if self._closed:
+                    return
+            self._frames.append(frame)
+            if self._stamps is not None:
+                self._stamps.append(time.perf_counter())
+            if not self._schedule():
+                return
+        self._pool.submit(self._drain)
+
+    def put_many(self, frames: List[bytes]) -> None:
+        """
+        Đưa cả lô frame vào hàng đợi, không áp giới hạn maxsize
+        (dùng để giao backlog offline - số frame đã bị giới hạn bởi log)
+        Args:
+            frames: Các frame theo thứ tự
+        """
+        if not frames:
+            return
+        with self._cond:
+            if self._closed:
+                return
+            self._frames.extend(frames)
+            if self._stamps is not None:
+                self._stamps.extend([time.perf_counter()] * len(frames))
+            if not self._schedule():
+                return
+        self._pool.submit(self._drain)
+
+    def _drain(self) -> None:
+        """
+        Tác vụ tiêu thụ: giao lần lượt các frame cho tới khi hàng đợi rỗng
+        Sau DELIVERY_BATCH frame thì xếp lại cuối pool để client chậm không
+        chiếm luồng giao của các client khác
+        """
+        if self.deliver_many is not None:
+            self._drain_batch()
+            return
+        for _ in range(DELIVERY_BATCH):
+            with self._cond:
+                if not self._frames or self._closed:
+                    self._scheduled = False
+                    self._cond.notify_all()
+                    return
+                frame = self._frames.popleft()
+                stamp = self._stamps.popleft() if self._stamps is not None else 0.0
+                self._cond.notify_all()
+            try:
+                self.deliver(frame)
+            except Exception:  # noqa: BLE001
+                # Lỗi của client nhận không được làm dừng hàng đợi
+                pass
+            if self._metrics is not None:
+                self._metrics.on_delivered(self._client_id, len(frame), time.perf_counter() - stamp)
+        self._pool.submit(self._drain)
+
+    def _drain_batch(self) -> None:
+        """
+        Tác vụ tiêu thụ ở chế độ lô: giao tối đa 1 lô qua deliver_many, rồi
+        hẹn giờ lô kế tiếp (hoặc xếp lại cuối pool nếu đã đủ lô)
+        """
+        with self._cond:
+            if not self._frames or self._closed:
+                self._scheduled = False
+                self._cond.notify_all()
+                return
+            count = min(len(self._frames), self._batch)
+            frames = [self._frames.popleft() for _ in range(count)]
+            stamps = [self._stamps.popleft() for _ in range(count)] if self._stamps is not None else None
+            self._cond.notify_all()
+        try:
+            self.deliver_many(frames)  # type: ignore[misc]
+        except Exception:  # noqa: BLE001
+            # Lỗi của client nhận không được làm dừng hàng đợi
+            pass
+        if stamps is not None:
+            now = time.perf_counter()
+            for frame, stamp in zip(frames, stamps):
+                self._metrics.on_delivered(self._client_id, len(frame), now - stamp)  # type: ignore[union-attr]
+        with self._cond:
+            if not self._frames or self._closed:
+                self._scheduled = False
+                self._cond.notify_all()
+                return
+            coalesce = self.coalesce
+            if coalesce is not None and coalesce.window > 0 and len(self._frames) < self._batch:
+                self._arm()
+                return
+        self._pool.submit(self._drain)
+
+    def wait_empty(self, timeout: Optional[float] = None) -> bool:
+        """
+        Chờ tới khi mọi frame đã được giao
+        Args:
+            timeout: Thời gian chờ tối đa (None = chờ mãi)
+        Returns:
+            bool: True nếu hàng đợi đã rỗng
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._frames and not self._scheduled, timeout)
+
+    def close(self) -> None:
+        """Đóng hàng đợi, bỏ các frame chưa giao"""
+        with self._cond:
+            self._closed = True
+            self._frames.clear()
+            if self._stamps is not None:
+                self._stamps.clear()
+            if self._armed:
+                # Lịch flush đang chờ sẽ bị bỏ qua
+                self._armed = 0
+                self._scheduled = False
+            self._cond.notify_all()
+
+
 class ClientRegistration:
     """
     Thông tin đăng ký client trong broker
     - client_id: ID duy nhất của client
     - display_name: Tên hiển thị của client
     - public_key_bytes: Khoá công khai X25519
-    - deliver: Callback để nhận tin nhắn mã hoá
+    - deliver: Callback để nhận frame bản mã
+    - queue: Hàng đợi giao frame (tạo khi có frame đầu tiên, None nếu giao trực tiếp)
+    - handle: Handle số nguyên do ClientRegistry cấp (-1 nếu chưa đăng ký)
+    - queue_size: Kích thước hàng đợi (0 = giao trực tiếp, -1 = đã huỷ đăng ký)
+    - overflow: Chính sách khi hàng đợi đầy (None = mặc định của broker)
+    - deliver_many: Callback nhận cả lô frame (None = nhận từng frame qua deliver)
+    - coalesce: Cấu hình gom frame (None = giao ngay)
+
+    Dùng __slots__ thay cho dataclass: không có __dict__ cho mỗi client.
+    """
+    __slots__ = ("client_id", "display_name", "public_key_bytes", "deliver", "queue", "handle", "queue_size", "overflow", "deliver_many", "coalesce")
+
+    def __init__(
+        self,
+        client_id: str,
+        display_name: str,
+        public_key_bytes: bytes,
+        deliver: FrameDelivery,
+        queue: Optional[DeliveryQueue] = None,
+        handle: int = -1,
+        queue_size: int = 0,
+        overflow: Optional[OverflowPolicy] = None,
+        deliver_many: Optional[BatchDelivery] = None,
+        coalesce: Optional[Coalescing] = None,
+    ) -> None:
+        self.client_id = client_id
+        self.display_name = display_name
+        self.public_key_bytes = public_key_bytes
+        self.deliver = deliver
+        self.queue = queue
+        self.handle = handle
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.deliver_many = deliver_many
+        self.coalesce = coalesce
+
+    def __repr__(self) -> str:
+        return f"ClientRegistration(client_id={self.client_id!r}, display_name={self.display_name!r}, handle={self.handle})"
+
+
+class ClientRegistry:
+    """
+    Registry client chia shard, an toàn khi nhiều luồng gửi cùng lúc
+    - Mỗi client_id được gán 1 handle số nguyên liên tục (tái sử dụng khi
+      giải phóng); bên trong broker (phòng, ...) chỉ giữ handle, chuỗi ID
+      chỉ xuất hiện ở API
+    - Bản ghi đăng ký nằm trong mảng theo handle: tra theo handle là 1 phép index
+    - Shard: dict client_id -> handle với lock riêng, chọn theo hash(client_id)
+    - Handle được đếm tham chiếu: 1 cho đăng ký, 1 cho mỗi phòng tham gia
+      (client offline vẫn giữ handle khi còn là thành viên phòng)
+    - Đọc trên đường gửi (get/by_handle) không lấy lock: dict.get và
+      list[index] là thao tác nguyên tử cả trên CPython thường lẫn free-threaded
+    """
+
+    def __init__(self, shards: int = REGISTRY_SHARDS) -> None:
+        """
+        Khởi tạo registry rỗng
+        Args:
+            shards: Số shard (làm tròn lên luỹ thừa của 2)
+        Raises:
+            ValueError: Nếu shards < 1
+        """
+        if shards < 1:
+            raise ValueError("Số shard phải >= 1")
+        count = 1 << (shards - 1).bit_length()
+        self._mask = count - 1
+        self._shards: List[Dict[str, int]] = [{} for _ in range(count)]
+        self._locks = [threading.Lock() for _ in range(count)]
+        # Các cột theo handle, chỉ ghi khi giữ _alloc_lock
+        self._alloc_lock = threading.Lock()
+        self._ids: List[Optional[str]] = []
+        self._records: List[Optional[ClientRegistration]] = []
+        self._refs = array("I")
+        # Handle giải phóng được dùng lại theo thứ tự FIFO để người gửi đang
+        # giữ handle cũ gần như không thể gặp client mới dùng lại handle đó
+        self._free: Deque[int] = deque()
+        self._count = 0
+
+    def _index(self, client_id: str) -> int:
+        """Chỉ số shard của client_id"""
+        return hash(client_id) & self._mask
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, client_id: object) -> bool:
+        return isinstance(client_id, str) and self.get(client_id) is not None
+
+    def _acquire(self, shard: Dict[str, int], client_id: str) -> int:
+        """Lấy handle của client_id và tăng tham chiếu (gọi khi giữ lock shard)"""
+        handle = shard.get(client_id)
+        with self._alloc_lock:
+            if handle is None:
+                if self._free:
+                    handle = self._free.popleft()
+                    self._ids[handle] = client_id
+                else:
+                    handle = len(self._ids)
+                    self._ids.append(client_id)
+                    self._records.append(None)
+                    self._refs.append(0)
+                shard[client_id] = handle
+            self._refs[handle] += 1
+        return handle
+
+    def _release(self, shard: Dict[str, int], handle: int) -> None:
+        """Giảm tham chiếu, giải phóng handle khi về 0 (gọi khi giữ lock shard)"""
+        with self._alloc_lock:
+            self._refs[handle] -= 1
+            if self._refs[handle]:
+                return
+            client_id = self._ids[handle]
+            self._ids[handle] = None
+            self._records[handle] = None
+            self._free.append(handle)
+        del shard[client_id]  # type: ignore[arg-type]
+
+    def intern(self, client_id: str) -> int:
+        """
+        Lấy handle của client_id (cấp mới nếu chưa có) và giữ 1 tham chiếu
+        Args:
+            client_id: ID của client
+        Returns:
+            int: Handle
+        """
+        index = self._index(client_id)
+        with self._locks[index]:
+            return self._acquire(self._shards[index], client_id)
+
+    def release(self, handle: int) -> None:
+        """
+        Trả 1 tham chiếu đã lấy bằng intern()
+        Args:
+            handle: Handle của client
+        """
+        client_id = self._ids[handle]
+        if client_id is None:
+            return
+        index = self._index(client_id)
+        with self._locks[index]:
+            self._release(self._shards[index], handle)
+
+    def handle_of(self, client_id: str) -> Optional[int]:
+        """
+        Handle hiện tại của client_id (không lấy lock)
+        Args:
+            client_id: ID của client
+        Returns:
+            int | None: Handle nếu client_id đang được tham chiếu
+        """
+        return self._shards[hash(client_id) & self._mask].get(client_id)
+
+    def id_of(self, handle: int) -> Optional[str]:
+        """
+        client_id của handle
+        Args:
+            handle: Handle của client
+        Returns:
+            str | None: ID nếu handle đang được dùng
+        """
+        return self._ids[handle]
+
+    def by_handle(self, handle: int) -> Optional[ClientRegistration]:
+        """
+        Tìm đăng ký theo handle (không lấy lock)
+        Args:
+            handle: Handle của client
+        Returns:
+            ClientRegistration | None: Đăng ký nếu client đang online
+        """
+        return self._records[handle]
+
+    def get(self, client_id: str) -> Optional[ClientRegistration]:
+        """
+        Tìm client (không lấy lock)
+        Args:
+            client_id: ID của client
+        Returns:
+            ClientRegistration | None: Đăng ký của client nếu có
+        """
+        handle = self._shards[hash(client_id) & self._mask].get(client_id)
+        if handle is None:
+            return None
+        registration = self._records[handle]
+        # Handle có thể vừa được giải phóng và cấp lại cho client khác
+        if registration is None or registration.client_id != client_id:
+            return None
+        return registration
+
+    def add(self, registration: ClientRegistration) -> Optional[ClientRegistration]:
+        """
+        Thêm hoặc thay thế đăng ký, gán registration.handle
+        Args:
+            registration: Đăng ký của client
+        Returns:
+            ClientRegistration | None: Đăng ký cũ bị thay thế (nếu có)
+        """
+        index = self._index(registration.client_id)
+        shard = self._shards[index]
+        with self._locks[index]:
+            handle = shard.get(registration.client_id)
+            previous = self._records[handle] if handle is not None else None
+            if previous is None:
+                handle = self._acquire(shard, registration.client_id)
+            registration.handle = handle  # type: ignore[assignment]
+            with self._alloc_lock:
+                self._records[handle] = registration  # type: ignore[index]
+                if previous is None:
+                    self._count += 1
+        return previous
+
+    def pop(self, client_id: str) -> Optional[ClientRegistration]:
+        """
+        Xoá client khỏi registry
+        Args:
+            client_id: ID của client
+        Returns:
+            ClientRegistration | None: Đăng ký đã xoá nếu có
+        """
+        index = self._index(client_id)
+        shard = self._shards[index]
+        with self._locks[index]:
+            handle = shard.get(client_id)
+            if handle is None or self._records[handle] is None:
+                return None
+            with self._alloc_lock:
+                registration = self._records[handle]
+                self._records[handle] = None
+                self._count -= 1
+            self._release(shard, handle)
+        return registration
+
+    def update(self, client_id: str, fn: Callable[[ClientRegistration], None]) -> bool:
+        """
+        Sửa đăng ký của client dưới lock của shard
+        Args:
+            client_id: ID của client
+            fn: Hàm sửa đăng ký
+        Returns:
+            bool: False nếu client không tồn tại
+        """
+        index = self._index(client_id)
+        with self._locks[index]:
+            registration = self.get(client_id)
+            if registration is None:
+                return False
+            fn(registration)
+            return True
+
+    def values(self) -> Iterator[ClientRegistration]:
+        """
+        Duyệt mọi đăng ký (trên bản copy của mảng bản ghi, không chặn writer)
+        Returns:
+            Iterator[ClientRegistration]: Các đăng ký
+        """
+        for registration in self._records.copy():
+            if registration is not None:
+                yield registration
+
+    def snapshot(self) -> Dict[str, ClientRegistration]:
+        """
+        Chụp danh sách client hiện tại
+        Returns:
+            Dict[str, ClientRegistration]: client_id -> đăng ký
+        """
+        return {registration.client_id: registration for registration in self.values()}
+
+
+class Room:
+    """
+    Phòng chat trong broker
+    - members: tập handle của thành viên (bất biến, thay cả tập khi có thay
+      đổi nên send_to_room duyệt không cần lock)
+    - events: DeltaStream thay đổi thành viên (key = client_id, value = None,
+      DELTA_RESET mang danh sách client_id)
+    - Thành viên giữ nguyên khi client offline, chỉ mất khi leave_room
+    """
+
+    def __init__(self, room_id: str, name: str, id_of: Callable[[int], Optional[str]]) -> None:
+        """
+        Khởi tạo phòng rỗng
+        Args:
+            room_id: ID của phòng
+            name: Tên phòng
+            id_of: Hàm đổi handle thành client_id (ClientRegistry.id_of)
+        """
+        self.room_id = room_id
+        self.name = name
+        self.members: FrozenSet[int] = frozenset()
+        self._id_of = id_of
+        self.events = DeltaStream(self.member_ids)
+
+    def member_ids(self) -> List[str]:
+        """Danh sách client_id thành viên (đã sắp xếp)"""
+        return sorted(filter(None, map(self._id_of, self.members)))
+
+
+class Broker(ABC):
     """
-    client_id: str
-    display_name: str
-    public_key_bytes: bytes
-    deliver: CipherDelivery
+    Giao diện chung của broker (trong bộ nhớ hoặc qua mạng)
+    - register_client / unregister_client / update_public_key / list_clients
+    - subscribe_presence / unsubscribe_presence: nhận thay đổi danh sách client
+    - create_room / join_room / leave_room / room_members / subscribe_room:
+      quản lý phòng và nhận thay đổi thành viên
+    - send_to_room: chuyển 1 frame tới mọi thành viên phòng trong 1 lệnh
+    - send_frame / send_frame_many: chuyển tiếp frame như bytes
+    - send_ciphertext / send_ciphertext_many: đóng gói frame rồi chuyển tiếp
+    """
+
+    @abstractmethod
+    def register_client(self, display_name: str, public_key_bytes: bytes, deliver: FrameDelivery, client_id: Optional[str] = None) -> str:
+        """Đăng ký client, trả về client_id (client_id cũ khi đăng ký lại)"""
+
+    @abstractmethod
+    def unregister_client(self, client_id: str) -> None:
+        """Hủy đăng ký client"""
+
+    @abstractmethod
+    def update_public_key(self, client_id: str, public_key_bytes: bytes) -> None:
+        """Cập nhật khoá công khai của client"""
+
+    @abstractmethod
+    def list_clients(self) -> Dict[str, ClientRegistration]:
+        """Danh sách client đang đăng ký theo client_id"""
+
+    @abstractmethod
+    def subscribe_presence(self, callback: DeltaCallback, since: Optional[int] = None) -> int:
+        """Đăng ký nhận thay đổi danh sách client, trả về token"""
+
+    @abstractmethod
+    def unsubscribe_presence(self, token: int) -> None:
+        """Huỷ đăng ký nhận thay đổi danh sách client"""
+
+    @abstractmethod
+    def create_room(self, name: str = "", room_id: Optional[str] = None) -> str:
+        """Tạo phòng, trả về room_id"""
+
+    @abstractmethod
+    def join_room(self, room_id: str, client_id: str) -> None:
+        """Thêm client vào phòng"""
+
+    @abstractmethod
+    def leave_room(self, room_id: str, client_id: str) -> None:
+        """Xoá client khỏi phòng"""
+
+    @abstractmethod
+    def room_members(self, room_id: str) -> List[str]:
+        """Danh sách client_id thành viên phòng"""
+
+    @abstractmethod
+    def subscribe_room(self, room_id: str, callback: DeltaCallback, since: Optional[int] = None) -> int:
+        """Đăng ký nhận thay đổi thành viên phòng, trả về token"""
+
+    @abstractmethod
+    def unsubscribe_room(self, room_id: str, token: int) -> None:
+        """Huỷ đăng ký nhận thay đổi thành viên phòng"""
+
+    @abstractmethod
+    def send_to_room(self, room_id: str, frame: bytes, exclude: Optional[str] = None) -> int:
+        """Chuyển 1 frame tới mọi thành viên phòng, trả về số client đã nhận"""
 
+    @abstractmethod
+    def send_frame(self, to_client_id: str, frame: bytes) -> bool:
+        """Chuyển tiếp frame tới client nhận, False nếu client không tồn tại"""
 
-class InMemoryBroker:
+    @abstractmethod
+    def send_frame_many(self, to_client_ids: Iterable[str], frame: bytes, exclude: Optional[str] = None) -> int:
+        """Chuyển tiếp 1 frame tới nhiều client, trả về số client đã nhận"""
+
+    def send_ciphertext(self, from_client_id: str, to_client_id: str, from_public_key_bytes: bytes, nonce: bytes, ciphertext: bytes, flags: int = 0) -> bool:
+        """
+        Đóng gói bản mã thành frame và chuyển tiếp từ client này sang client khác
+        Args:
+            from_client_id: ID của client gửi
+            to_client_id: ID của client nhận
+            from_public_key_bytes: Khoá công khai của client gửi
+            nonce: Nonce đã sử dụng khi mã hoá
+            ciphertext: Bản mã cần chuyển tiếp
+            flags: Cờ frame (app.wire.FLAG_*)
+        Returns:
+            bool: False nếu client nhận không tồn tại
+        """
+        frame = encode_frame(from_client_id, from_public_key_bytes, nonce, ciphertext, flags)
+        return self.send_frame(to_client_id, frame)
+
+    def send_ciphertext_many(self, from_client_id: str, to_client_ids: Iterable[str], key_id: bytes, nonce: bytes, ciphertext: bytes, flags: int = 0) -> int:
+        """
+        Đóng gói bản mã thành 1 frame và chuyển tiếp tới nhiều client
+        Args:
+            from_client_id: ID của client gửi
+            to_client_ids: Danh sách ID client nhận
+            key_id: Khoá công khai người gửi hoặc group_id (với FLAG_GROUP)
+            nonce: Nonce đã sử dụng khi mã hoá
+            ciphertext: Bản mã cần chuyển tiếp
+            flags: Cờ frame (app.wire.FLAG_*)
+        Returns:
+            int: Số client đã nhận được frame
+        """
+        frame = encode_frame(from_client_id, key_id, nonce, ciphertext, flags)
+        return self.send_frame_many(to_client_ids, frame, exclude=from_client_id)
+
+    def send_ciphertext_to_room(self, from_client_id: str, room_id: str, key_id: bytes, nonce: bytes, ciphertext: bytes, flags: int = 0) -> int:
+        """
+        Đóng gói bản mã thành 1 frame và chuyển tới mọi thành viên phòng (trừ người gửi)
+        Args:
+            from_client_id: ID của client gửi
+            room_id: ID của phòng
+            key_id: Khoá công khai người gửi hoặc group_id (với FLAG_GROUP)
+            nonce: Nonce đã sử dụng khi mã hoá
+            ciphertext: Bản mã cần chuyển tiếp
+            flags: Cờ frame (app.wire.FLAG_*)
+        Returns:
+            int: Số client đã nhận được frame
+        """
+        frame = encode_frame(from_client_id, key_id, nonce, ciphertext, flags)
+        return self.send_to_room(room_id, frame, exclude=from_client_id)
+
+
+class InMemoryBroker(Broker):
     """
     Broker trong bộ nhớ để chuyển tiếp tin nhắn E2EE
     - Singleton pattern để đảm bảo chỉ có 1 broker
     - Quản lý danh sách client đã đăng ký
     - Chuyển tiếp bản mã giữa các client
+    - Mỗi client có hàng đợi giao frame riêng, người gửi không chạy
+      code giải mã/UI của người nhận
+    - Có OfflineLog: frame tới client offline (đã từng đăng ký) được lưu và
+      giao khi client đăng ký lại với cùng client_id và khoá công khai
     """
     _instance: Optional["InMemoryBroker"] = None
 
-    def __init__(self) -> None:
-        """Khởi tạo broker với danh sách client trống"""
-        self.clients: Dict[str, ClientRegistration] = {}
+    def __init__(self, queue_size: Optional[int] = DELIVERY_QUEUE_SIZE, overflow: OverflowPolicy = OverflowPolicy.REJECT, workers: int = DELIVERY_WORKERS, shards: int = REGISTRY_SHARDS, offline: Optional[OfflineLog] = None, metrics: Optional[BrokerMetrics] = None) -> None:
+        """
+        Khởi tạo broker với danh sách client trống
+        Args:
+            queue_size: Kích thước hàng đợi mặc định mỗi client (None = giao trực tiếp)
+            overflow: Chính sách mặc định khi hàng đợi đầy (REJECT: người gửi,
+                thường là GUI thread, không bao giờ bị chặn chờ người nhận)
+            workers: Số luồng giao frame
+            shards: Số shard của registry client
+            offline: Log lưu frame cho client offline (None = bỏ frame)
+            metrics: Nơi ghi số liệu vận hành (None = tắt đo)
+        """
+        self.clients = ClientRegistry(shards)
+        self.offline = offline
+        self.metrics = metrics
+        # Thay đổi danh sách client: key = client_id, value = ClientRegistration
+        self.presence = DeltaStream(self.list_clients)
+        self._rooms: Dict[str, Room] = {}
+        # Chỉ mục thành viên: handle -> các room_id đã tham gia
+        self._room_index: Dict[int, Set[str]] = {}
+        self._rooms_lock = threading.Lock()
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self._workers = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        self._queue_lock = threading.Lock()
+        self._timer: Optional[FlushTimer] = None
 
     @classmethod
     def instance(cls) -> "InMemoryBroker":
@@ -60,32 +1267,140 @@ class InMemoryBroker:
             cls._instance = InMemoryBroker()
         return cls._instance
 
-    def register_client(self, display_name: str, public_key_bytes: bytes, deliver: CipherDelivery) -> str:
+    def _delivery_pool(self) -> ThreadPoolExecutor:
+        """Thread pool giao frame (tạo khi cần)"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="broker-delivery")
+            return self._pool
+
+    def _queue_for(self, registration: ClientRegistration) -> Optional[DeliveryQueue]:
+        """
+        Hàng đợi của client, tạo khi cần (client chưa nhận frame nào không tốn hàng đợi)
+        Returns:
+            DeliveryQueue | None: None nếu client giao trực tiếp hoặc đã huỷ đăng ký
+        """
+        with self._queue_lock:
+            if registration.queue is None and registration.queue_size > 0:
+                registration.queue = DeliveryQueue(
+                    registration.deliver,
+                    self._delivery_pool(),
+                    registration.queue_size,
+                    registration.overflow or self.overflow,
+                    metrics=self.metrics,
+                    client_id=registration.client_id,
+                    deliver_many=registration.deliver_many,
+                    coalesce=registration.coalesce,
+                    timer=self._flush_timer() if registration.coalesce is not None else None,
+                )
+            return registration.queue
+
+    def _flush_timer(self) -> FlushTimer:
+        """Timer hẹn giờ flush của các client gom frame (tạo khi cần)"""
+        with self._pool_lock:
+            if self._timer is None:
+                self._timer = FlushTimer()
+            return self._timer
+
+    def _close_queue(self, registration: ClientRegistration) -> None:
+        """Đánh dấu đăng ký đã huỷ và đóng hàng đợi (frame chưa giao bị bỏ)"""
+        with self._queue_lock:
+            registration.queue_size = -1
+            queue, registration.queue = registration.queue, None
+        if queue is not None:
+            queue.close()
+
+    def register_client(self, display_name: str, public_key_bytes: bytes, deliver: FrameDelivery, client_id: Optional[str] = None, queue_size: Optional[int] = None, overflow: Optional[OverflowPolicy] = None, deliver_many: Optional[BatchDelivery] = None, coalesce: Optional[Coalescing] = None) -> str:
         """
-        Đăng ký client mới vào broker
+        Đăng ký client vào broker
         Args:
             display_name: Tên hiển thị của client
             public_key_bytes: Khoá công khai X25519
-            deliver: Callback để nhận tin nhắn
+            deliver: Callback để nhận frame bản mã (gọi trên luồng giao frame)
+            client_id: ID cũ khi đăng ký lại (None = tạo ID mới); backlog offline
+                của ID này được giao ngay, nếu khoá công khai trùng khoá đã ghi
+                trong log offline
+            queue_size: Kích thước hàng đợi riêng (None = mặc định của broker, 0 = giao trực tiếp)
+            overflow: Chính sách khi hàng đợi đầy (None = mặc định của broker)
+            deliver_many: Callback nhận cả lô frame; khi có, frame đang chờ được
+                giao theo lô thay vì gọi deliver cho từng frame
+            coalesce: Gom frame tối đa coalesce.window giây / coalesce.max_frames
+                frame mỗi lô (None = giao ngay; cửa sổ chat nên để None)
         Returns:
-            str: Client ID duy nhất được tạo
+            str: Client ID
+        Raises:
+            ValueError: Nếu gom frame mà không có deliver_many hoặc hàng đợi
+            BrokerError: Nếu client_id đang offline và đã đăng ký với khoá công khai khác
         """
-        client_id = str(uuid.uuid4())
-        self.clients[client_id] = ClientRegistration(
+        if client_id is None:
+            client_id = str(uuid.uuid4())
+        elif self.offline is not None and client_id not in self.clients:
+            # Chỉ người giữ khoá cũ được nhận lại ID và backlog offline của nó
+            stored = self.offline.public_key(client_id)
+            if stored is not None and stored != bytes(public_key_bytes):
+                raise BrokerError(f"Client ID đã đăng ký với khoá công khai khác: {client_id}")
+        size = self.queue_size if queue_size is None else queue_size
+        if (deliver_many is not None or coalesce is not None) and not size:
+            raise ValueError("Giao theo lô cần hàng đợi (queue_size > 0)")
+        if coalesce is not None and deliver_many is None:
+            raise ValueError("Gom frame cần callback deliver_many")
+        registration = ClientRegistration(
             client_id=client_id,
             display_name=display_name,
             public_key_bytes=public_key_bytes,
             deliver=deliver,
+            queue_size=size or 0,
+            overflow=overflow,
+            deliver_many=deliver_many,
+            coalesce=coalesce,
         )
+        backlog: List[bytes] = []
+        if self.offline is not None:
+            self.offline.remember(client_id, public_key_bytes)
+            backlog = self.offline.take(client_id)
+        if backlog and registration.queue_size:
+            # Backlog vào hàng đợi trước khi client xuất hiện để giữ thứ tự
+            self._queue_for(registration).put_many(backlog)  # type: ignore[union-attr]
+            backlog = []
+        previous = self.clients.add(registration)
+        self.presence.publish(DELTA_JOIN, client_id, registration)
+        if previous is not None:
+            self._close_queue(previous)
+        if self.offline is not None:
+            # Frame lọt vào log trong lúc đang đăng ký
+            backlog += self.offline.take(client_id)
+        for frame in backlog:
+            self._enqueue(registration, frame)
         return client_id
 
     def unregister_client(self, client_id: str) -> None:
         """
-        Hủy đăng ký client khỏi broker
+        Hủy đăng ký client khỏi broker (frame chưa giao bị bỏ)
         Args:
             client_id: ID của client cần hủy đăng ký
         """
-        self.clients.pop(client_id, None)
+        registration = self.clients.pop(client_id)
+        if registration is None:
+            return
+        self.presence.publish(DELTA_LEAVE, client_id)
+        self._close_queue(registration)
+        if self.metrics is not None:
+            self.metrics.forget(client_id)
+
+    def update_public_key(self, client_id: str, public_key_bytes: bytes) -> None:
+        """
+        Cập nhật khoá công khai của client (vd: sau khi đổi khoá phiên)
+        Args:
+            client_id: ID của client
+            public_key_bytes: Khoá công khai X25519 mới
+        """
+        def apply(registration: ClientRegistration) -> None:
+            registration.public_key_bytes = public_key_bytes
+
+        if self.clients.update(client_id, apply):
+            if self.offline is not None:
+                self.offline.remember(client_id, public_key_bytes)
+            self.presence.publish(DELTA_UPDATE, client_id, self.clients.get(client_id))
 
     def list_clients(self) -> Dict[str, ClientRegistration]:
         """
@@ -93,21 +1408,762 @@ class InMemoryBroker:
         Returns:
             Dict[str, ClientRegistration]: Dictionary chứa tất cả client
         """
-        return dict(self.clients)
+        return self.clients.snapshot()
 
-    def send_ciphertext(self, from_client_id: str, to_client_id: str, from_public_key_bytes: bytes, nonce: bytes, ciphertext: bytes) -> None:
+    def subscribe_presence(self, callback: DeltaCallback, since: Optional[int] = None) -> int:
         """
-        Chuyển tiếp bản mã từ client này sang client khác
+        Đăng ký nhận thay đổi danh sách client thay cho việc gọi list_clients định kỳ
         Args:
-            from_client_id: ID của client gửi
-            to_client_id: ID của client nhận
-            from_public_key_bytes: Khoá công khai của client gửi
-            nonce: Nonce đã sử dụng khi mã hoá
-            ciphertext: Bản mã cần chuyển tiếp
+            callback: Hàm nhận DeltaEvent (key = client_id, value = ClientRegistration)
+            since: Phiên bản cuối đã biết để nối lại (None = nhận DELTA_RESET trước)
+        Returns:
+            int: Token để huỷ đăng ký
+        """
+        return self.presence.subscribe(callback, since)
+
+    def unsubscribe_presence(self, token: int) -> None:
+        """
+        Huỷ đăng ký nhận thay đổi danh sách client
+        Args:
+            token: Token trả về từ subscribe_presence()
         """
-        if to_client_id not in self.clients:
+        self.presence.unsubscribe(token)
+
+    def _enqueue(self, registration: ClientRegistration, frame: bytes) -> None:
+        """Đưa frame vào hàng đợi của client (hoặc giao trực tiếp nếu không có)"""
+        queue = registration.queue
+        if queue is None and registration.queue_size:
+            queue = self._queue_for(registration)
+            if queue is None:
+                return  # Client vừa huỷ đăng ký
+        metrics = self.metrics
+        if metrics is None:
+            if queue is not None:
+                queue.put(frame)
+            else:
+                registration.deliver(frame)
             return
-        
-        # Lấy thông tin client nhận và gửi tin nhắn
-        registration = self.clients[to_client_id]
-        registration.deliver(from_client_id, from_public_key_bytes, nonce, ciphertext)
+        metrics.on_send(len(frame))
+        start = time.perf_counter()
+        try:
+            if queue is not None:
+                queue.put(frame)
+                return
+            registration.deliver(frame)
+        except QueueFull:
+            metrics.on_dropped(registration.client_id)
+            raise
+        metrics.on_delivered(registration.client_id, len(frame), time.perf_counter() - start)
+
+    def _undeliverable(self, to_client_id: str, frame: bytes) -> bool:
+        """
+        Xử lý frame tới client không tồn tại
+        - Chỉ lưu vào log offline frame tới client đã từng đăng ký (log có khoá)
+        Returns:
+            bool: True nếu frame được lưu vào log offline
+        """
+        if self.offline is None or self.offline.public_key(to_client_id) is None:
+            if self.metrics is not None:
+                self.metrics.on_unknown()
+            return False
+        if not self.offline.append(to_client_id, frame):
+            if self.metrics is not None:
+                self.metrics.on_offline_dropped()
+            return False
+        if self.metrics is not None:
+            self.metrics.on_offline()
+        return True
+
+    def send_frame(self, to_client_id: str, frame: bytes) -> bool:
+        """
+        Chuyển tiếp frame tới client nhận, không đọc nội dung frame
+        Args:
+            to_client_id: ID của client nhận
+            frame: Frame bản mã (app.wire)
+        Returns:
+            bool: False nếu client nhận không tồn tại (và không có OfflineLog)
+        Raises:
+            QueueFull: Nếu hàng đợi của client nhận đầy (REJECT hoặc BLOCK quá hạn)
+        """
+        registration = self.clients.get(to_client_id)
+        if registration is None:
+            return self._undeliverable(to_client_id, frame)
+        self._enqueue(registration, frame)
+        return True
+
+    def send_frame_many(self, to_client_ids: Iterable[str], frame: bytes, exclude: Optional[str] = None) -> int:
+        """
+        Chuyển tiếp cùng 1 frame (vd: tin nhắn nhóm mã hoá bằng sender key)
+        tới nhiều client, không mã hoá hay copy lại cho từng người
+        Args:
+            to_client_ids: Danh sách ID client nhận
+            frame: Frame bản mã
+            exclude: ID client bỏ qua (thường là người gửi)
+        Returns:
+            int: Số client đã nhận frame vào hàng đợi (client đầy hàng đợi bị bỏ qua)
+        """
+        delivered = 0
+        for to_client_id in to_client_ids:
+            if to_client_id != exclude and self._deliver_one(self.clients.get(to_client_id), to_client_id, frame):
+                delivered += 1
+        return delivered
+
+    def _deliver_one(self, registration: Optional[ClientRegistration], client_id: Optional[str], frame: bytes) -> bool:
+        """
+        Giao frame cho 1 client trong lệnh gửi nhiều người nhận
+        Returns:
+            bool: False nếu frame bị bỏ (client không tồn tại hoặc hàng đợi đầy)
+        """
+        if registration is None:
+            return client_id is not None and self._undeliverable(client_id, frame)
+        try:
+            self._enqueue(registration, frame)
+        except QueueFull:
+            return False
+        return True
+
+    def _room(self, room_id: str) -> Room:
+        """Lấy phòng theo ID (không lấy lock)"""
+        room = self._rooms.get(room_id)
+        if room is None:
+            raise BrokerError(f"Phòng không tồn tại: {room_id}")
+        return room
+
+    def create_room(self, name: str = "", room_id: Optional[str] = None) -> str:
+        """
+        Tạo phòng mới (trả về phòng có sẵn nếu room_id đã tồn tại)
+        Args:
+            name: Tên phòng
+            room_id: ID mong muốn (None = tạo ID mới)
+        Returns:
+            str: ID của phòng
+        """
+        room_id = room_id or str(uuid.uuid4())
+        with self._rooms_lock:
+            if room_id not in self._rooms:
+                self._rooms[room_id] = Room(room_id, name, self.clients.id_of)
+        return room_id
+
+    def _may_join(self, client_id: str) -> bool:
+        """Client được phép vào phòng: đang đăng ký với broker này"""
+        return client_id in self.clients
+
+    def join_room(self, room_id: str, client_id: str) -> None:
+        """
+        Thêm client vào phòng
+        Args:
+            room_id: ID của phòng
+            client_id: ID của client (phải đang đăng ký)
+        Raises:
+            BrokerError: Nếu phòng không tồn tại hoặc client chưa đăng ký
+        """
+        if not self._may_join(client_id):
+            raise BrokerError(f"Client không tồn tại: {client_id}")
+        with self._rooms_lock:
+            room = self._room(room_id)
+            handle = self.clients.handle_of(client_id)
+            if handle is not None and handle in room.members:
+                return
+            # Phòng giữ 1 tham chiếu tới handle cho tới khi client rời phòng
+            handle = self.clients.intern(client_id)
+            room.members = room.members | {handle}
+            self._room_index.setdefault(handle, set()).add(room_id)
+            room.events.publish(DELTA_JOIN, client_id)
+
+    def leave_room(self, room_id: str, client_id: str) -> None:
+        """
+        Xoá client khỏi phòng
+        Args:
+            room_id: ID của phòng
+            client_id: ID của client
+        Raises:
+            BrokerError: Nếu phòng không tồn tại
+        """
+        with self._rooms_lock:
+            room = self._room(room_id)
+            handle = self.clients.handle_of(client_id)
+            if handle is None or handle not in room.members:
+                return
+            room.members = room.members - {handle}
+            rooms = self._room_index.get(handle)
+            if rooms is not None:
+                rooms.discard(room_id)
+                if not rooms:
+                    del self._room_index[handle]
+            self.clients.release(handle)
+            room.events.publish(DELTA_LEAVE, client_id)
+
+    def room_members(self, room_id: str) -> List[str]:
+        """
+        Danh sách thành viên phòng
+        Args:
+            room_id: ID của phòng
+        Returns:
+            List[str]: Các client_id (đã sắp xếp)
+        Raises:
+            BrokerError: Nếu phòng không tồn tại
+        """
+        return self._room(room_id).member_ids()
+
+    def client_rooms(self, client_id: str) -> List[str]:
+        """
+        Các phòng client đang tham gia
+        Args:
+            client_id: ID của client
+        Returns:
+            List[str]: Các room_id (đã sắp xếp)
+        """
+        with self._rooms_lock:
+            handle = self.clients.handle_of(client_id)
+            if handle is None:
+                return []
+            return sorted(self._room_index.get(handle, ()))
+
+    def subscribe_room(self, room_id: str, callback: DeltaCallback, since: Optional[int] = None) -> int:
+        """
+        Đăng ký nhận thay đổi thành viên phòng
+        Args:
+            room_id: ID của phòng
+            callback: Hàm nhận DeltaEvent (key = client_id)
+            since: Phiên bản cuối đã biết để nối lại (None = nhận DELTA_RESET trước)
+        Returns:
+            int: Token để huỷ đăng ký
+        Raises:
+            BrokerError: Nếu phòng không tồn tại
+        """
+        return self._room(room_id).events.subscribe(callback, since)
+
+    def unsubscribe_room(self, room_id: str, token: int) -> None:
+        """
+        Huỷ đăng ký nhận thay đổi thành viên phòng
+        Args:
+            room_id: ID của phòng
+            token: Token trả về từ subscribe_room()
+        """
+        room = self._rooms.get(room_id)
+        if room is not None:
+            room.events.unsubscribe(token)
+
+    def send_to_room(self, room_id: str, frame: bytes, exclude: Optional[str] = None) -> int:
+        """
+        Chuyển 1 frame tới mọi thành viên phòng trong 1 lệnh broker
+        Args:
+            room_id: ID của phòng
+            frame: Frame bản mã
+            exclude: ID client bỏ qua (thường là người gửi)
+        Returns:
+            int: Số client đã nhận frame vào hàng đợi (hoặc vào log offline)
+        Raises:
+            BrokerError: Nếu phòng không tồn tại hoặc người gửi (header frame)
+                không phải thành viên phòng
+            FrameError: Nếu frame không hợp lệ
+        """
+        clients = self.clients
+        members = self._room(room_id).members
+        if clients.handle_of(decode_frame(frame).sender_id) not in members:
+            raise BrokerError("Người gửi không phải thành viên phòng")
+        skip = clients.handle_of(exclude) if exclude is not None else None
+        delivered = 0
+        for handle in members:
+            if handle != skip and self._deliver_one(clients.by_handle(handle), clients.id_of(handle), frame):
+                delivered += 1
+        return delivered
+
+    def stats(self) -> BrokerStats:
+        """
+        Lấy ảnh chụp số liệu của broker
+        Returns:
+            BrokerStats: Số liệu (bộ đếm bằng 0 nếu broker tạo với metrics=None)
+        """
+        if self.metrics is None:
+            return BrokerStats(registered_clients=len(self.clients), rooms=len(self._rooms))
+        return self.metrics.snapshot(len(self.clients), len(self._rooms))
+
+    def queue_depth(self, client_id: str) -> int:
+        """
+        Số frame đang chờ giao cho client
+        Args:
+            client_id: ID của client
+        Returns:
+            int: Độ dài hàng đợi (0 nếu không có)
+        """
+        registration = self.clients.get(client_id)
+        if registration is None or registration.queue is None:
+            return 0
+        return len(registration.queue)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Chờ tới khi mọi hàng đợi đã giao hết frame (dùng khi test/benchmark)
+        Args:
+            timeout: Thời gian chờ tối đa cho mỗi hàng đợi
+        Returns:
+            bool: True nếu mọi hàng đợi đã rỗng
+        """
+        return all(
+            registration.queue.wait_empty(timeout)
+            for registration in self.clients.values()
+            if registration.queue is not None
+        )
+
+
+def parse_broker_url(url: str) -> Tuple[int, object]:
+    """
+    Phân tích URL broker
+    Args:
+        url: "tcp://host:port" hoặc "unix:///đường/dẫn.sock"
+    Returns:
+        Tuple: (socket family, địa chỉ) - địa chỉ là (host, port) hoặc đường dẫn
+    Raises:
+        ValueError: Nếu URL không hợp lệ
+    """
+    if url.startswith("unix://"):
+        path = url[len("unix://"):]
+        if not path:
+            raise ValueError(f"Thiếu đường dẫn socket trong URL: {url}")
+        return socket.AF_UNIX, path
+    if url.startswith("tcp://"):
+        host, sep, port = url[len("tcp://"):].rpartition(":")
+        if not sep or not port.isdigit():
+            raise ValueError(f"URL TCP cần dạng tcp://host:port: {url}")
+        return socket.AF_INET, (host.strip("[]") or "127.0.0.1", int(port))
+    raise ValueError(f"Không hỗ trợ URL broker: {url}")
+
+
+def _no_delivery(frame: bytes) -> None:
+    """Callback giữ chỗ cho client ở xa (frame được chuyển qua server)"""
+
+
+_VERSION = struct.Struct(">Q")
+
+
+def _event_header(event: DeltaEvent) -> List[bytes]:
+    """Các trường chung của OP_EVENT: version, kind, key"""
+    return [_VERSION.pack(event.version), bytes((event.kind,)), event.key.encode("utf-8")]
+
+
+def encode_presence_event(event: DeltaEvent) -> List[bytes]:
+    """
+    Đóng gói sự kiện presence thành các trường của OP_EVENT (sau token)
+    Args:
+        event: Sự kiện với value là ClientRegistration (hoặc snapshot)
+    Returns:
+        List[bytes]: version, kind, client_id, rồi display_name, public_key
+            (DELTA_RESET: các bộ ba client_id, display_name, public_key)
+    """
+    fields = _event_header(event)
+    if event.kind == DELTA_RESET:
+        for client_id, registration in event.value.items():
+            fields += [client_id.encode("utf-8"), registration.display_name.encode("utf-8"), registration.public_key_bytes]
+    elif event.kind != DELTA_LEAVE:
+        fields += [event.value.display_name.encode("utf-8"), event.value.public_key_bytes]
+    return fields
+
+
+def decode_presence_event(fields: List[memoryview]) -> DeltaEvent:
+    """
+    Giải mã các trường OP_EVENT (sau token) thành sự kiện presence
+    Args:
+        fields: Các trường từ encode_presence_event
+    Returns:
+        DeltaEvent: value là ClientRegistration (deliver là callback giữ chỗ)
+    """
+    (version,) = _VERSION.unpack(fields[0])
+    kind = fields[1][0]
+    key = str(fields[2], "utf-8")
+
+    def registration(client_id: str, name: memoryview, public_key: memoryview) -> ClientRegistration:
+        return ClientRegistration(client_id, str(name, "utf-8"), bytes(public_key), _no_delivery)
+
+    value: Any = None
+    if kind == DELTA_RESET:
+        value = {}
+        for i in range(3, len(fields) - 2, 3):
+            client_id = str(fields[i], "utf-8")
+            value[client_id] = registration(client_id, fields[i + 1], fields[i + 2])
+    elif kind != DELTA_LEAVE:
+        value = registration(key, fields[3], fields[4])
+    return DeltaEvent(version, kind, key, value)
+
+
+def encode_room_event(event: DeltaEvent) -> List[bytes]:
+    """
+    Đóng gói sự kiện thành viên phòng thành các trường của OP_EVENT (sau token)
+    Args:
+        event: Sự kiện của Room.events
+    Returns:
+        List[bytes]: version, kind, client_id (DELTA_RESET: kèm các client_id thành viên)
+    """
+    fields = _event_header(event)
+    if event.kind == DELTA_RESET:
+        fields += [client_id.encode("utf-8") for client_id in event.value]
+    return fields
+
+
+def decode_room_event(fields: List[memoryview]) -> DeltaEvent:
+    """
+    Giải mã các trường OP_EVENT (sau token) thành sự kiện thành viên phòng
+    Args:
+        fields: Các trường từ encode_room_event
+    Returns:
+        DeltaEvent: value là danh sách client_id với DELTA_RESET, ngược lại None
+    """
+    (version,) = _VERSION.unpack(fields[0])
+    kind = fields[1][0]
+    value = [str(f, "utf-8") for f in fields[3:]] if kind == DELTA_RESET else None
+    return DeltaEvent(version, kind, str(fields[2], "utf-8"), value)
+
+
+class RemoteBroker(Broker):
+    """
+    Broker client kết nối tới broker server (app.server) qua TCP/Unix socket
+    - Cùng giao diện với InMemoryBroker, ClientWindow dùng thay singleton
+    - Một kết nối dùng chung cho mọi client trong cùng process
+    - Frame được server đẩy về và gọi callback deliver trên luồng đọc socket
+    """
+    _instances: Dict[str, "RemoteBroker"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, url: str, timeout: float = REQUEST_TIMEOUT, secret: Optional[bytes] = None) -> None:
+        """
+        Kết nối tới broker server
+        Args:
+            url: "tcp://host:port" hoặc "unix:///đường/dẫn.sock"
+            timeout: Thời gian chờ tối đa cho mỗi yêu cầu (giây)
+            secret: Khoá bí mật của cluster, gửi OP_AUTH ngay khi kết nối
+                (listener nội bộ giữa các shard; None = không xác thực)
+        """
+        family, address = parse_broker_url(url)
+        self.url = url
+        self.timeout = timeout
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.connect(address)
+        if family == socket.AF_INET:
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if secret is not None:
+            self._sock.sendall(pack_message(OP_AUTH, secret))
+        self._reader = self._sock.makefile("rb")
+        self._send_lock = threading.Lock()
+        self._req_ids = itertools.count(1)
+        self._pending: Dict[int, Future] = {}
+        self._delivers: Dict[str, FrameDelivery] = {}
+        # token -> (callback, hàm giải mã sự kiện)
+        self._subscriptions: Dict[int, Tuple[DeltaCallback, Callable[[List[memoryview]], DeltaEvent]]] = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._read_loop, name="broker-reader", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def connect(cls, url: str, secret: Optional[bytes] = None) -> "RemoteBroker":
+        """
+        Lấy kết nối dùng chung tới broker server theo URL
+        Args:
+            url: URL của broker server
+            secret: Khoá bí mật của cluster (chỉ dùng khi mở kết nối mới)
+        Returns:
+            RemoteBroker: Kết nối dùng chung
+        """
+        with cls._instances_lock:
+            broker = cls._instances.get(url)
+            if broker is None or broker._closed:
+                broker = cls._instances[url] = RemoteBroker(url, secret=secret)
+            return broker
+
+    def _send(self, message: bytes) -> None:
+        """Ghi message ra socket (an toàn khi gọi từ nhiều luồng)"""
+        with self._send_lock:
+            self._sock.sendall(message)
+
+    def _request(self, op: int, *fields: bytes) -> List[memoryview]:
+        """Gửi yêu cầu và chờ server trả lời"""
+        req_id = next(self._req_ids)
+        future: Future = Future()
+        self._pending[req_id] = future
+        try:
+            self._send(pack_message(op, struct.pack(">I", req_id), *fields))
+            return future.result(self.timeout)
+        except FutureTimeout:
+            raise BrokerError(f"Broker server không trả lời sau {self.timeout} giây") from None
+        finally:
+            self._pending.pop(req_id, None)
+
+    def _read_loop(self) -> None:
+        """Luồng nền: đọc message từ server và phân phối"""
+        try:
+            while True:
+                header = self._reader.read(MSG_LENGTH_BYTES)
+                if len(header) < MSG_LENGTH_BYTES:
+                    break
+                body = self._reader.read(read_message_length(header))
+                op, fields = unpack_message(body)
+                if op == OP_DELIVER:
+                    deliver = self._delivers.get(str(fields[0], "utf-8"))
+                    if deliver is not None:
+                        try:
+                            deliver(fields[1])
+                        except Exception:  # noqa: BLE001
+                            # Lỗi của client nhận không được làm dừng luồng đọc
+                            pass
+                    continue
+                if op == OP_EVENT:
+                    (token,) = struct.unpack(">I", fields[0])
+                    subscription = self._subscriptions.get(token)
+                    if subscription is not None:
+                        callback, decode = subscription
+                        try:
+                            callback(decode(fields[1:]))
+                        except Exception:  # noqa: BLE001
+                            # Lỗi của callback sự kiện không được làm dừng luồng đọc
+                            pass
+                    continue
+                (req_id,) = struct.unpack(">I", fields[0])
+                future = self._pending.get(req_id)
+                if future is None:
+                    continue
+                if op == OP_REPLY:
+                    future.set_result(fields[1:])
+                elif op == OP_ERROR:
+                    future.set_exception(BrokerError(str(fields[1], "utf-8")))
+        except (OSError, ValueError, struct.error):
+            pass
+        finally:
+            self._closed = True
+            for future in list(self._pending.values()):
+                if not future.done():
+                    future.set_exception(BrokerError("Mất kết nối tới broker server"))
+
+    def register_client(self, display_name: str, public_key_bytes: bytes, deliver: FrameDelivery, client_id: Optional[str] = None) -> str:
+        """
+        Đăng ký client với broker server
+        Args:
+            display_name: Tên hiển thị của client
+            public_key_bytes: Khoá công khai X25519
+            deliver: Callback nhận frame (gọi trên luồng đọc socket)
+            client_id: ID cũ khi đăng ký lại (None = server cấp ID mới)
+        Returns:
+            str: Client ID do server cấp
+        """
+        fields = [display_name.encode("utf-8"), public_key_bytes]
+        if client_id is not None:
+            # Backlog offline có thể tới trước REPLY
+            self._delivers[client_id] = deliver
+            fields.append(client_id.encode("utf-8"))
+        try:
+            reply = self._request(OP_REGISTER, *fields)
+        except BrokerError:
+            if client_id is not None:
+                self._delivers.pop(client_id, None)
+            raise
+        client_id = str(reply[0], "utf-8")
+        self._delivers[client_id] = deliver
+        return client_id
+
+    def unregister_client(self, client_id: str) -> None:
+        """
+        Hủy đăng ký client khỏi broker server
+        Args:
+            client_id: ID của client cần hủy đăng ký
+        """
+        self._delivers.pop(client_id, None)
+        if not self._closed:
+            self._send(pack_message(OP_UNREGISTER, client_id.encode("utf-8")))
+
+    def update_public_key(self, client_id: str, public_key_bytes: bytes) -> None:
+        """
+        Cập nhật khoá công khai của client trên server
+        Args:
+            client_id: ID của client
+            public_key_bytes: Khoá công khai X25519 mới
+        """
+        self._send(pack_message(OP_UPDATE_KEY, client_id.encode("utf-8"), public_key_bytes))
+
+    def list_clients(self) -> Dict[str, ClientRegistration]:
+        """
+        Lấy danh sách client từ broker server
+        Returns:
+            Dict[str, ClientRegistration]: Client đã đăng ký (deliver là callback giữ chỗ)
+        """
+        reply = self._request(OP_LIST)
+        clients: Dict[str, ClientRegistration] = {}
+        for i in range(0, len(reply) - 2, 3):
+            client_id = str(reply[i], "utf-8")
+            clients[client_id] = ClientRegistration(
+                client_id=client_id,
+                display_name=str(reply[i + 1], "utf-8"),
+                public_key_bytes=bytes(reply[i + 2]),
+                deliver=_no_delivery,
+            )
+        return clients
+
+    def subscribe_presence(self, callback: DeltaCallback, since: Optional[int] = None) -> int:
+        """
+        Đăng ký nhận thay đổi danh sách client từ server
+        Args:
+            callback: Hàm nhận DeltaEvent (gọi trên luồng đọc socket)
+            since: Phiên bản cuối đã biết để nối lại (None = nhận DELTA_RESET trước)
+        Returns:
+            int: Token để huỷ đăng ký
+        """
+        return self._subscribe(TOPIC_PRESENCE, callback, decode_presence_event, since)
+
+    def _subscribe(self, topic: bytes, callback: DeltaCallback, decode: Callable[[List[memoryview]], DeltaEvent], since: Optional[int]) -> int:
+        """Gửi OP_SUBSCRIBE cho topic, sự kiện về được giải mã bằng decode"""
+        token = next(self._req_ids)
+        self._subscriptions[token] = (callback, decode)
+        since_field = _VERSION.pack(since) if since is not None else b""
+        self._send(pack_message(OP_SUBSCRIBE, struct.pack(">I", token), topic, since_field))
+        return token
+
+    def unsubscribe_presence(self, token: int) -> None:
+        """
+        Huỷ đăng ký nhận thay đổi danh sách client
+        Args:
+            token: Token trả về từ subscribe_presence()
+        """
+        self._unsubscribe(token)
+
+    def _unsubscribe(self, token: int) -> None:
+        """Gửi OP_UNSUBSCRIBE và bỏ callback của token"""
+        self._subscriptions.pop(token, None)
+        if not self._closed:
+            self._send(pack_message(OP_UNSUBSCRIBE, struct.pack(">I", token)))
+
+    def create_room(self, name: str = "", room_id: Optional[str] = None) -> str:
+        """
+        Tạo phòng trên server (trả về phòng có sẵn nếu room_id đã tồn tại)
+        Args:
+            name: Tên phòng
+            room_id: ID mong muốn (None = server tạo ID mới)
+        Returns:
+            str: ID của phòng
+        """
+        reply = self._request(OP_CREATE_ROOM, name.encode("utf-8"), (room_id or "").encode("utf-8"))
+        return str(reply[0], "utf-8")
+
+    def join_room(self, room_id: str, client_id: str) -> None:
+        """
+        Thêm client vào phòng
+        Args:
+            room_id: ID của phòng
+            client_id: ID của client
+        Raises:
+            BrokerError: Nếu phòng không tồn tại
+        """
+        self._request(OP_JOIN_ROOM, room_id.encode("utf-8"), client_id.encode("utf-8"))
+
+    def leave_room(self, room_id: str, client_id: str) -> None:
+        """
+        Xoá client khỏi phòng
+        Args:
+            room_id: ID của phòng
+            client_id: ID của client
+        Raises:
+            BrokerError: Nếu phòng không tồn tại
+        """
+        self._request(OP_LEAVE_ROOM, room_id.encode("utf-8"), client_id.encode("utf-8"))
+
+    def room_members(self, room_id: str) -> List[str]:
+        """
+        Danh sách thành viên phòng
+        Args:
+            room_id: ID của phòng
+        Returns:
+            List[str]: Các client_id (đã sắp xếp)
+        Raises:
+            BrokerError: Nếu phòng không tồn tại
+        """
+        return [str(f, "utf-8") for f in self._request(OP_ROOM_MEMBERS, room_id.encode("utf-8"))]
+
+    def subscribe_room(self, room_id: str, callback: DeltaCallback, since: Optional[int] = None) -> int:
+        """
+        Đăng ký nhận thay đổi thành viên phòng từ server
+        Args:
+            room_id: ID của phòng
+            callback: Hàm nhận DeltaEvent (gọi trên luồng đọc socket)
+            since: Phiên bản cuối đã biết để nối lại (None = nhận DELTA_RESET trước)
+        Returns:
+            int: Token để huỷ đăng ký
+        """
+        return self._subscribe(TOPIC_ROOM_PREFIX + room_id.encode("utf-8"), callback, decode_room_event, since)
+
+    def unsubscribe_room(self, room_id: str, token: int) -> None:
+        """
+        Huỷ đăng ký nhận thay đổi thành viên phòng
+        Args:
+            room_id: ID của phòng
+            token: Token trả về từ subscribe_room()
+        """
+        self._unsubscribe(token)
+
+    def send_to_room(self, room_id: str, frame: bytes, exclude: Optional[str] = None) -> int:
+        """
+        Gửi 1 frame lên server để chuyển tới mọi thành viên phòng và chờ
+        server báo lại số client đã nhận
+        Args:
+            room_id: ID của phòng
+            frame: Frame bản mã
+            exclude: ID client bỏ qua
+        Returns:
+            int: Số client đã nhận frame
+        Raises:
+            BrokerError: Nếu phòng không tồn tại, người gửi không phải thành
+                viên phòng hoặc server không trả lời
+        """
+        reply = self._request(OP_SEND_ROOM_REQ, room_id.encode("utf-8"), (exclude or "").encode("utf-8"), frame)
+        (delivered,) = struct.unpack(">I", reply[0])
+        return delivered
+
+    def send_frame(self, to_client_id: str, frame: bytes) -> bool:
+        """
+        Gửi frame lên server để chuyển tới client nhận (không chờ xác nhận)
+        Args:
+            to_client_id: ID của client nhận
+            frame: Frame bản mã
+        Returns:
+            bool: True nếu đã ghi frame ra socket
+        """
+        self._send(pack_message(OP_SEND, to_client_id.encode("utf-8"), frame))
+        return True
+
+    def send_frame_many(self, to_client_ids: Iterable[str], frame: bytes, exclude: Optional[str] = None) -> int:
+        """
+        Gửi 1 frame lên server để chuyển tới nhiều client (không chờ xác nhận)
+        Args:
+            to_client_ids: Danh sách ID client nhận
+            frame: Frame bản mã
+            exclude: ID client bỏ qua
+        Returns:
+            int: Số client nhận đã yêu cầu
+        """
+        targets = [cid.encode("utf-8") for cid in to_client_ids if cid != exclude]
+        self._send(pack_message(OP_SEND_MANY, (exclude or "").encode("utf-8"), frame, *targets))
+        return len(targets)
+
+    def close(self) -> None:
+        """Đóng kết nối tới broker server"""
+        self._closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+
+def connect_broker(url: Optional[str] = None) -> Broker:
+    """
+    Chọn broker cho client
+    Args:
+        url: URL broker server (None = đọc biến môi trường E2EE_BROKER)
+    Returns:
+        Broker: ClusterBroker với "cluster://<thư mục>", RemoteBroker nếu có URL
+            khác, ngược lại InMemoryBroker.instance()
+    """
+    if url is None:
+        url = os.environ.get(BROKER_URL_ENV)
+    if not url or url == "memory":
+        return InMemoryBroker.instance()
+    if url.startswith("cluster://"):
+        # Import muộn: app.cluster phụ thuộc app.server và module này
+        from .cluster import ClusterBroker
+        return ClusterBroker.connect(url)
+    return RemoteBroker.connect(url)
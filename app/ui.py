@@ -3,9 +3,9 @@ Giao diện người dùng (GUI) cho ứng dụng chat E2EE.
 
 Cung cấp giao diện hiện đại và thân thiện:
 - Quản lý cửa sổ chat và launcher chính
-- Hiển thị tin nhắn với bubble style Messenger
+- Hiển thị tin nhắn với bubble style Messenger (QListView + delegate, ảo hoá)
 - Panel E2EE thời gian thực hiển thị quá trình mã hóa
-- Lưu trữ và khôi phục lịch sử chat
+- Lưu trữ và khôi phục lịch sử chat (kho SQLite, app.history)
 - Responsive design với splitter có thể kéo thả
 
 Tính năng UI/UX:
@@ -17,22 +17,51 @@ Tính năng UI/UX:
 
 from __future__ import annotations
 
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Set, Tuple
 from dataclasses import dataclass
+from collections import OrderedDict
 import os
 import re
-import datetime
-import html as py_html
+import threading
+import weakref
 
 from PySide6 import QtCore, QtGui, QtWidgets
 
-from .crypto import KeyPair, derive_shared_key, encrypt_message, decrypt_message, public_key_bytes
-from .transport import InMemoryBroker, ClientRegistration
+from .crypto import (
+    KeyPair,
+    derive_shared_key,
+    encrypt_message,
+    decrypt_message,
+    public_key_bytes,
+    forget_session_keys,
+    Session,
+    RekeyRequired,
+)
+from .transport import DELTA_LEAVE, DELTA_RESET, BrokerError, ClientRegistration, DeltaEvent, QueueFull, connect_broker
+from .executor import CryptoExecutor
+from .history import EXPORT_SUFFIX, STORE_SUFFIX, ChatMessage, MessageStore, _format_timestamp, list_histories
+from .wire import FLAG_GROUP, FLAG_SENDER_KEY, FLAG_STREAM, decode_frame, encode_frame
 from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PublicKey
 from cryptography.hazmat.primitives import hashes
 
 # Thư mục lưu trữ lịch sử chat
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+CHAT_WINDOW = 200  # Số tin nhắn tối đa giữ trong khung chat khi đang ở cuối danh sách
+CHAT_PAGE = 50  # Số tin nhắn đọc thêm từ kho mỗi lần cuộn tới đầu/cuối
+CHAT_MAX_LOADED = 400  # Số tin nhắn tối đa giữ trong bộ nhớ của khung chat
+BUBBLE_WIDTH_CACHE = 4  # Số độ rộng khung chat giữ cache kích thước bubble
+HISTORY_ROW_HEIGHT = 82  # Chiều cao 1 dòng trong danh sách lịch sử chat của launcher
+AVATAR_SIZE = 50  # Đường kính avatar trong danh sách lịch sử chat
+# Màu avatar theo chữ cái đầu của tên hiển thị
+AVATAR_COLORS = {
+    'A': '#e74c3c', 'B': '#3498db', 'C': '#9b59b6', 'D': '#2ecc71', 'E': '#f39c12',
+    'F': '#e91e63', 'G': '#00bcd4', 'H': '#673ab7', 'I': '#ff5722', 'J': '#795548',
+    'K': '#607d8b', 'L': '#ff9800', 'M': '#4caf50', 'N': '#2196f3', 'O': '#9c27b0',
+    'P': '#ff6f00', 'Q': '#8bc34a', 'R': '#f44336', 'S': '#009688', 'T': '#ffc107',
+    'U': '#3f51b5', 'V': '#cddc39', 'W': '#ff5252', 'X': '#4db6ac', 'Y': '#ffa726',
+    'Z': '#ab47bc'
+}
+AVATAR_DEFAULT_COLOR = '#0084ff'  # Màu avatar cho chữ cái ngoài A-Z
 
 
 class FadeLabel(QtWidgets.QLabel):
@@ -83,48 +112,277 @@ def _safe_filename(name: str) -> str:
     return name or "nguoi-dung"
 
 
-def _wrap_html_with_utf8_meta(html_content: str) -> str:
+class ChatMessageModel(QtCore.QAbstractListModel):
     """
-    Đảm bảo HTML có meta charset UTF-8 để hiển thị tiếng Việt đúng
+    Model tin nhắn cho khung chat (QListView)
+    - Chỉ giữ 1 cửa sổ tin liên tiếp của lịch sử (tối đa CHAT_MAX_LOADED tin),
+      phần còn lại nằm trong kho (MessageStore) và được đọc theo trang
+    - Đang ở cuối danh sách thì giữ khoảng CHAT_WINDOW dòng (trim), nên chi phí
+      layout của view không tăng theo độ dài lịch sử
+    - has_older/has_newer: kho còn tin trước/sau cửa sổ đang giữ
     """
-    if "<meta charset=" in html_content.lower():
-        return html_content
-    head_insert = "<meta charset=\"utf-8\">"
-    if "<head>" in html_content.lower():
-        return re.sub(r"(?i)<head>", "<head>" + head_insert, html_content, count=1)
-    return """<!DOCTYPE html><html><head><meta charset=\"utf-8\"></head><body>{}</body></html>""".format(html_content)
+    MessageRole = QtCore.Qt.ItemDataRole.UserRole + 1
 
+    def __init__(self, parent: Optional[QtCore.QObject] = None) -> None:
+        super().__init__(parent)
+        self._messages: List[ChatMessage] = []
+        self.has_older = False
+        self.has_newer = False
 
-def _format_timestamp() -> str:
-    """Định dạng thời gian hiện tại theo dd/MM/yyyy HH:mm"""
-    return datetime.datetime.now().strftime("%d/%m/%Y %H:%M")
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:  # noqa: N802
+        return 0 if parent.isValid() else len(self._messages)
 
-
-def _format_bubble(sender: str, text: str, outgoing: bool) -> str:
+    def data(self, index: QtCore.QModelIndex, role: int = QtCore.Qt.ItemDataRole.DisplayRole) -> object:
+        if not index.isValid():
+            return None
+        message = self._messages[index.row()]
+        if role == self.MessageRole:
+            return message
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            return message.text
+        if role == QtCore.Qt.ItemDataRole.ToolTipRole:
+            return f"{message.sender} · {message.timestamp}" if message.sender else message.timestamp
+        return None
+
+    def message_at(self, row: int) -> ChatMessage:
+        """Tin nhắn ở dòng row của view (delegate gọi thẳng, không qua data())"""
+        return self._messages[row]
+
+    def first_id(self) -> int:
+        """ID trong kho của tin cũ nhất đang giữ (0 = chưa có tin)"""
+        return self._messages[0].id if self._messages else 0
+
+    def last_id(self) -> int:
+        """ID trong kho của tin mới nhất đang giữ (0 = chưa có tin)"""
+        return self._messages[-1].id if self._messages else 0
+
+    def set_messages(self, messages: List[ChatMessage], has_older: bool = False) -> None:
+        """
+        Thay toàn bộ tin nhắn bằng trang tin mới nhất
+        Args:
+            messages: Các tin theo thứ tự gửi/nhận
+            has_older: Kho còn tin cũ hơn
+        """
+        self.beginResetModel()
+        self._messages = list(messages)
+        self.has_older = has_older
+        self.has_newer = False
+        self.endResetModel()
+
+    def append(self, message: ChatMessage) -> bool:
+        """
+        Thêm tin nhắn vào cuối
+        Returns:
+            bool: False nếu cửa sổ đang không chứa cuối lịch sử (tin sẽ được
+                đọc từ kho khi cuộn xuống)
+        """
+        if self.has_newer:
+            return False
+        row = len(self._messages)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._messages.append(message)
+        self.endInsertRows()
+        return True
+
+    def _drop_front(self, count: int) -> None:
+        """Bỏ count tin cũ nhất khỏi cửa sổ"""
+        if count <= 0:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), 0, count - 1)
+        del self._messages[:count]
+        self.endRemoveRows()
+        self.has_older = True
+
+    def _drop_back(self, count: int) -> None:
+        """Bỏ count tin mới nhất khỏi cửa sổ"""
+        if count <= 0:
+            return
+        row = len(self._messages)
+        self.beginRemoveRows(QtCore.QModelIndex(), row - count, row - 1)
+        del self._messages[row - count:]
+        self.endRemoveRows()
+        self.has_newer = True
+
+    def trim(self) -> None:
+        """
+        Bỏ các tin cũ khi cửa sổ vượt CHAT_WINDOW + CHAT_PAGE dòng
+        (gọi khi view đang ở cuối danh sách)
+        """
+        extra = len(self._messages) - CHAT_WINDOW
+        if extra > CHAT_PAGE:
+            self._drop_front(extra)
+
+    def prepend(self, page: List[ChatMessage], has_older: bool) -> int:
+        """
+        Thêm 1 trang tin cũ vào đầu, bỏ bớt tin mới nhất nếu vượt CHAT_MAX_LOADED
+        Args:
+            page: Các tin ngay trước tin cũ nhất đang giữ
+            has_older: Kho còn tin cũ hơn page
+        Returns:
+            int: Số dòng đã thêm
+        """
+        self.has_older = has_older
+        if page:
+            self.beginInsertRows(QtCore.QModelIndex(), 0, len(page) - 1)
+            self._messages[:0] = page
+            self.endInsertRows()
+            self._drop_back(len(self._messages) - CHAT_MAX_LOADED)
+        return len(page)
+
+    def extend(self, page: List[ChatMessage], has_newer: bool) -> int:
+        """
+        Thêm 1 trang tin mới vào cuối, bỏ bớt tin cũ nhất nếu vượt CHAT_MAX_LOADED
+        Args:
+            page: Các tin ngay sau tin mới nhất đang giữ
+            has_newer: Kho còn tin mới hơn page
+        Returns:
+            int: Số dòng đã bỏ ở đầu
+        """
+        self.has_newer = has_newer
+        if page:
+            row = len(self._messages)
+            self.beginInsertRows(QtCore.QModelIndex(), row, row + len(page) - 1)
+            self._messages.extend(page)
+            self.endInsertRows()
+        dropped = max(0, len(self._messages) - CHAT_MAX_LOADED)
+        self._drop_front(dropped)
+        return dropped
+
+    def apply_page(self, page: List[ChatMessage], older: bool) -> int:
+        """
+        Ghép 1 trang CHAT_PAGE tin đọc từ kho (trang đủ CHAT_PAGE tin thì coi
+        như kho còn tin, lần đọc sau trả về rỗng sẽ xoá cờ)
+        Args:
+            page: Kết quả MessageStore.before(first_id()) hoặc after(last_id())
+            older: True nếu page là trang tin cũ hơn
+        Returns:
+            int: Số dòng mà các tin đang giữ bị dịch xuống (âm = dịch lên)
+        """
+        if older:
+            return self.prepend(page, has_older=len(page) == CHAT_PAGE)
+        return -self.extend(page, has_newer=len(page) == CHAT_PAGE)
+
+
+class BubbleDelegate(QtWidgets.QStyledItemDelegate):
     """
-    Tạo HTML cho bubble tin nhắn theo style Messenger
-    - Tin gửi: màu xanh, căn phải
-    - Tin nhận: màu xám, căn trái
-    - Tự động xuống dòng cho text dài
+    Vẽ tin nhắn dạng bubble Messenger trong QListView
+    - Chỉ các dòng đang hiển thị được vẽ
+    - Kích thước tự nhiên (không xuống dòng) của mỗi tin được tính 1 lần;
+      tin dài hơn độ rộng tối đa được cache kích thước theo từng độ rộng
+      (BUBBLE_WIDTH_CACHE độ rộng gần nhất), nên kéo splitter chỉ tính lại
+      các tin dài đang nằm trong cửa sổ hiển thị
     """
-    ts = _format_timestamp()
-    safe_text = py_html.escape(text)
-    safe_sender = py_html.escape(sender)
-    justify = 'flex-end' if outgoing else 'flex-start'
-    
-    # Màu sắc theo chuẩn Messenger
-    bg = "#0084ff" if outgoing else "#e4e6ea"
-    fg = "#ffffff" if outgoing else "#1c1e21"
-    radius = "18px 18px 4px 18px" if outgoing else "18px 18px 18px 4px"
-    
-    return (
-        f"<div style='display:flex; justify-content:{justify}; margin:2px 0; padding:0 12px;'>"
-        f"  <div style='max-width:70%; background:{bg}; color:{fg}; padding:10px 14px; border-radius:{radius}; font-size:14px; line-height:1.4; box-shadow:0 1px 2px rgba(0,0,0,0.1);'>"
-        f"    <div style='white-space:pre-wrap; margin-bottom:4px;'>{safe_text}</div>"
-        f"    <div style='text-align:right; font-size:11px; opacity:.7; margin-top:4px; font-weight:normal;'>{ts}</div>"
-        f"  </div>"
-        f"</div>"
-    )
+    MARGIN_X = 12  # Khoảng cách bubble tới mép khung chat
+    MARGIN_Y = 2  # Khoảng cách giữa 2 bubble (mỗi phía)
+    PAD_X = 14  # Padding ngang trong bubble
+    PAD_Y = 10  # Padding dọc trong bubble
+    GAP = 4  # Khoảng cách giữa nội dung và thời gian
+    RADIUS = 18  # Bo góc bubble
+    TAIL_RADIUS = 4  # Bo góc phía người gửi
+    MAX_RATIO = 0.7  # Độ rộng tối đa của bubble so với khung chat
+
+    def __init__(self, view: QtWidgets.QListView) -> None:
+        super().__init__(view)
+        self._view = view
+        self._viewport = view.viewport()
+        self._text_font = QtGui.QFont(view.font())
+        self._text_font.setPixelSize(14)
+        self._time_font = QtGui.QFont(view.font())
+        self._time_font.setPixelSize(11)
+        self._text_metrics = QtGui.QFontMetrics(self._text_font)
+        self._time_metrics = QtGui.QFontMetrics(self._time_font)
+        self._time_height = self._time_metrics.height()
+        self._natural: "weakref.WeakKeyDictionary[ChatMessage, QtCore.QSize]" = weakref.WeakKeyDictionary()
+        self._wrapped: "OrderedDict[int, weakref.WeakKeyDictionary[ChatMessage, QtCore.QSize]]" = OrderedDict()
+        # Kích thước dòng theo độ rộng hiện tại (tính lại khi độ rộng đổi)
+        self._rows: "weakref.WeakKeyDictionary[ChatMessage, Tuple[QtCore.QSize, QtCore.QSize]]" = weakref.WeakKeyDictionary()
+        self._rows_width = -1
+
+    def _max_text_width(self) -> int:
+        """Độ rộng tối đa của nội dung theo độ rộng khung chat hiện tại"""
+        width = self._viewport.width() - 2 * self.MARGIN_X
+        return max(40, int(width * self.MAX_RATIO) - 2 * self.PAD_X)
+
+    def _text_size(self, message: ChatMessage, max_width: int) -> QtCore.QSize:
+        """Kích thước phần nội dung (có cache)"""
+        natural = self._natural.get(message)
+        if natural is None:
+            rect = self._text_metrics.boundingRect(QtCore.QRect(0, 0, 1 << 20, 1 << 20), QtCore.Qt.TextFlag.TextExpandTabs, message.text)
+            natural = self._natural[message] = rect.size()
+        if natural.width() <= max_width:
+            return natural
+        cache = self._wrapped.get(max_width)
+        if cache is None:
+            cache = self._wrapped[max_width] = weakref.WeakKeyDictionary()
+            while len(self._wrapped) > BUBBLE_WIDTH_CACHE:
+                self._wrapped.popitem(last=False)
+        else:
+            self._wrapped.move_to_end(max_width)
+        size = cache.get(message)
+        if size is None:
+            flags = QtCore.Qt.TextFlag.TextWordWrap | QtCore.Qt.TextFlag.TextExpandTabs
+            size = cache[message] = self._text_metrics.boundingRect(QtCore.QRect(0, 0, max_width, 1 << 20), flags, message.text).size()
+        return size
+
+    def _layout(self, message: ChatMessage) -> Tuple[QtCore.QSize, QtCore.QSize]:
+        """Kích thước (nội dung, dòng) của tin nhắn theo độ rộng khung chat hiện tại"""
+        max_width = self._max_text_width()
+        if max_width != self._rows_width:
+            self._rows = weakref.WeakKeyDictionary()
+            self._rows_width = max_width
+        layout = self._rows.get(message)
+        if layout is None:
+            text = self._text_size(message, max_width)
+            time_width = self._time_metrics.horizontalAdvance(message.timestamp)
+            row = QtCore.QSize(
+                max(text.width(), time_width) + 2 * (self.PAD_X + self.MARGIN_X),
+                text.height() + self.GAP + self._time_height + 2 * (self.PAD_Y + self.MARGIN_Y),
+            )
+            layout = self._rows[message] = (text, row)
+        return layout
+
+    def sizeHint(self, option: QtWidgets.QStyleOptionViewItem, index: QtCore.QModelIndex) -> QtCore.QSize:  # noqa: N802
+        return self._layout(self._view.model().message_at(index.row()))[1]
+
+    def paint(self, painter: QtGui.QPainter, option: QtWidgets.QStyleOptionViewItem, index: QtCore.QModelIndex) -> None:
+        message = self._view.model().message_at(index.row())
+        text, row = self._layout(message)
+        bubble = QtCore.QSize(row.width() - 2 * self.MARGIN_X, row.height() - 2 * self.MARGIN_Y)
+        rect = option.rect
+        if message.outgoing:
+            x = rect.right() - self.MARGIN_X - bubble.width() + 1
+            bg, fg = QtGui.QColor("#0084ff"), QtGui.QColor("#ffffff")
+        else:
+            x = rect.left() + self.MARGIN_X
+            bg, fg = QtGui.QColor("#e4e6ea"), QtGui.QColor("#1c1e21")
+        box = QtCore.QRectF(x, rect.top() + self.MARGIN_Y, bubble.width(), bubble.height())
+
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        # Bo góc 18px, riêng góc dưới phía người gửi bo 4px (vẽ đè cùng màu)
+        painter.setPen(QtCore.Qt.PenStyle.NoPen)
+        painter.setBrush(bg)
+        painter.drawRoundedRect(box, self.RADIUS, self.RADIUS)
+        corner_x = box.right() - self.RADIUS if message.outgoing else box.left()
+        painter.drawRoundedRect(QtCore.QRectF(corner_x, box.bottom() - self.RADIUS, self.RADIUS, self.RADIUS), self.TAIL_RADIUS, self.TAIL_RADIUS)
+
+        painter.setPen(fg)
+        painter.setFont(self._text_font)
+        text_rect = QtCore.QRect(int(box.left()) + self.PAD_X, int(box.top()) + self.PAD_Y, text.width(), text.height())
+        flags = QtCore.Qt.TextFlag.TextWordWrap | QtCore.Qt.TextFlag.TextExpandTabs
+        painter.drawText(text_rect, int(flags), message.text)
+
+        fg.setAlphaF(0.7)
+        painter.setPen(fg)
+        painter.setFont(self._time_font)
+        time_rect = QtCore.QRect(
+            int(box.left()) + self.PAD_X,
+            text_rect.bottom() + 1 + self.GAP,
+            bubble.width() - 2 * self.PAD_X,
+            self._time_height,
+        )
+        painter.drawText(time_rect, int(QtCore.Qt.AlignmentFlag.AlignRight), message.timestamp)
+        painter.restore()
 
 
 class ClientWindow(QtWidgets.QMainWindow):
@@ -134,70 +392,96 @@ class ClientWindow(QtWidgets.QMainWindow):
     - Panel hiển thị thông tin mã hoá thời gian thực
     - Lưu trữ lịch sử chat
     """
+    # Frame từ broker (có thể tới từ luồng đọc socket) được chuyển về GUI thread
+    _frame_arrived = QtCore.Signal(object)
+    # Thay đổi danh sách client (DeltaEvent) từ broker, chuyển về GUI thread
+    _presence_changed = QtCore.Signal(object)
+    # Lỗi ghi lịch sử (HistoryWriteError) từ luồng ghi của kho, chuyển về GUI thread
+    _history_failed = QtCore.Signal(object)
+
     def __init__(self, display_name: str) -> None:
         super().__init__()
         self.setWindowTitle(f"Trò chuyện mã hoá - {display_name}")
         self.resize(1000, 620)
 
         self.display_name = display_name
-        # Tạo cặp khoá X25519 mới cho mỗi phiên
-        self.key_pair = KeyPair.generate()
-        self.broker = InMemoryBroker.instance()
+        # Lấy cặp khoá X25519 mới (tạo sẵn ở luồng nền) cho mỗi phiên
+        self.key_pair = KeyPair.acquire()
+        # Broker trong bộ nhớ hoặc broker server (biến môi trường E2EE_BROKER)
+        self.broker = connect_broker()
+        self._frame_arrived.connect(self._on_frame_received)
         
         # Đăng ký client với broker
         self.client_id = self.broker.register_client(
             display_name,
             public_key_bytes(self.key_pair.public_key),
-            self._on_ciphertext_received,
+            self._frame_arrived.emit,
         )
 
         self.peers: Dict[str, Peer] = {}
+        # Mỗi đối tác (theo khoá công khai) có 1 Session AES-GCM dùng lại
+        self._sessions: Dict[bytes, Session] = {}
+        self._sessions_lock = threading.Lock()
+        # Mã hoá/giải mã chạy trên thread pool, kết quả trả về GUI thread
+        self.executor = CryptoExecutor.instance()
+        self._closed = False
+        # Shared secret (hex) cho panel E2EE, tính 1 lần cho mỗi đối tác
+        self._live_secret_hex: Dict[bytes, str] = {}
         self._setup_ui()
         self._ensure_data_dir()
         self._load_history()
-        self._refresh_peers()
+
+        # Nhận thay đổi danh sách đối tác từ broker (sự kiện đầu tiên là snapshot)
+        self._presence_version = 0
+        self._presence_changed.connect(self._on_presence_changed)
+        self._presence_token = self.broker.subscribe_presence(self._presence_changed.emit)
         
         # Hiển thị thông tin khóa ban đầu (sau khi UI đã được setup)
         self._show_initial_key_info()
 
-        # Timer cập nhật danh sách đối tác định kỳ
-        self._peer_timer = QtCore.QTimer(self)
-        self._peer_timer.setInterval(1200)  # 1.2 giây
-        self._peer_timer.timeout.connect(self._refresh_peers)
-        self._peer_timer.start()
-
     def _ensure_data_dir(self) -> None:
         """Tạo thư mục data nếu chưa tồn tại"""
         os.makedirs(DATA_DIR, exist_ok=True)
 
-    def _history_path(self) -> str:
-        """Đường dẫn file lịch sử chat"""
-        return os.path.join(DATA_DIR, f"{_safe_filename(self.display_name)}.html")
+    def _history_path(self, suffix: str = STORE_SUFFIX) -> str:
+        """Đường dẫn kho lịch sử chat (hoặc file HTML cùng tên với suffix=EXPORT_SUFFIX)"""
+        return os.path.join(DATA_DIR, f"{_safe_filename(self.display_name)}{suffix}")
 
     def _load_history(self) -> None:
-        """Tải lịch sử chat từ file HTML"""
-        path = self._history_path()
-        if os.path.exists(path):
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    html = f.read()
-                self.chat_view.setHtml(html)
-            except Exception:
-                pass
-
-    def closeEvent(self, event: QtGui.QCloseEvent) -> None:  # noqa: N802
-        """Xử lý khi đóng cửa sổ - lưu lịch sử và hủy đăng ký"""
+        """
+        Mở kho lịch sử (chuyển file HTML cũ vào kho nếu có) và hiển thị
+        CHAT_WINDOW tin mới nhất; tin cũ hơn được đọc khi cuộn lên
+        """
+        self.history: Optional[MessageStore] = None
+        self._history_loading = False
+        self._history_failed.connect(self._on_history_failed)
         try:
-            # Lưu lịch sử chat (không lưu khoá)
-            html_content = self.chat_view.toHtml()
-            html_content = _wrap_html_with_utf8_meta(html_content)
-            with open(self._history_path(), "w", encoding="utf-8") as f:
-                f.write(html_content)
+            self.history = MessageStore(self._history_path(), legacy_html=self._history_path(EXPORT_SUFFIX), on_error=self._history_failed.emit)
+            page = self.history.latest(CHAT_WINDOW)
+            self.chat_model.set_messages(page, has_older=len(page) == CHAT_WINDOW)
+            self.chat_view.scrollToBottom()
         except Exception:
             pass
+
+    def _on_history_failed(self, exc: Exception) -> None:
+        """Báo lỗi ghi lịch sử (tin vẫn hiển thị nhưng không còn trong kho)"""
+        if not self._closed:
+            self._animate_status(f"Lỗi lưu lịch sử: {exc}")
+
+    def closeEvent(self, event: QtGui.QCloseEvent) -> None:  # noqa: N802
+        """Xử lý khi đóng cửa sổ - ghi nốt lịch sử và hủy đăng ký"""
+        if self.history is not None:
+            # Tin nhắn đã được lưu dần khi gửi/nhận, chỉ còn ghi nốt hàng đợi (không lưu khoá)
+            try:
+                self.history.close()
+            except Exception:
+                pass
         
-        # Hủy đăng ký khỏi broker
+        # Hủy đăng ký khỏi broker và xoá khoá phiên khỏi cache
+        self._closed = True
+        self.broker.unsubscribe_presence(self._presence_token)
         self.broker.unregister_client(self.client_id)
+        self._drop_sessions()
         event.accept()
 
     def _setup_ui(self) -> None:
@@ -254,10 +538,18 @@ class ClientWindow(QtWidgets.QMainWindow):
         left_holder = QtWidgets.QWidget()
         left_layout = QtWidgets.QVBoxLayout(left_holder)
 
-        # Khung hiển thị tin nhắn
-        self.chat_view = QtWidgets.QTextBrowser()
-        self.chat_view.setOpenLinks(False)
-        self.chat_view.setStyleSheet("QTextBrowser { background: #f0f2f5; color: #1c1e21; border: none; padding: 8px; }")
+        # Khung hiển thị tin nhắn: model + delegate, chỉ vẽ các dòng đang hiện
+        self.chat_model = ChatMessageModel(self)
+        self.chat_view = QtWidgets.QListView()
+        self.chat_view.setModel(self.chat_model)
+        self.chat_view.setItemDelegate(BubbleDelegate(self.chat_view))
+        self.chat_view.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.chat_view.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.chat_view.setResizeMode(QtWidgets.QListView.ResizeMode.Adjust)
+        self.chat_view.setSelectionMode(QtWidgets.QAbstractItemView.SelectionMode.NoSelection)
+        self.chat_view.setFocusPolicy(QtCore.Qt.FocusPolicy.NoFocus)
+        self.chat_view.setStyleSheet("QListView { background: #f0f2f5; color: #1c1e21; border: none; padding: 8px; }")
+        self.chat_view.verticalScrollBar().valueChanged.connect(self._on_chat_scrolled)
         left_layout.addWidget(self.chat_view, 1)
 
         # Thanh nhập tin nhắn theo style Messenger
@@ -475,8 +767,36 @@ class ClientWindow(QtWidgets.QMainWindow):
         anim.setEasingCurve(QtCore.QEasingCurve.Type.InOutQuad)
         anim.start(QtCore.QAbstractAnimation.DeletionPolicy.DeleteWhenStopped)
 
-    def _refresh_peers(self) -> None:
-        """Cập nhật danh sách đối tác có thể chat"""
+    def _on_presence_changed(self, event: DeltaEvent) -> None:
+        """Áp dụng thay đổi danh sách client từ broker vào combo đối tác"""
+        if event.kind != DELTA_RESET and event.version <= self._presence_version:
+            return
+        self._presence_version = event.version
+        if event.kind == DELTA_RESET:
+            self._refresh_peers(event.value)
+            return
+        cid = event.key
+        if cid == self.client_id:
+            return
+        idx = self.peer_combo.findData(cid)
+        if event.kind == DELTA_LEAVE:
+            self.peers.pop(cid, None)
+            if idx >= 0:
+                self.peer_combo.removeItem(idx)
+            return
+        reg: ClientRegistration = event.value
+        self.peers[cid] = Peer(client_id=cid, display_name=reg.display_name, public_key_bytes=reg.public_key_bytes)
+        if idx >= 0:
+            self.peer_combo.setItemText(idx, reg.display_name)
+        else:
+            self.peer_combo.addItem(reg.display_name, userData=cid)
+
+    def _refresh_peers(self, clients: Dict[str, ClientRegistration]) -> None:
+        """
+        Dựng lại danh sách đối tác có thể chat từ snapshot của broker
+        Args:
+            clients: client_id -> ClientRegistration
+        """
         current_cid = self.peer_combo.currentData()
         current_text = self.peer_combo.currentText()
 
@@ -484,8 +804,7 @@ class ClientWindow(QtWidgets.QMainWindow):
         self.peer_combo.clear()
         self.peers.clear()
         
-        # Lấy danh sách client từ broker
-        for cid, reg in self.broker.list_clients().items():
+        for cid, reg in clients.items():
             if cid == self.client_id:
                 continue
             peer = Peer(client_id=cid, display_name=reg.display_name, public_key_bytes=reg.public_key_bytes)
@@ -538,7 +857,7 @@ class ClientWindow(QtWidgets.QMainWindow):
             </li>
             <li><strong>🔒 Encryption (AES-GCM):</strong> Mã hóa tin nhắn:
                 <ul>
-                    <li>Nonce: 12 bytes ngẫu nhiên</li>
+                    <li>Nonce: 12 bytes = 4 bytes ngẫu nhiên + bộ đếm 8 bytes (không bao giờ lặp lại)</li>
                     <li>Ciphertext: Tin nhắn đã mã hóa</li>
                     <li>Auth Tag: Xác thực tính toàn vẹn</li>
                 </ul>
@@ -566,19 +885,67 @@ class ClientWindow(QtWidgets.QMainWindow):
         )
 
     def _append_chat_bubble(self, sender: str, text: str, outgoing: bool) -> None:
-        """Thêm bubble tin nhắn vào khung chat"""
-        self.chat_view.append(_format_bubble(sender, text, outgoing))
-
-    def _set_live_e2ee(self, peer_name: str, shared_key: bytes, nonce: bytes, ciphertext: bytes) -> None:
+        """Thêm bubble tin nhắn vào khung chat (tự cuộn nếu đang ở cuối)"""
+        bar = self.chat_view.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum() - 4
+        message = ChatMessage(sender, text, outgoing, _format_timestamp())
+        if self.history is not None:
+            self.history.append(message)
+        if self.chat_model.append(message) and at_bottom:
+            self.chat_model.trim()
+            self.chat_view.scrollToBottom()
+
+    def _on_chat_scrolled(self, value: int) -> None:
+        """Cuộn gần đầu/cuối khung chat: đọc thêm 1 trang tin từ kho ở luồng nền"""
+        if self.history is None or self._history_loading:
+            return
+        bar = self.chat_view.verticalScrollBar()
+        if value <= bar.pageStep() and self.chat_model.has_older:
+            self._fetch_history_page(older=True)
+        elif value >= bar.maximum() - bar.pageStep() and self.chat_model.has_newer:
+            self._fetch_history_page(older=False)
+
+    def _fetch_history_page(self, older: bool) -> None:
+        """
+        Đọc trang tin trước (older=True) hoặc sau cửa sổ đang giữ trên thread pool,
+        rồi ghép vào model mà không làm xê dịch các dòng đang xem
+        """
+        history = self.history
+        first_id, last_id = self.chat_model.first_id(), self.chat_model.last_id()
+
+        def read() -> List[ChatMessage]:
+            return history.before(first_id, CHAT_PAGE) if older else history.after(last_id, CHAT_PAGE)
+
+        self._history_loading = True
+
+        def done(page: List[ChatMessage]) -> None:
+            self._history_loading = False
+            if self._closed:
+                return
+            # Giữ dòng đang ở đỉnh khung chat đứng yên khi thêm/bỏ dòng
+            top = self.chat_view.indexAt(QtCore.QPoint(0, 0))
+            offset = self.chat_view.visualRect(top).top() if top.isValid() else 0
+            shift = self.chat_model.apply_page(page, older)
+            row = top.row() + shift if top.isValid() else -1
+            if row >= 0:
+                self.chat_view.scrollTo(self.chat_model.index(row, 0), QtWidgets.QAbstractItemView.ScrollHint.PositionAtTop)
+                bar = self.chat_view.verticalScrollBar()
+                bar.setValue(bar.value() - offset)
+
+        def failed(exc: BaseException) -> None:
+            self._history_loading = False
+            if not self._closed:
+                self._animate_status(f"Lỗi đọc lịch sử: {exc}")
+
+        self.executor.submit(read, on_done=done, on_error=failed)
+
+    def _set_live_e2ee(self, peer_name: str, shared_key: bytes, nonce: bytes | memoryview, ciphertext: bytes | memoryview) -> None:
         """Cập nhật panel E2EE thời gian thực với thông tin mã hoá đầy đủ"""
         # Lấy thông tin peer hiện tại
         peer = self._current_peer()
         if peer is None:
             return
             
-        # Lấy public key của peer
-        peer_pub = X25519PublicKey.from_public_bytes(peer.public_key_bytes)
-        
         # Hiển thị thông tin đầy đủ
         self.live_peer.setText(f"Đối tác: {peer_name}")
         
@@ -595,9 +962,13 @@ class ClientWindow(QtWidgets.QMainWindow):
         peer_public_hex = peer.public_key_bytes.hex()
         self.live_peer_public.setText(f"🔑 Khóa công khai đối tác (hex): {peer_public_hex}")
         
-        # Shared secret từ ECDH
-        shared_secret = self.key_pair.private_key.exchange(peer_pub)
-        self.live_shared_secret.setText(f"🤝 Shared Secret (X25519 ECDH): {shared_secret.hex()}")
+        # Shared secret từ ECDH (chỉ tính lại khi đổi đối tác)
+        shared_secret_hex = self._live_secret_hex.get(peer.public_key_bytes)
+        if shared_secret_hex is None:
+            peer_pub = X25519PublicKey.from_public_bytes(peer.public_key_bytes)
+            shared_secret_hex = self.key_pair.private_key.exchange(peer_pub).hex()
+            self._live_secret_hex[peer.public_key_bytes] = shared_secret_hex
+        self.live_shared_secret.setText(f"🤝 Shared Secret (X25519 ECDH): {shared_secret_hex}")
         
         # AES key từ HKDF
         self.live_aes_key.setText(f"🔐 AES Key (HKDF-SHA256): {shared_key.hex()}")
@@ -631,6 +1002,32 @@ class ClientWindow(QtWidgets.QMainWindow):
         if hasattr(self, '_update_splitter_sizes'):
             QtCore.QTimer.singleShot(50, self._update_splitter_sizes)
 
+    def _session_for(self, peer_public_key_bytes: bytes) -> Session:
+        """Lấy (hoặc tạo) Session AES-GCM với đối tác - gọi được từ worker thread"""
+        with self._sessions_lock:
+            session = self._sessions.get(peer_public_key_bytes)
+            if session is None:
+                session = Session.for_peer(self.key_pair, peer_public_key_bytes)
+                self._sessions[peer_public_key_bytes] = session
+            return session
+
+    def _drop_sessions(self) -> None:
+        """Xoá mọi Session và khoá phiên của cặp khoá hiện tại"""
+        with self._sessions_lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+        self._live_secret_hex.clear()
+        forget_session_keys(self.key_pair)
+
+    def _rekey(self) -> None:
+        """Tạo cặp khoá mới khi khoá phiên đã dùng hết giới hạn tin nhắn"""
+        self._drop_sessions()
+        self.key_pair = KeyPair.acquire()
+        self.broker.update_public_key(self.client_id, public_key_bytes(self.key_pair.public_key))
+        self._update_explain()
+        self._show_initial_key_info()
+
     def _current_peer(self) -> Optional[Peer]:
         """Lấy đối tác hiện tại được chọn"""
         idx = self.peer_combo.currentIndex()
@@ -651,41 +1048,93 @@ class ClientWindow(QtWidgets.QMainWindow):
             return
             
         self.msg_edit.clear()
+        self._submit_send(peer, text)
+
+    def _submit_send(self, peer: Peer, text: str) -> None:
+        """Mã hoá tin nhắn trên thread pool rồi gửi qua broker (trên GUI thread)"""
+        peer_public = peer.public_key_bytes
+
+        def encrypt() -> tuple:
+            # Mã hoá bằng Session của đối tác (ECDH + key schedule chỉ chạy lần đầu)
+            session = self._session_for(peer_public)
+            nonce, ciphertext = session.encrypt(text.encode("utf-8"))
+            return session.key, nonce, ciphertext
+
+        def done(result: tuple) -> None:
+            if self._closed:
+                return
+            aes_key, nonce, ciphertext = result
+            # Đóng gói frame và gửi qua broker trước, chỉ hiển thị/lưu tin đã gửi được
+            frame = encode_frame(self.client_id, public_key_bytes(self.key_pair.public_key), nonce, ciphertext)
+            try:
+                sent = self.broker.send_frame(peer.client_id, frame)
+            except QueueFull:
+                self._animate_status(f"{peer.display_name} đang quá tải, tin nhắn chưa được gửi.")
+                return
+            except (BrokerError, OSError) as exc:
+                self._animate_status(f"Lỗi gửi tin nhắn: {exc}")
+                return
+            if not sent:
+                self._animate_status(f"{peer.display_name} không còn online, tin nhắn chưa được gửi.")
+                return
 
-        # Tạo khoá chung và mã hoá tin nhắn
-        peer_pub = X25519PublicKey.from_public_bytes(peer.public_key_bytes)
-        aes_key = derive_shared_key(self.key_pair.private_key, peer_pub)
-        nonce, ciphertext = encrypt_message(aes_key, text.encode("utf-8"))
-
-        # Hiển thị tin nhắn và cập nhật panel E2EE
-        self._append_chat_bubble("Bạn → " + peer.display_name, text, outgoing=True)
-        self._set_live_e2ee(peer.display_name, aes_key, nonce, ciphertext)
-
-        # Gửi qua broker
-        self.broker.send_ciphertext(
-            from_client_id=self.client_id,
-            to_client_id=peer.client_id,
-            from_public_key_bytes=public_key_bytes(self.key_pair.public_key),
-            nonce=nonce,
-            ciphertext=ciphertext,
-        )
-        self._animate_status("Đã gửi bản mã qua broker.")
-
-    def _on_ciphertext_received(self, from_client_id: str, from_public_key_bytes: bytes, nonce: bytes, ciphertext: bytes) -> None:
-        """Xử lý khi nhận được tin nhắn mã hoá"""
+            # Hiển thị tin nhắn và cập nhật panel E2EE
+            self._append_chat_bubble("Bạn → " + peer.display_name, text, outgoing=True)
+            self._set_live_e2ee(peer.display_name, aes_key, nonce, ciphertext)
+            self._animate_status("Đã gửi bản mã qua broker.")
+
+        def failed(exc: BaseException) -> None:
+            if self._closed:
+                return
+            if isinstance(exc, RekeyRequired):
+                self._rekey()
+                self._submit_send(peer, text)
+                return
+            self._animate_status(f"Lỗi mã hoá: {exc}")
+
+        self.executor.submit(encrypt, lane=self.client_id, on_done=done, on_error=failed)
+
+    def _on_frame_received(self, data: bytes) -> None:
+        """Xử lý khi nhận được frame bản mã từ broker"""
         try:
-            # Giải mã tin nhắn
-            from_pub = X25519PublicKey.from_public_bytes(from_public_key_bytes)
-            aes_key = derive_shared_key(self.key_pair.private_key, from_pub)
-            plaintext = decrypt_message(aes_key, nonce, ciphertext)
-            
+            frame = decode_frame(data)
+        except ValueError as exc:
+            self._animate_status(f"Frame không hợp lệ: {exc}")
+            return
+        if frame.flags & (FLAG_GROUP | FLAG_SENDER_KEY | FLAG_STREAM):
+            # Cửa sổ chat hiện chỉ hỗ trợ tin nhắn từng cặp
+            return
+        self._on_ciphertext_received(frame.sender_id, bytes(frame.key_id), frame.nonce, frame.ciphertext)
+
+    def _on_ciphertext_received(self, from_client_id: str, from_public_key_bytes: bytes, nonce: memoryview, ciphertext: memoryview) -> None:
+        """Xử lý khi nhận được tin nhắn mã hoá - giải mã trên thread pool"""
+        # Chỉ giải mã bằng khoá công khai đã biết của người gửi, không tin key_id
+        # trong frame (chặn frame giả danh đối tác bằng khoá khác)
+        sender = self.peers.get(from_client_id)
+        if sender is None or sender.public_key_bytes != from_public_key_bytes:
+            self._animate_status("Bỏ qua bản mã: khoá người gửi không khớp danh bạ.")
+            return
+
+        def decrypt() -> tuple:
+            session = self._session_for(from_public_key_bytes)
+            # Bản rõ đã xác thực nhưng không phải UTF-8: thay ký tự lỗi thay vì báo lỗi
+            return session.key, session.decrypt(nonce, ciphertext).decode("utf-8", errors="replace")
+
+        def done(result: tuple) -> None:
+            if self._closed:
+                return
+            aes_key, text = result
             # Hiển thị tin nhắn và cập nhật panel E2EE
-            sender_name = self.broker.clients.get(from_client_id).display_name if from_client_id in self.broker.clients else "?"
-            self._append_chat_bubble(sender_name + " → Bạn", plaintext.decode('utf-8'), outgoing=False)
+            sender_name = sender.display_name
+            self._append_chat_bubble(sender_name + " → Bạn", text, outgoing=False)
             self._set_live_e2ee(sender_name, aes_key, nonce, ciphertext)
             self._animate_status("Đã nhận bản mã và giải mã cục bộ.")
-        except Exception as exc:  # noqa: BLE001
-            self.chat_view.append(f"<div style='color:#ef9a9a'>Lỗi giải mã: {py_html.escape(str(exc))}</div>")
+
+        def failed(exc: BaseException) -> None:
+            if not self._closed:
+                self._animate_status(f"Lỗi giải mã: {exc}")
+
+        self.executor.submit(decrypt, lane=self.client_id, on_done=done, on_error=failed)
 
     def _run_demo(self) -> None:
         """Chạy demo minh hoạ quá trình E2EE"""
@@ -718,6 +1167,155 @@ class ClientWindow(QtWidgets.QMainWindow):
         )
 
 
+_avatar_cache: Dict[Tuple[str, int], QtGui.QPixmap] = {}
+
+
+def _avatar_pixmap(letter: str, size: int) -> QtGui.QPixmap:
+    """
+    Avatar tròn có chữ cái đầu (vẽ 1 lần cho mỗi cặp chữ cái, kích thước)
+    Args:
+        letter: Chữ cái đầu (đã viết hoa)
+        size: Đường kính (pixel logic)
+    Returns:
+        QtGui.QPixmap: Avatar đã vẽ sẵn
+    """
+    key = (letter, size)
+    pixmap = _avatar_cache.get(key)
+    if pixmap is not None:
+        return pixmap
+    screen = QtGui.QGuiApplication.primaryScreen()
+    ratio = screen.devicePixelRatio() if screen is not None else 1.0
+    pixmap = QtGui.QPixmap(int(size * ratio), int(size * ratio))
+    pixmap.setDevicePixelRatio(ratio)
+    pixmap.fill(QtCore.Qt.GlobalColor.transparent)
+    painter = QtGui.QPainter(pixmap)
+    painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+    painter.setPen(QtGui.QPen(QtGui.QColor(255, 255, 255, 204), 2))
+    painter.setBrush(QtGui.QColor(AVATAR_COLORS.get(letter, AVATAR_DEFAULT_COLOR)))
+    painter.drawEllipse(QtCore.QRectF(1, 1, size - 2, size - 2))
+    font = QtGui.QFont()
+    font.setPixelSize(20)
+    font.setBold(True)
+    painter.setFont(font)
+    painter.setPen(QtGui.QColor("white"))
+    painter.drawText(QtCore.QRectF(0, 0, size, size), QtCore.Qt.AlignmentFlag.AlignCenter, letter)
+    painter.end()
+    _avatar_cache[key] = pixmap
+    return pixmap
+
+
+class ChatHistoryModel(QtCore.QAbstractListModel):
+    """
+    Model danh sách lịch sử chat của launcher
+    - Mỗi dòng là 1 danh tính: tên hiển thị và tên file kho lịch sử
+    - Kiểm tra trùng theo tên file bằng set (không duyệt danh sách)
+    """
+    FilenameRole = QtCore.Qt.ItemDataRole.UserRole
+    NameRole = QtCore.Qt.ItemDataRole.UserRole + 1
+
+    def __init__(self, parent: Optional[QtCore.QObject] = None) -> None:
+        super().__init__(parent)
+        self._entries: List[Tuple[str, str]] = []  # (tên hiển thị, tên file)
+        self._filenames: Set[str] = set()
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> int:  # noqa: N802
+        return 0 if parent.isValid() else len(self._entries)
+
+    def data(self, index: QtCore.QModelIndex, role: int = QtCore.Qt.ItemDataRole.DisplayRole) -> object:
+        if not index.isValid():
+            return None
+        display_name, filename = self._entries[index.row()]
+        if role in (QtCore.Qt.ItemDataRole.DisplayRole, self.NameRole):
+            return display_name
+        if role == self.FilenameRole:
+            return filename
+        return None
+
+    def set_entries(self, entries: List[Tuple[str, str]]) -> None:
+        """Thay toàn bộ danh sách (tên hiển thị, tên file)"""
+        self.beginResetModel()
+        self._entries = list(entries)
+        self._filenames = {filename for _, filename in self._entries}
+        self.endResetModel()
+
+    def add(self, display_name: str, filename: str) -> bool:
+        """
+        Thêm 1 danh tính vào cuối danh sách
+        Returns:
+            bool: False nếu tên file đã có trong danh sách
+        """
+        if filename in self._filenames:
+            return False
+        row = len(self._entries)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self._entries.append((display_name, filename))
+        self._filenames.add(filename)
+        self.endInsertRows()
+        return True
+
+
+class ChatHistoryDelegate(QtWidgets.QStyledItemDelegate):
+    """
+    Vẽ 1 dòng lịch sử chat: thẻ bo góc, avatar, tên và biểu tượng trạng thái
+    - Mọi dòng cao bằng nhau (HISTORY_ROW_HEIGHT), chỉ các dòng đang hiển thị được vẽ
+    - Avatar lấy từ cache pixmap theo (chữ cái, kích thước)
+    """
+    MARGIN = 2  # Khoảng cách thẻ tới mép dòng
+    PADDING = 16  # Khoảng cách nội dung tới mép thẻ
+    SPACING = 16  # Khoảng cách giữa avatar, tên và biểu tượng
+    RADIUS = 12
+    STATUS_ICON = "💬"
+
+    def __init__(self, parent: Optional[QtCore.QObject] = None) -> None:
+        super().__init__(parent)
+        self._name_font = QtGui.QFont("Segoe UI")
+        self._name_font.setPixelSize(16)
+        self._name_font.setWeight(QtGui.QFont.Weight.DemiBold)
+        self._icon_font = QtGui.QFont()
+        self._icon_font.setPixelSize(18)
+        self._icon_width = QtGui.QFontMetrics(self._icon_font).horizontalAdvance(self.STATUS_ICON) + 8
+
+    def sizeHint(self, option: QtWidgets.QStyleOptionViewItem, index: QtCore.QModelIndex) -> QtCore.QSize:  # noqa: N802
+        return QtCore.QSize(300, HISTORY_ROW_HEIGHT)
+
+    def paint(self, painter: QtGui.QPainter, option: QtWidgets.QStyleOptionViewItem, index: QtCore.QModelIndex) -> None:
+        display_name = index.data(ChatHistoryModel.NameRole) or ""
+        hover = bool(option.state & QtWidgets.QStyle.StateFlag.State_MouseOver)
+        card = QtCore.QRectF(option.rect).adjusted(self.MARGIN, self.MARGIN, -self.MARGIN, -self.MARGIN)
+
+        painter.save()
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        # Thẻ nền: trắng mờ, viền xanh nhạt khi rê chuột
+        if hover:
+            painter.setPen(QtGui.QPen(QtGui.QColor(33, 150, 243, 77), 1))
+            painter.setBrush(QtGui.QColor(255, 255, 255))
+        else:
+            painter.setPen(QtGui.QPen(QtGui.QColor(0, 0, 0, 26), 1))
+            painter.setBrush(QtGui.QColor(255, 255, 255, 230))
+        painter.drawRoundedRect(card.adjusted(0.5, 0.5, -0.5, -0.5), self.RADIUS, self.RADIUS)
+
+        # Avatar với chữ cái đầu
+        first_letter = display_name[0].upper() if display_name else "?"
+        left = card.left() + self.PADDING
+        top = card.top() + (card.height() - AVATAR_SIZE) / 2
+        painter.drawPixmap(QtCore.QPointF(left, top), _avatar_pixmap(first_letter, AVATAR_SIZE))
+
+        # Biểu tượng trạng thái ở mép phải
+        icon_rect = QtCore.QRectF(card.right() - self.PADDING - self._icon_width, card.top(), self._icon_width, card.height())
+        painter.setFont(self._icon_font)
+        painter.setPen(QtGui.QColor("#27ae60"))
+        painter.drawText(icon_rect, QtCore.Qt.AlignmentFlag.AlignCenter, self.STATUS_ICON)
+
+        # Tên hiển thị (cắt bớt nếu quá dài)
+        name_left = left + AVATAR_SIZE + self.SPACING
+        name_rect = QtCore.QRectF(name_left, card.top(), icon_rect.left() - self.SPACING - name_left, card.height())
+        painter.setFont(self._name_font)
+        painter.setPen(QtGui.QColor("#2c3e50"))
+        name = QtGui.QFontMetrics(self._name_font).elidedText(display_name, QtCore.Qt.TextElideMode.ElideRight, int(name_rect.width()))
+        painter.drawText(name_rect, QtCore.Qt.AlignmentFlag.AlignLeft | QtCore.Qt.AlignmentFlag.AlignVCenter, name)
+        painter.restore()
+
+
 class Launcher(QtWidgets.QMainWindow):
     """
     Cửa sổ launcher chính để tạo và quản lý các cửa sổ chat
@@ -760,10 +1358,18 @@ class Launcher(QtWidgets.QMainWindow):
         history_label.setStyleSheet("QLabel { font-weight: bold; color: #1c1e21; margin-top: 10px; }")
         layout.addWidget(history_label)
         
-        # List widget hiển thị lịch sử chat
-        self.clients_list = QtWidgets.QListWidget()
+        # Danh sách lịch sử chat (model + delegate: chỉ vẽ các dòng đang hiển thị)
+        self.history_model = ChatHistoryModel(self)
+        self.clients_list = QtWidgets.QListView()
+        self.clients_list.setModel(self.history_model)
+        self.clients_list.setItemDelegate(ChatHistoryDelegate(self.clients_list))
+        self.clients_list.setUniformItemSizes(True)
+        self.clients_list.setSpacing(6)
+        self.clients_list.setMouseTracking(True)
+        self.clients_list.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.clients_list.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
         self.clients_list.setStyleSheet("""
-            QListWidget { 
+            QListView { 
                 background: qlineargradient(x1:0, y1:0, x2:0, y2:1, 
                     stop:0 #ffffff, stop:1 #f8f9fa);
                 border: 2px solid #e9ecef;
@@ -771,17 +1377,6 @@ class Launcher(QtWidgets.QMainWindow):
                 padding: 12px;
                 selection-background-color: transparent;
             }
-            QListWidget::item { 
-                border-radius: 12px;
-                margin: 6px 0px;
-                background: transparent;
-            }
-            QListWidget::item:hover { 
-                background: transparent; 
-            }
-            QListWidget::item:selected { 
-                background: transparent;
-            }
             QScrollBar:vertical {
                 background: #f1f3f4;
                 width: 12px;
@@ -796,7 +1391,7 @@ class Launcher(QtWidgets.QMainWindow):
                 background: #a8b2ba;
             }
         """)
-        self.clients_list.itemClicked.connect(self._open_chat_history)
+        self.clients_list.clicked.connect(self._open_chat_history)
         layout.addWidget(self.clients_list, 1)
 
         # Áp dụng theme hiện đại cho launcher
@@ -806,7 +1401,7 @@ class Launcher(QtWidgets.QMainWindow):
                 "stop:0 #4facfe, stop:1 #00f2fe); "
                 "border-radius: 0px; "
             "}"
-            "QLabel, QListWidget, QLineEdit { "
+            "QLabel, QListView, QLineEdit { "
                 "color: #2c3e50; "
                 "font-family: 'Segoe UI', 'Roboto', 'Helvetica Neue', Arial, sans-serif; "
             "}"
@@ -868,115 +1463,16 @@ class Launcher(QtWidgets.QMainWindow):
         self.setStyleSheet(style)
 
     def _load_chat_history(self) -> None:
-        """Tải lịch sử chat từ thư mục data"""
-        if not os.path.exists(DATA_DIR):
-            return
-        
-        for filename in os.listdir(DATA_DIR):
-            if filename.endswith('.html'):
-                name = filename[:-5]  # Bỏ phần mở rộng .html
-                # Giữ nguyên tên gốc, chỉ thay dấu gạch ngang bằng khoảng trắng
-                display_name = name.replace('-', ' ')
-                self._add_chat_history_item(display_name, filename)
-    
-    def _add_chat_history_item(self, display_name: str, filename: str) -> None:
-        """Thêm item lịch sử chat vào danh sách với avatar"""
-        item = QtWidgets.QListWidgetItem()
-        
-        # Tạo widget tùy chỉnh với avatar và thông tin
-        widget = QtWidgets.QWidget()
-        widget.setStyleSheet("""
-            QWidget {
-                background: rgba(255, 255, 255, 0.9);
-                border: 1px solid rgba(0, 0, 0, 0.1);
-                border-radius: 12px;
-                margin: 2px;
-            }
-            QWidget:hover {
-                background: rgba(255, 255, 255, 1.0);
-                border: 1px solid rgba(33, 150, 243, 0.3);
-                margin: 1px;
-            }
-        """)
-        
-        layout = QtWidgets.QHBoxLayout(widget)
-        layout.setContentsMargins(16, 16, 16, 16)  # Margin đều để căn giữa
-        layout.setSpacing(16)  # Khoảng cách vừa phải
-        layout.setAlignment(QtCore.Qt.AlignmentFlag.AlignVCenter)  # Căn giữa theo chiều dọc
-        
-        # Avatar với gradient đẹp
-        first_letter = display_name[0].upper() if display_name else "?"
-        avatar = QtWidgets.QLabel(first_letter)
-        
-        # Tạo gradient màu dựa trên chữ cái đầu
-        colors = {
-            'A': '#e74c3c', 'B': '#3498db', 'C': '#9b59b6', 'D': '#2ecc71', 'E': '#f39c12',
-            'F': '#e91e63', 'G': '#00bcd4', 'H': '#673ab7', 'I': '#ff5722', 'J': '#795548',
-            'K': '#607d8b', 'L': '#ff9800', 'M': '#4caf50', 'N': '#2196f3', 'O': '#9c27b0',
-            'P': '#ff6f00', 'Q': '#8bc34a', 'R': '#f44336', 'S': '#009688', 'T': '#ffc107',
-            'U': '#3f51b5', 'V': '#cddc39', 'W': '#ff5252', 'X': '#4db6ac', 'Y': '#ffa726',
-            'Z': '#ab47bc'
-        }
-        avatar_color = colors.get(first_letter, '#0084ff')
-        
-        avatar.setStyleSheet(f"""
-            QLabel {{ 
-                font-size: 20px; 
-                font-weight: bold; 
-                color: white; 
-                background: {avatar_color};
-                border-radius: 25px;
-                min-width: 50px;
-                min-height: 50px;
-                border: 2px solid rgba(255, 255, 255, 0.8);
-            }}
-        """)
-        avatar.setFixedSize(50, 50)
-        avatar.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-
-        # Tên hiển thị với typography đẹp
-        name_label = QtWidgets.QLabel(display_name)
-        name_label.setStyleSheet("""
-            QLabel { 
-                font-weight: 600; 
-                color: #2c3e50; 
-                font-size: 16px;
-                padding: 0px;
-                margin: 0px;
-                font-family: 'Segoe UI', 'Roboto', sans-serif;
-            }
-        """)
-        name_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignLeft | QtCore.Qt.AlignmentFlag.AlignVCenter)
-        name_label.setSizePolicy(QtWidgets.QSizePolicy.Policy.Expanding, QtWidgets.QSizePolicy.Policy.Preferred)
-        
-        # Thêm icon trạng thái
-        status_icon = QtWidgets.QLabel("💬")
-        status_icon.setStyleSheet("""
-            QLabel {
-                font-size: 18px;
-                color: #27ae60;
-                padding: 4px;
-            }
-        """)
-        status_icon.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-        status_icon.setSizePolicy(QtWidgets.QSizePolicy.Policy.Fixed, QtWidgets.QSizePolicy.Policy.Preferred)
-        
-        layout.addWidget(avatar)
-        layout.addWidget(name_label, 1)
-        layout.addWidget(status_icon)
-        
-        # Đặt kích thước tối thiểu cho item - chiều cao vừa phải để căn giữa đẹp
-        item.setSizeHint(QtCore.QSize(300, 82))
-        # Lưu cả filename và display_name
-        item.setData(QtCore.Qt.ItemDataRole.UserRole, filename)
-        item.setData(QtCore.Qt.ItemDataRole.UserRole + 1, display_name)
-        self.clients_list.addItem(item)
-        self.clients_list.setItemWidget(item, widget)
+        """Tải danh sách lịch sử chat (kho .db và file HTML cũ) từ thư mục data"""
+        # Giữ nguyên tên gốc, chỉ thay dấu gạch ngang bằng khoảng trắng
+        self.history_model.set_entries(
+            [(name.replace('-', ' '), name + STORE_SUFFIX) for name in list_histories(DATA_DIR)]
+        )
     
-    def _open_chat_history(self, item: QtWidgets.QListWidgetItem) -> None:
+    def _open_chat_history(self, index: QtCore.QModelIndex) -> None:
         """Mở cửa sổ chat với lịch sử"""
-        filename = item.data(QtCore.Qt.ItemDataRole.UserRole)
-        display_name = item.data(QtCore.Qt.ItemDataRole.UserRole + 1)
+        filename = index.data(ChatHistoryModel.FilenameRole)
+        display_name = index.data(ChatHistoryModel.NameRole)
         
         if not filename or not display_name:
             return
@@ -994,17 +1490,6 @@ class Launcher(QtWidgets.QMainWindow):
         self._windows.append(win)
         
         # Thêm vào danh sách lịch sử (chỉ nếu chưa có)
-        safe_name = _safe_filename(name)
-        filename = f"{safe_name}.html"
-        
-        # Kiểm tra xem đã có trong danh sách chưa
-        existing_items = []
-        for i in range(self.clients_list.count()):
-            item = self.clients_list.item(i)
-            if item and item.data(QtCore.Qt.ItemDataRole.UserRole) == filename:
-                existing_items.append(item)
-        
-        if not existing_items:
-            self._add_chat_history_item(name, filename)
+        self.history_model.add(name, f"{_safe_filename(name)}{STORE_SUFFIX}")
         
         self.name_edit.clear()
@@ -0,0 +1,251 @@
+"""
+Định dạng frame nhị phân cho bản mã trao đổi qua broker.
+
+Một frame gói toàn bộ thông tin của một tin nhắn mã hoá:
+- Header cố định: magic, phiên bản, cờ, độ dài các trường
+- Sender handle: ID của client gửi (UTF-8)
+- Key ID: khoá công khai người gửi (tin từng cặp) hoặc group_id (tin nhóm)
+- Nonce: 12 bytes (prefix + bộ đếm của NonceSequence)
+- Ciphertext: bản mã AES-GCM kèm tag
+
+Mã hoá ghi vào 1 buffer cấp phát sẵn, giải mã trả về các memoryview
+trỏ vào frame gốc (không copy). Broker chỉ chuyển tiếp frame như bytes.
+
+Mô-đun cũng định nghĩa giao thức điều khiển (OP_*) giữa RemoteBroker
+và broker server qua socket.
+"""
+
+from __future__ import annotations
+
+from typing import List, NamedTuple, Optional, Tuple, Union
+import struct
+
+from .crypto import NONCE_BYTES
+
+FRAME_MAGIC = b"E2"  # 2 bytes nhận diện frame
+FRAME_VERSION = 1  # Phiên bản định dạng frame
+
+# Cờ của frame
+FLAG_GROUP = 0x01  # Tin nhóm mã hoá bằng sender key (key ID = group_id)
+FLAG_SENDER_KEY = 0x02  # Gói phân phối sender key qua kênh từng cặp
+FLAG_STREAM = 0x04  # Một đoạn của luồng mã hoá (encrypt_stream)
+
+# magic, version, flags, sender_len, key_id_len, ciphertext_len
+_HEADER = struct.Struct(">2sBBBBI")
+HEADER_BYTES = _HEADER.size
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class FrameError(ValueError):
+    """Frame không hợp lệ (sai magic, phiên bản hoặc độ dài)"""
+
+
+class Frame(NamedTuple):
+    """
+    Frame đã giải mã, các trường là memoryview trỏ vào buffer gốc
+
+    Attributes:
+        version (int): Phiên bản định dạng
+        flags (int): Cờ FLAG_*
+        sender (memoryview): Sender handle (UTF-8)
+        key_id (memoryview): Khoá công khai người gửi hoặc group_id
+        nonce (memoryview): Nonce 12 bytes
+        ciphertext (memoryview): Bản mã kèm tag
+    """
+    version: int
+    flags: int
+    sender: memoryview
+    key_id: memoryview
+    nonce: memoryview
+    ciphertext: memoryview
+
+    @property
+    def sender_id(self) -> str:
+        """ID client gửi dạng chuỗi"""
+        return str(self.sender, "utf-8")
+
+
+def frame_size(sender: bytes, key_id: Buffer, ciphertext: Buffer) -> int:
+    """
+    Tính kích thước frame
+    Args:
+        sender: Sender handle đã mã hoá UTF-8
+        key_id: Key ID
+        ciphertext: Bản mã
+    Returns:
+        int: Số bytes của frame
+    """
+    return HEADER_BYTES + len(sender) + len(key_id) + NONCE_BYTES + len(ciphertext)
+
+
+def encode_frame(sender_id: str, key_id: Buffer, nonce: Buffer, ciphertext: Buffer, flags: int = 0, out: Optional[Union[bytearray, memoryview]] = None) -> Union[bytearray, memoryview]:
+    """
+    Đóng gói tin nhắn mã hoá thành frame trong 1 buffer
+    Args:
+        sender_id: ID của client gửi
+        key_id: Khoá công khai người gửi hoặc group_id (tối đa 255 bytes)
+        nonce: Nonce 12 bytes
+        ciphertext: Bản mã kèm tag
+        flags: Cờ FLAG_*
+        out: Buffer cấp sẵn (tùy chọn), phải đủ frame_size(...) bytes
+    Returns:
+        bytearray | memoryview: Frame (memoryview trên out nếu có out)
+    Raises:
+        FrameError: Nếu trường nào vượt giới hạn độ dài
+    """
+    sender = sender_id.encode("utf-8")
+    if len(sender) > 0xFF or len(key_id) > 0xFF:
+        raise FrameError("Sender handle và key ID tối đa 255 bytes")
+    if len(nonce) != NONCE_BYTES:
+        raise FrameError(f"Nonce phải dài {NONCE_BYTES} bytes")
+
+    size = frame_size(sender, key_id, ciphertext)
+    if out is None:
+        buf: Union[bytearray, memoryview] = bytearray(size)
+        view = memoryview(buf)
+    else:
+        if len(out) < size:
+            raise FrameError(f"Buffer cần ít nhất {size} bytes")
+        view = memoryview(out)[:size]
+        buf = view
+
+    _HEADER.pack_into(view, 0, FRAME_MAGIC, FRAME_VERSION, flags, len(sender), len(key_id), len(ciphertext))
+    pos = HEADER_BYTES
+    for part in (sender, key_id, nonce, ciphertext):
+        end = pos + len(part)
+        view[pos:end] = part
+        pos = end
+    return buf
+
+
+def decode_frame(data: Buffer) -> Frame:
+    """
+    Giải mã frame, không copy dữ liệu
+    Args:
+        data: Frame nhận được
+    Returns:
+        Frame: Các trường dạng memoryview trỏ vào data
+    Raises:
+        FrameError: Nếu frame không hợp lệ
+    """
+    view = memoryview(data)
+    if len(view) < HEADER_BYTES:
+        raise FrameError("Frame quá ngắn")
+    magic, version, flags, sender_len, key_id_len, ct_len = _HEADER.unpack_from(view, 0)
+    if magic != FRAME_MAGIC:
+        raise FrameError("Sai magic của frame")
+    if version != FRAME_VERSION:
+        raise FrameError(f"Không hỗ trợ frame phiên bản {version}")
+    if len(view) != HEADER_BYTES + sender_len + key_id_len + NONCE_BYTES + ct_len:
+        raise FrameError("Độ dài frame không khớp header")
+
+    pos = HEADER_BYTES
+    sender = view[pos:pos + sender_len]
+    pos += sender_len
+    key_id = view[pos:pos + key_id_len]
+    pos += key_id_len
+    nonce = view[pos:pos + NONCE_BYTES]
+    pos += NONCE_BYTES
+    return Frame(version, flags, sender, key_id, nonce, view[pos:pos + ct_len])
+
+
+# ---------------------------------------------------------------------------
+# Giao thức điều khiển giữa client và broker server (app.server)
+# Mỗi message: độ dài thân (u32) + mã lệnh (u8) + các trường, mỗi trường
+# có tiền tố độ dài u32. Frame bản mã đi nguyên vẹn trong một trường.
+# ---------------------------------------------------------------------------
+
+OP_REGISTER = 1  # req_id, display_name, public_key[, client_id] → REPLY(client_id)
+OP_UNREGISTER = 2  # client_id
+OP_LIST = 3  # req_id → REPLY(client_id, display_name, public_key, ...)
+OP_SEND = 4  # to_client_id, frame
+OP_SEND_MANY = 5  # exclude_client_id, frame, to_client_id, ...
+OP_UPDATE_KEY = 6  # client_id, public_key
+OP_SUBSCRIBE = 7  # token, topic, since (u64, rỗng = từ snapshot)
+OP_UNSUBSCRIBE = 8  # token
+OP_CREATE_ROOM = 9  # req_id, name, room_id (rỗng = server tạo) → REPLY(room_id)
+OP_JOIN_ROOM = 10  # req_id, room_id, client_id → REPLY()
+OP_LEAVE_ROOM = 11  # req_id, room_id, client_id → REPLY()
+OP_ROOM_MEMBERS = 12  # req_id, room_id → REPLY(client_id, ...)
+OP_SEND_ROOM = 13  # room_id, exclude_client_id, frame
+OP_SEND_ROOM_REQ = 14  # req_id, room_id, exclude_client_id, frame → REPLY(số client nhận u32)
+OP_AUTH = 15  # secret (message đầu tiên trên listener nội bộ của cluster, sai thì bị ngắt)
+OP_REPLY = 64  # req_id, ... (server → client)
+OP_DELIVER = 65  # to_client_id, frame (server → client)
+OP_ERROR = 66  # req_id, message (server → client)
+OP_EVENT = 67  # token, version (u64), kind (u8), key, ... (server → client)
+
+TOPIC_PRESENCE = b"presence"  # Topic của OP_SUBSCRIBE: thay đổi danh sách client
+TOPIC_ROOM_PREFIX = b"room:"  # Topic "room:<room_id>": thay đổi thành viên phòng
+
+_MSG_HEADER = struct.Struct(">IB")  # độ dài thân (tính cả mã lệnh), mã lệnh
+_FIELD_LEN = struct.Struct(">I")
+MSG_HEADER_BYTES = _MSG_HEADER.size
+MSG_LENGTH_BYTES = _FIELD_LEN.size  # Số bytes tiền tố độ dài của mỗi message
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024  # Giới hạn 1 message để tránh cấp phát quá lớn
+
+
+def pack_message(op: int, *fields: Buffer) -> bytearray:
+    """
+    Đóng gói message điều khiển vào 1 buffer
+    Args:
+        op: Mã lệnh OP_*
+        *fields: Các trường dạng bytes-like
+    Returns:
+        bytearray: Message sẵn sàng ghi ra socket
+    """
+    body = 1 + sum(_FIELD_LEN.size + len(f) for f in fields)
+    buf = bytearray(MSG_LENGTH_BYTES + body)
+    _MSG_HEADER.pack_into(buf, 0, body, op)
+    pos = MSG_HEADER_BYTES
+    for f in fields:
+        _FIELD_LEN.pack_into(buf, pos, len(f))
+        pos += _FIELD_LEN.size
+        buf[pos:pos + len(f)] = f
+        pos += len(f)
+    return buf
+
+
+def read_message_length(header: Buffer) -> int:
+    """
+    Đọc độ dài thân message từ 4 bytes đầu
+    Args:
+        header: 4 bytes đầu của message
+    Returns:
+        int: Độ dài thân (gồm mã lệnh và các trường)
+    Raises:
+        FrameError: Nếu message vượt MAX_MESSAGE_BYTES
+    """
+    (length,) = _FIELD_LEN.unpack(bytes(header))
+    if not 1 <= length <= MAX_MESSAGE_BYTES:
+        raise FrameError(f"Độ dài message không hợp lệ: {length}")
+    return length
+
+
+def unpack_message(body: Buffer) -> Tuple[int, List[memoryview]]:
+    """
+    Tách thân message thành mã lệnh và các trường (memoryview, không copy)
+    Args:
+        body: Thân message (sau 4 bytes độ dài)
+    Returns:
+        Tuple[int, list]: (mã lệnh, danh sách trường)
+    Raises:
+        FrameError: Nếu độ dài trường không khớp
+    """
+    view = memoryview(body)
+    if not len(view):
+        raise FrameError("Message rỗng")
+    op = view[0]
+    fields: List[memoryview] = []
+    pos = 1
+    while pos < len(view):
+        if pos + _FIELD_LEN.size > len(view):
+            raise FrameError("Message bị cắt cụt")
+        (size,) = _FIELD_LEN.unpack_from(view, pos)
+        pos += _FIELD_LEN.size
+        if pos + size > len(view):
+            raise FrameError("Trường vượt quá độ dài message")
+        fields.append(view[pos:pos + size])
+        pos += size
+    return op, fields
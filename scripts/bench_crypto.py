@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Bộ đo hiệu năng (microbenchmark) cho các hàm mã hoá trong app/crypto.py.
+
+Đo ops/giây và độ trễ p50/p99 cho:
+- KeyPair.generate / KeyPair.acquire
+- derive_shared_key (không cache) và get_session_key (có cache)
+- encrypt_message / decrypt_message và Session.encrypt / Session.decrypt
+  với kích thước tin nhắn từ 16 B tới 16 MB
+
+Kết quả ghi ra JSON và so sánh với baseline đã lưu; chạy không cần Qt.
+Baseline phụ thuộc máy nên không có trong repo: lần chạy đầu tiên (chưa có
+file baseline) lưu kết quả làm baseline, các lần sau so sánh với nó.
+
+Sử dụng:
+    python scripts/bench_crypto.py                       # đo và so với baseline (lần đầu: tạo baseline)
+    python scripts/bench_crypto.py --save-baseline       # lưu kết quả làm baseline
+    python scripts/bench_crypto.py --threshold 0.1 -o out.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, List
+
+# Cho phép chạy trực tiếp từ thư mục gốc hoặc thư mục scripts/
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import cryptography  # noqa: E402
+
+from app.crypto import (  # noqa: E402
+    KeyPair,
+    Session,
+    SessionKeyCache,
+    decrypt_message,
+    default_keypair_pool,
+    derive_shared_key,
+    encrypt_message,
+)
+
+DEFAULT_BASELINE = os.path.join(ROOT_DIR, "scripts", "bench_baseline.json")
+DEFAULT_SIZES = [16, 256, 4 * 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024]
+DEFAULT_THRESHOLD = 0.15  # Chậm hơn baseline quá 15% thì coi là regression
+
+
+def _measure(fn: Callable[[], object], min_time: float, min_iters: int = 5, max_iters: int = 200_000) -> Dict[str, float]:
+    """
+    Chạy fn lặp lại tới khi đủ min_time giây, đo độ trễ từng lần gọi
+    Returns:
+        dict: ops_per_sec, p50_us, p99_us, iterations
+    """
+    fn()  # Làm nóng (cache, cấp phát lần đầu)
+    samples: List[int] = []
+    clock = time.perf_counter_ns
+    deadline = clock() + int(min_time * 1e9)
+    while len(samples) < max_iters and (len(samples) < min_iters or clock() < deadline):
+        start = clock()
+        fn()
+        samples.append(clock() - start)
+    samples.sort()
+    total = sum(samples)
+    return {
+        "ops_per_sec": len(samples) / (total / 1e9) if total else 0.0,
+        "p50_us": samples[len(samples) // 2] / 1e3,
+        "p99_us": samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1e3,
+        "iterations": len(samples),
+    }
+
+
+def _size_label(size: int) -> str:
+    """Nhãn kích thước dễ đọc: 16B, 4KB, 16MB"""
+    for unit, factor in (("MB", 1024 * 1024), ("KB", 1024)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return f"{size}B"
+
+
+def run_benchmarks(sizes: List[int], min_time: float) -> Dict[str, Dict[str, float]]:
+    """
+    Chạy toàn bộ benchmark
+    Args:
+        sizes: Các kích thước tin nhắn cần đo
+        min_time: Thời gian đo tối thiểu cho mỗi case (giây)
+    Returns:
+        dict: Tên case -> kết quả đo
+    """
+    results: Dict[str, Dict[str, float]] = {}
+    own, peer = KeyPair.generate(), KeyPair.generate()
+    cache = SessionKeyCache()
+    peer_bytes = peer.public_bytes()
+
+    pool = default_keypair_pool()
+    pool.start()
+    cases: Dict[str, Callable[[], object]] = {
+        "keypair_generate": KeyPair.generate,
+        "keypair_acquire": pool.acquire,
+        "derive_shared_key_uncached": lambda: derive_shared_key(own.private_key, peer.public_key),
+        "session_key_cached": lambda: cache.get(own, peer_bytes),
+    }
+    for name, fn in cases.items():
+        results[name] = _measure(fn, min_time)
+        print(f"  {name:<32} {results[name]['ops_per_sec']:>14,.0f} ops/s", flush=True)
+
+    aes_key = derive_shared_key(own.private_key, peer.public_key)
+    session = Session(aes_key)
+    for size in sizes:
+        plaintext = os.urandom(size)
+        nonce, ciphertext = encrypt_message(aes_key, plaintext)
+        label = _size_label(size)
+        sized_cases: Dict[str, Callable[[], object]] = {
+            f"encrypt_message/{label}": lambda: encrypt_message(aes_key, plaintext),
+            f"decrypt_message/{label}": lambda: decrypt_message(aes_key, nonce, ciphertext),
+            f"session_encrypt/{label}": lambda: session.encrypt(plaintext),
+            f"session_decrypt/{label}": lambda: session.decrypt(nonce, ciphertext),
+        }
+        for name, fn in sized_cases.items():
+            results[name] = _measure(fn, min_time)
+            print(f"  {name:<32} {results[name]['ops_per_sec']:>14,.0f} ops/s", flush=True)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    """
+    So sánh kết quả với baseline
+    Args:
+        results: Kết quả vừa đo
+        baseline: Kết quả baseline
+        threshold: Tỷ lệ chậm đi tối đa cho phép (0.15 = 15%)
+    Returns:
+        list: Mô tả các case bị regression
+    """
+    regressions = []
+    for name, base in baseline.items():
+        current = results.get(name)
+        if current is None or not base.get("ops_per_sec"):
+            continue
+        ratio = current["ops_per_sec"] / base["ops_per_sec"]
+        if ratio < 1.0 - threshold:
+            regressions.append(f"{name}: {current['ops_per_sec']:,.0f} ops/s so với baseline {base['ops_per_sec']:,.0f} ({(ratio - 1) * 100:+.1f}%)")
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> int:
+    """
+    Entry point của bộ benchmark
+    Returns:
+        int: 0 nếu không có regression, 1 nếu có
+    """
+    parser = argparse.ArgumentParser(description="Benchmark các hàm mã hoá của app/crypto.py")
+    parser.add_argument("-o", "--output", help="Ghi kết quả JSON ra file này")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="File baseline JSON để so sánh")
+    parser.add_argument("--save-baseline", action="store_true", help="Lưu kết quả làm baseline mới")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Tỷ lệ chậm đi tối đa cho phép (mặc định 0.15)")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Thời gian đo tối thiểu mỗi case (giây)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Các kích thước tin nhắn (bytes)")
+    args = parser.parse_args(argv)
+
+    print("🔬 Đang đo hiệu năng mã hoá...")
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "cryptography": cryptography.__version__,
+            "machine": platform.machine(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": run_benchmarks(args.sizes, args.min_time),
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Đã ghi kết quả vào {args.output}")
+
+    if args.save_baseline or not os.path.exists(args.baseline):
+        # Lần chạy đầu trên máy này (chưa có baseline) cũng lưu làm baseline
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Đã lưu baseline vào {args.baseline}")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(report["results"], baseline.get("results", {}), args.threshold)
+    if regressions:
+        print(f"❌ Có {len(regressions)} case chậm hơn baseline quá {args.threshold:.0%}:")
+        for line in regressions:
+            print("   - " + line)
+        return 1
+    print(f"✅ Không có regression (ngưỡng {args.threshold:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Đo bộ nhớ của registry client trong InMemoryBroker.
+
+Đăng ký N client (10k, 100k, 1M) với tên và khoá công khai tạo sẵn, đo
+bằng tracemalloc số bytes broker cấp phát thêm cho mỗi client: ID dạng
+chuỗi, bản ghi đăng ký, chỉ mục theo shard, bảng handle và hàng đợi.
+Chạy không cần Qt.
+
+Sử dụng:
+    python scripts/bench_registry.py
+    python scripts/bench_registry.py --counts 10000 100000 -o registry.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+# Cho phép chạy trực tiếp từ thư mục gốc hoặc thư mục scripts/
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from app.transport import InMemoryBroker  # noqa: E402
+
+DEFAULT_COUNTS = [10_000, 100_000, 1_000_000]
+
+
+def _deliver(frame: bytes) -> None:
+    """Callback dùng chung cho mọi client giả lập"""
+
+
+def measure(count: int) -> Dict[str, float]:
+    """
+    Đăng ký count client vào 1 broker mới và đo bộ nhớ
+    Args:
+        count: Số client
+    Returns:
+        dict: bytes_per_client, total_mb, register_per_sec
+    """
+    names = [f"client-{i}" for i in range(count)]
+    key = os.urandom(32)
+    keys = [key[:31] + bytes((i & 0xFF,)) for i in range(count)]
+    broker = InMemoryBroker()
+    gc.collect()
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    for name, public_key in zip(names, keys):
+        broker.register_client(name, public_key, _deliver)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    used = after - before
+    assert len(broker.clients) == count
+    return {
+        "bytes_per_client": used / count,
+        "total_mb": used / (1024 * 1024),
+        "register_per_sec": count / elapsed,
+    }
+
+
+def main(argv: List[str] | None = None) -> int:
+    """
+    Entry point của benchmark
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(description="Đo bộ nhớ registry client của InMemoryBroker")
+    parser.add_argument("--counts", type=int, nargs="+", default=DEFAULT_COUNTS, help="Số client cần đăng ký")
+    parser.add_argument("-o", "--output", help="Ghi kết quả JSON ra file này")
+    args = parser.parse_args(argv)
+
+    print("🧮 Đang đo bộ nhớ registry...")
+    results: Dict[str, Dict[str, float]] = {}
+    for count in args.counts:
+        results[str(count)] = result = measure(count)
+        print(f"  {count:>10,} client  {result['bytes_per_client']:>8.1f} B/client  {result['total_mb']:>9.1f} MB  {result['register_per_sec']:>10,.0f} đăng ký/s", flush=True)
+
+    if args.output:
+        report = {
+            "meta": {
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "machine": platform.machine(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Đã ghi kết quả vào {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Đo tốc độ dựng HTML bubble tin nhắn trong app/history.py.
+
+So sánh cách dựng cũ (f-string CSS inline cho từng bubble, gọi
+datetime.now().strftime và escape nhãn người gửi mỗi lần) với cách hiện tại
+(template dựng sẵn, style dùng chung theo class, cache thời gian theo phút,
+nhãn người gửi escape 1 lần cho mỗi đối tác). Đo tin/giây cho từng bubble và
+cho cả file xuất lịch sử; chạy không cần Qt.
+
+Sử dụng:
+    python scripts/bench_render.py
+    python scripts/bench_render.py --messages 50000 -o render.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import html as py_html
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+# Cho phép chạy trực tiếp từ thư mục gốc hoặc thư mục scripts/
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from app.history import ChatMessage, _export_history_html, _format_bubble  # noqa: E402
+
+DEFAULT_MESSAGES = 20_000
+DEFAULT_PEERS = 8  # Số đối tác khác nhau trong lịch sử giả lập
+DEFAULT_ROUNDS = 5  # Lấy kết quả tốt nhất trong số lần đo
+
+
+def _legacy_format_bubble(sender: str, text: str, outgoing: bool, timestamp: Optional[str] = None) -> str:
+    """Cách dựng bubble trước đây (CSS inline cho từng tin), giữ lại làm mốc so sánh"""
+    ts = timestamp or datetime.datetime.now().strftime("%d/%m/%Y %H:%M")
+    safe_text = py_html.escape(text)
+    safe_sender = py_html.escape(sender)  # noqa: F841
+    justify = 'flex-end' if outgoing else 'flex-start'
+    bg = "#0084ff" if outgoing else "#e4e6ea"
+    fg = "#ffffff" if outgoing else "#1c1e21"
+    radius = "18px 18px 4px 18px" if outgoing else "18px 18px 18px 4px"
+    return (
+        f"<div style='display:flex; justify-content:{justify}; margin:2px 0; padding:0 12px;'>"
+        f"  <div style='max-width:70%; background:{bg}; color:{fg}; padding:10px 14px; border-radius:{radius}; font-size:14px; line-height:1.4; box-shadow:0 1px 2px rgba(0,0,0,0.1);'>"
+        f"    <div style='white-space:pre-wrap; margin-bottom:4px;'>{safe_text}</div>"
+        f"    <div style='text-align:right; font-size:11px; opacity:.7; margin-top:4px; font-weight:normal;'>{ts}</div>"
+        f"  </div>"
+        f"</div>"
+    )
+
+
+def _legacy_export(messages: List[ChatMessage]) -> str:
+    """File xuất lịch sử theo cách cũ (bubble CSS inline + khối JSON)"""
+    data = json.dumps(
+        [{"sender": m.sender, "text": m.text, "outgoing": m.outgoing, "timestamp": m.timestamp} for m in messages],
+        ensure_ascii=False,
+    ).replace("</", "<\\/")
+    bubbles = "\n".join(_legacy_format_bubble(m.sender, m.text, m.outgoing, m.timestamp) for m in messages)
+    return f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"></head><body>\n{bubbles}\n<script type=\"application/json\">{data}</script>\n</body></html>\n"
+
+
+def _make_messages(count: int, peers: int) -> List[ChatMessage]:
+    """Lịch sử giả lập: tin gửi/nhận xen kẽ với vài đối tác, độ dài khác nhau"""
+    names = [f"Người dùng {i}" for i in range(peers)]
+    return [
+        ChatMessage(
+            ("Bạn → " if i % 2 else "") + names[i % peers] + ("" if i % 2 else " → Bạn"),
+            f"Tin nhắn số {i} <{i % 7}> " + "xin chào " * (i % 20),
+            bool(i % 2),
+            "",
+        )
+        for i in range(count)
+    ]
+
+
+def _best_rate(fn: Callable[[], object], count: int, rounds: int) -> float:
+    """Chạy fn rounds lần, trả về số tin/giây của lần nhanh nhất"""
+    fn()  # Làm nóng
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+
+def run(count: int, peers: int, rounds: int) -> Dict[str, Dict[str, float]]:
+    """
+    Đo bubble (thời gian hiện tại, như lúc nhận tin) và file xuất (thời gian có sẵn)
+    Returns:
+        dict: Kết quả theo từng phép đo, mỗi phép đo gồm before/after/speedup
+    """
+    messages = _make_messages(count, peers)
+    stamped = [ChatMessage(m.sender, m.text, m.outgoing, "18/10/2026 10:00") for m in messages]
+    cases = {
+        "bubble": (
+            lambda: [_legacy_format_bubble(m.sender, m.text, m.outgoing) for m in messages],
+            lambda: [_format_bubble(m.sender, m.text, m.outgoing) for m in messages],
+        ),
+        "export": (
+            lambda: _legacy_export(stamped),
+            lambda: _export_history_html(stamped),
+        ),
+    }
+    results: Dict[str, Dict[str, float]] = {}
+    for name, (before, after) in cases.items():
+        rate_before = _best_rate(before, count, rounds)
+        rate_after = _best_rate(after, count, rounds)
+        results[name] = {"before_msgs_per_sec": rate_before, "after_msgs_per_sec": rate_after, "speedup": rate_after / rate_before}
+    results["export"]["before_bytes_per_msg"] = len(_legacy_export(stamped).encode("utf-8")) / count
+    results["export"]["after_bytes_per_msg"] = len(_export_history_html(stamped).encode("utf-8")) / count
+    return results
+
+
+def main(argv: List[str] | None = None) -> int:
+    """
+    Entry point của benchmark
+    Returns:
+        int: Exit code
+    """
+    parser = argparse.ArgumentParser(description="Đo tốc độ dựng HTML bubble tin nhắn (trước/sau)")
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES, help="Số tin nhắn mỗi lần đo")
+    parser.add_argument("--peers", type=int, default=DEFAULT_PEERS, help="Số đối tác khác nhau")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS, help="Số lần đo (lấy lần nhanh nhất)")
+    parser.add_argument("-o", "--output", help="Ghi kết quả JSON ra file này")
+    args = parser.parse_args(argv)
+
+    print(f"🎨 Đang đo dựng HTML với {args.messages:,} tin nhắn...")
+    results = run(args.messages, args.peers, args.rounds)
+    for name, r in results.items():
+        print(f"  {name:<8} trước {r['before_msgs_per_sec']:>12,.0f} tin/s   sau {r['after_msgs_per_sec']:>12,.0f} tin/s   x{r['speedup']:.2f}")
+    export = results["export"]
+    print(f"  kích thước file xuất: {export['before_bytes_per_msg']:.0f} → {export['after_bytes_per_msg']:.0f} B/tin")
+
+    if args.output:
+        report = {
+            "meta": {
+                "python": platform.python_version(),
+                "implementation": platform.python_implementation(),
+                "machine": platform.machine(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "messages": args.messages,
+                "peers": args.peers,
+            },
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Đã ghi kết quả vào {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
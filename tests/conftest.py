@@ -0,0 +1,6 @@
+"""Cấu hình pytest: cho phép import gói app khi chạy từ thư mục gốc hoặc tests/"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
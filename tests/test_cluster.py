@@ -0,0 +1,158 @@
+"""Kiểm thử chuyển tiếp frame giữa các shard (app.cluster)"""
+
+import asyncio
+import os
+import socket
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import cluster
+from app.cluster import ClusterConfig, _PeerLink
+from app.server import BrokerServer
+from app.transport import BrokerMetrics, RemoteBroker
+from app.wire import MSG_LENGTH_BYTES, OP_AUTH, OP_SEND, encode_frame, pack_message, read_message_length, unpack_message
+
+SECRET = b"s" * 32
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(cluster, "CLUSTER_RETRY", 0.05)
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_peer_link_counts_dropped_batch(tmp_path):
+    metrics = BrokerMetrics()
+    with ThreadPoolExecutor(1) as pool:
+        link = _PeerLink(f"unix://{tmp_path / 'missing.sock'}", pool, metrics)
+        for _ in range(3):
+            link.forward("peer", b"frame")
+        assert _wait_for(lambda: metrics.forward_dropped == 3)
+        link.close()
+    assert metrics.snapshot().forward_dropped == 3
+
+
+def test_peer_link_resends_batch_when_peer_comes_up(tmp_path):
+    path = str(tmp_path / "peer.sock")
+    metrics = BrokerMetrics()
+    received = []
+
+    def serve():
+        time.sleep(0.07)  # Shard đích khởi động sau lần gửi đầu tiên
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(path)
+            server.listen(1)
+            conn, _ = server.accept()
+            with conn, conn.makefile("rb") as reader:
+                header = reader.read(MSG_LENGTH_BYTES)
+                received.append(unpack_message(reader.read(read_message_length(header))))
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    with ThreadPoolExecutor(1) as pool:
+        link = _PeerLink(f"unix://{path}", pool, metrics)
+        link.forward("peer", b"frame")
+        thread.join(2)
+        link.close()
+    assert len(received) == 1
+    op, fields = received[0]
+    assert op == OP_SEND and [bytes(f) for f in fields] == [b"peer", b"frame"]
+    assert metrics.forward_dropped == 0
+
+
+@pytest.fixture
+def shard(tmp_path):
+    """BrokerServer có listener client (TCP) và listener nội bộ (Unix socket, cần SECRET)"""
+    ready = threading.Event()
+    state = {"peer": f"unix://{tmp_path / 'shard.peer.sock'}"}
+
+    def run():
+        async def go():
+            server = BrokerServer()
+            await server.start("tcp://127.0.0.1:0")
+            await server.start(state["peer"], trusted=True, secret=SECRET)
+            state["url"] = server.addresses[0]
+            state["loop"] = asyncio.get_running_loop()
+            state["stop"] = asyncio.Event()
+            ready.set()
+            await state["stop"].wait()
+            await server.close()
+
+        asyncio.run(go())
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait(5)
+    yield state
+    state["loop"].call_soon_threadsafe(state["stop"].set)
+    thread.join(5)
+
+
+def _forged(to_client_id):
+    return pack_message(OP_SEND, to_client_id.encode("utf-8"), bytes(encode_frame("mallory", b"m" * 32, b"n" * 12, b"gia mao")))
+
+
+@pytest.mark.parametrize("auth", [b"", pack_message(OP_AUTH, b"x" * 32), pack_message(OP_AUTH, SECRET[:-1])])
+def test_peer_listener_drops_unauthenticated_connection(shard, auth):
+    bob = RemoteBroker(shard["url"])
+    try:
+        received = []
+        bob_id = bob.register_client("Bob", b"b" * 32, received.append)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(2)
+            sock.connect(shard["peer"][len("unix://"):])
+            sock.sendall(auth + _forged(bob_id))
+            assert sock.recv(1) == b""
+        time.sleep(0.1)
+        assert received == []
+    finally:
+        bob.close()
+
+
+def test_peer_link_authenticates_with_cluster_secret(shard):
+    bob = RemoteBroker(shard["url"])
+    try:
+        received = []
+        bob_id = bob.register_client("Bob", b"b" * 32, received.append)
+        with ThreadPoolExecutor(1) as pool:
+            link = _PeerLink(shard["peer"], pool, secret=SECRET)
+            link.forward(bob_id, bytes(encode_frame("carol", b"c" * 32, b"n" * 12, b"chuyen tiep")))
+            assert _wait_for(lambda: len(received) == 1)
+            link.close()
+        peer = RemoteBroker(shard["peer"], secret=SECRET)
+        try:
+            assert bob_id in peer.list_clients()
+        finally:
+            peer.close()
+    finally:
+        bob.close()
+
+
+def test_config_keeps_secret_private(tmp_path):
+    config = ClusterConfig.create(str(tmp_path), 2)
+    assert len(config.peer_secret) == cluster.CLUSTER_SECRET_BYTES
+    assert ClusterConfig.create(str(tmp_path), 2).secret != config.secret
+    config.save(str(tmp_path))
+    path = tmp_path / cluster.CLUSTER_CONFIG
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    loaded = ClusterConfig.load(str(tmp_path))
+    assert loaded.peer_secret == config.peer_secret
+    assert loaded.peer_url("shard-0") == config.peers["shard-0"]
+    # Cấu hình cũ không có khoá: không dùng listener nội bộ
+    loaded.secret = ""
+    assert loaded.peer_url("shard-0") == config.shards["shard-0"]
+
+
+def test_trusted_listener_requires_secret(tmp_path):
+    with pytest.raises(ValueError):
+        asyncio.run(BrokerServer().start(f"unix://{tmp_path / 'peer.sock'}", trusted=True))
@@ -0,0 +1,271 @@
+"""Kiểm thử các tiện ích của app.crypto"""
+
+import io
+import mmap
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+from app.crypto import (
+    BATCH_MIN_PER_WORKER,
+    SENDER_KEY_AAD,
+    KeyPair,
+    NonceSequence,
+    RekeyRequired,
+    SenderKey,
+    Session,
+    SessionClosed,
+    SessionKeyCache,
+    StreamError,
+    _iter_chunks,
+    decrypt_many,
+    decrypt_stream,
+    encrypt_many,
+    encrypt_stream,
+    nonce_sequence_number,
+    public_key_bytes,
+)
+
+DATA = bytes(range(256)) * 40
+
+
+def _joined(chunks):
+    return b"".join(bytes(chunk) for chunk in chunks)
+
+
+def test_iter_chunks_mmap_is_sliced_from_start(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(DATA)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        mapped.seek(100)
+        chunks = list(_iter_chunks(mapped, 1000))
+        assert all(isinstance(chunk, memoryview) for chunk in chunks)
+        assert _joined(chunks) == DATA
+        del chunks
+
+
+def test_iter_chunks_file_and_iterable_sources():
+    assert _joined(_iter_chunks(io.BytesIO(DATA), 999)) == DATA
+    assert _joined(_iter_chunks([DATA[:5000], DATA[5000:]], 999)) == DATA
+    assert all(len(chunk) <= 999 for chunk in _iter_chunks(bytearray(DATA), 999))
+
+
+def test_session_key_cache_eviction_keeps_returned_key():
+    cache = SessionKeyCache(max_entries=1)
+    own = KeyPair.generate()
+    first_peer = public_key_bytes(KeyPair.generate().public_key)
+    first = cache.get(own, first_peer)
+    held = bytes(first)
+    cache.get(own, public_key_bytes(KeyPair.generate().public_key))
+    assert len(cache) == 1
+    assert bytes(first) == held and any(held)
+    assert cache.get(own, first_peer) == held
+
+
+def test_sessions_for_same_peer_share_nonce_sequence():
+    alice, bob = KeyPair.generate(), KeyPair.generate()
+    first = Session.for_peer(alice, bob.public_bytes())
+    second = Session.for_peer(alice, bob.public_bytes())
+    assert first.nonces is second.nonces
+    nonces = [first.encrypt(b"a")[0], second.encrypt(b"b")[0], first.encrypt(b"c")[0]]
+    assert [nonce_sequence_number(n) for n in nonces] == [0, 1, 2]
+    assert len({n[:4] for n in nonces}) == 1
+
+
+def test_direction_bit_separates_nonces_of_both_sides():
+    alice, bob = KeyPair.generate(), KeyPair.generate()
+    to_bob = Session.for_peer(alice, bob.public_bytes())
+    to_alice = Session.for_peer(bob, alice.public_bytes())
+    assert to_bob.key == to_alice.key
+    assert (to_bob.nonces.prefix[0] ^ to_alice.nonces.prefix[0]) & 0x80
+    assert (to_bob.nonces.prefix[0] & 0x80) == (0x80 if alice.public_bytes() < bob.public_bytes() else 0)
+    nonce, ciphertext = to_bob.encrypt(b"xin chao")
+    assert to_alice.decrypt(nonce, ciphertext) == b"xin chao"
+
+
+def test_rekey_required_after_limit():
+    nonces = NonceSequence(limit=2)
+    session = Session(bytes(32), nonces)
+    session.encrypt(b"1")
+    session.encrypt(b"2")
+    assert nonces.remaining == 0
+    with pytest.raises(RekeyRequired):
+        session.encrypt(b"3")
+    with pytest.raises(RekeyRequired):
+        Session(bytes(32), nonces).encrypt(b"3")
+    assert nonces.counter == 2
+
+
+def test_cache_session_limit_counts_across_sessions():
+    cache = SessionKeyCache()
+    own, peer = KeyPair.generate(), KeyPair.generate().public_bytes()
+    key, nonces = cache.session(own, peer)
+    nonces.limit = 1
+    Session(key, nonces).encrypt(b"1")
+    again_key, again = cache.session(own, peer)
+    assert again is nonces and again_key == key
+    with pytest.raises(RekeyRequired):
+        Session(again_key, again).encrypt(b"2")
+
+
+def test_closed_session_rejects_every_operation():
+    session = Session(b"k" * 32)
+    nonce, ciphertext = session.encrypt(b"truoc khi dong")
+    session.close()
+    session.close()
+    assert not any(session._key)
+    with pytest.raises(SessionClosed):
+        session.encrypt(b"x")
+    with pytest.raises(SessionClosed):
+        session.decrypt(nonce, ciphertext)
+    with pytest.raises(SessionClosed):
+        session.decrypt(nonce, ciphertext, out=bytearray(64))
+    with pytest.raises(SessionClosed):
+        session.key
+    assert session.nonces.counter == 1
+
+
+def test_decrypt_into_buffer_rejects_short_ciphertext():
+    session = Session(b"k" * 32)
+    nonce, ciphertext = session.encrypt(b"xin chao")
+    out = bytearray(64)
+    assert bytes(session.decrypt(nonce, ciphertext, out=out)) == b"xin chao"
+    with pytest.raises(InvalidTag):
+        session.decrypt(nonce, ciphertext[:5], out=out)
+    with pytest.raises(InvalidTag):
+        session.decrypt(nonce, b"", out=out)
+
+
+def _pairwise():
+    alice, bob = KeyPair.generate(), KeyPair.generate()
+    return Session.for_peer(alice, bob.public_bytes()), Session.for_peer(bob, alice.public_bytes())
+
+
+def test_sender_key_distribution_round_trip():
+    to_bob, from_alice = _pairwise()
+    sender = SenderKey.generate()
+    received = SenderKey.open(from_alice, *sender.seal_for(to_bob))
+    assert received.group_id == sender.group_id
+    nonce, ciphertext = sender.encrypt(b"chao ca nhom")
+    assert received.decrypt(nonce, ciphertext) == b"chao ca nhom"
+    with pytest.raises(ValueError):
+        received.encrypt(b"gia danh")
+
+
+def test_sender_key_rejects_member_forgery_and_tampering():
+    to_bob, from_alice = _pairwise()
+    sender = SenderKey.generate()
+    received = SenderKey.open(from_alice, *sender.seal_for(to_bob))
+    # Thành viên giữ khoá nhóm tự ký bằng khoá của mình
+    forger = SenderKey.generate(received.group_id)
+    forger.session = Session(received.session.key)
+    with pytest.raises(InvalidTag):
+        received.decrypt(*forger.encrypt(b"gia mao"))
+    nonce, ciphertext = sender.encrypt(b"that")
+    for tampered in (ciphertext[:-1] + bytes([ciphertext[-1] ^ 1]), bytes([ciphertext[0] ^ 1]) + ciphertext[1:], ciphertext[:10]):
+        with pytest.raises(InvalidTag):
+            received.decrypt(nonce, tampered)
+
+
+def test_tampered_sender_key_packet_is_rejected():
+    to_bob, from_alice = _pairwise()
+    nonce, packet = SenderKey.generate().seal_for(to_bob)
+    with pytest.raises(InvalidTag):
+        SenderKey.open(from_alice, nonce, packet[:-1] + bytes([packet[-1] ^ 1]))
+    with pytest.raises(ValueError):
+        SenderKey.open(from_alice, *to_bob.encrypt(b"ngan qua", SENDER_KEY_AAD))
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_decrypt_many_isolates_failures(workers):
+    session = Session(b"k" * 32)
+    count = 4 * BATCH_MIN_PER_WORKER
+    sealed = encrypt_many(session, [(b"tin %d" % i, b"aad") for i in range(count)], workers=workers)
+    assert sealed.ok and len({nonce for nonce, _ in sealed.results}) == count
+    items = [(nonce, ciphertext, b"aad") for nonce, ciphertext in sealed.results]
+    bad = {3, BATCH_MIN_PER_WORKER + 1, count - 1}
+    for i in bad:
+        nonce, ciphertext, aad = items[i]
+        items[i] = (nonce, ciphertext[:-1] + bytes([ciphertext[-1] ^ 1]), aad)
+    opened = decrypt_many(session, items, workers=workers)
+    assert sorted(i for i, _ in opened.failures) == sorted(bad)
+    assert all(isinstance(exc, InvalidTag) for _, exc in opened.failures)
+    assert [opened.results[i] for i in range(count) if i not in bad] == [b"tin %d" % i for i in range(count) if i not in bad]
+    assert all(opened.results[i] is None for i in bad)
+
+
+def test_encrypt_many_reports_items_past_rekey_limit():
+    session = Session(b"k" * 32, NonceSequence(limit=3))
+    batch = encrypt_many(session, [(b"%d" % i, None) for i in range(5)])
+    assert not batch.ok
+    assert [i for i, _ in batch.failures] == [3, 4]
+    assert all(isinstance(exc, RekeyRequired) for _, exc in batch.failures)
+    assert [session.decrypt(*result) for result in batch.results[:3]] == [b"0", b"1", b"2"]
+
+
+
+def _stream(aad=b"tep"):
+    sender, receiver = _pairwise()
+    return receiver, list(encrypt_stream(sender, DATA, 1000, aad))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 1000, len(DATA), 64 * 1024])
+@pytest.mark.parametrize("source", [bytes, io.BytesIO, lambda data: [data[:7], b"", data[7:]]])
+def test_stream_round_trip(chunk_size, source):
+    sender, receiver = _pairwise()
+    segments = list(encrypt_stream(sender, source(DATA), chunk_size, b"tep"))
+    assert len(segments[0]) == 12 and len(segments[-1]) == 16
+    assert _joined(decrypt_stream(receiver, segments, b"tep")) == DATA
+
+
+def test_empty_stream_has_only_header_and_final_segment():
+    sender, receiver = _pairwise()
+    segments = list(encrypt_stream(sender, b""))
+    assert len(segments) == 2
+    assert _joined(decrypt_stream(receiver, segments)) == b""
+
+
+def test_stream_detects_truncation():
+    session, segments = _stream()
+    with pytest.raises(StreamError):
+        _joined(decrypt_stream(session, segments[:-1], b"tep"))
+    # Bỏ đoạn kết thúc lẫn vài đoạn dữ liệu cuối cũng bị phát hiện
+    with pytest.raises(StreamError):
+        _joined(decrypt_stream(session, segments[:5], b"tep"))
+    with pytest.raises(StreamError):
+        _joined(decrypt_stream(session, [], b"tep"))
+    with pytest.raises(StreamError):
+        _joined(decrypt_stream(session, [segments[0][:-1]] + segments[1:], b"tep"))
+
+
+def test_stream_detects_reordering_and_tampering():
+    session, segments = _stream()
+    swapped = segments[:1] + [segments[2], segments[1]] + segments[3:]
+    with pytest.raises(InvalidTag):
+        _joined(decrypt_stream(session, swapped, b"tep"))
+    # Đoạn cuối bị chèn vào giữa: sai chỉ số đoạn
+    with pytest.raises(InvalidTag):
+        _joined(decrypt_stream(session, segments[:2] + segments[-1:] + segments[2:-1], b"tep"))
+    tampered = segments[:3] + [bytes([segments[3][0] ^ 1]) + segments[3][1:]] + segments[4:]
+    with pytest.raises(InvalidTag):
+        _joined(decrypt_stream(session, tampered, b"tep"))
+    with pytest.raises(InvalidTag):
+        _joined(decrypt_stream(session, segments, b"khac"))
+
+
+def test_stream_rejects_trailing_data():
+    session, segments = _stream()
+    with pytest.raises(StreamError):
+        _joined(decrypt_stream(session, segments + [segments[1]], b"tep"))
+    with pytest.raises(StreamError):
+        _joined(decrypt_stream(session, segments + [segments[-1]], b"tep"))
+
+
+def test_stream_subkey_requires_open_session():
+    session = Session(b"k" * 32)
+    assert session.derive_key(b"salt", b"a") != session.derive_key(b"salt", b"b")
+    session.close()
+    with pytest.raises(SessionClosed):
+        next(encrypt_stream(session, DATA))
+    with pytest.raises(SessionClosed):
+        session.derive_key(b"salt", b"a")
@@ -0,0 +1,77 @@
+"""Kiểm thử thứ tự lane và dọn lane của CryptoExecutor"""
+
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("PySide6.QtCore")
+
+from app.executor import CryptoExecutor  # noqa: E402
+
+
+@pytest.fixture
+def executor():
+    executor = CryptoExecutor(max_workers=4)
+    # Gom tác vụ xong thay vì đi qua signal, test tự gọi _deliver như GUI thread
+    finished = []
+    executor._task_finished = type("Collect", (), {"emit": staticmethod(finished.append)})()
+    executor.finished = finished
+    yield executor
+    executor.shutdown()
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_lane_results_in_submit_order_and_lane_pruned(executor):
+    release = threading.Event()
+    results = []
+
+    def slow(value):
+        release.wait(5)
+        return value
+
+    executor.submit(slow, 0, lane="chat", on_done=results.append)
+    for value in range(1, 5):
+        executor.submit(lambda v: v, value, lane="chat", on_done=results.append)
+    assert _wait_for(lambda: len(executor.finished) == 4)
+    for task in list(executor.finished):
+        executor._deliver(task)
+    assert results == []
+    release.set()
+    assert _wait_for(lambda: len(executor.finished) == 5)
+    executor._deliver(executor.finished[-1])
+    assert results == [0, 1, 2, 3, 4]
+    assert executor._lane_seq == {} and executor._lane_next == {} and executor._lane_ready == {}
+
+    executor.submit(lambda: "again", lane="chat", on_done=results.append)
+    assert _wait_for(lambda: len(executor.finished) == 6)
+    executor._deliver(executor.finished[-1])
+    assert results[-1] == "again" and executor._lane_seq == {}
+    assert executor.stats().queue_depth == 0
+
+
+def test_raising_callback_does_not_stall_lane(executor, monkeypatch):
+    reported = []
+    monkeypatch.setattr("sys.excepthook", lambda *exc_info: reported.append(exc_info[1]))
+    results = []
+
+    def explode(value):
+        raise RuntimeError("callback lỗi")
+
+    executor.submit(lambda: 0, lane="chat", on_done=explode)
+    executor.submit(lambda: 1, lane="chat", on_done=results.append)
+    executor.submit(lambda: 1 / 0, lane="chat", on_error=lambda exc: explode(exc))
+    executor.submit(lambda: 3, lane="chat", on_done=results.append)
+    assert _wait_for(lambda: len(executor.finished) == 4)
+    for task in sorted(executor.finished, key=lambda t: -t.seq):
+        executor._deliver(task)
+    assert results == [1, 3]
+    assert [str(exc) for exc in reported] == ["callback lỗi", "callback lỗi"]
+    assert executor._lane_ready == {} and executor._lane_seq == {}
+    assert executor.stats().queue_depth == 0
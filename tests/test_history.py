@@ -0,0 +1,262 @@
+"""Kiểm thử kho lịch sử MessageStore (SQLite WAL, group commit, chuyển file HTML cũ) và bubble HTML xuất ra"""
+
+import datetime
+import html
+import re
+import sqlite3
+from html.parser import HTMLParser
+
+import pytest
+
+from app import history
+from app.history import EXPORT_STYLESHEET, ChatMessage, HistoryWriteError, MessageStore, _export_history_html, _format_bubble
+
+
+def _message(i, outgoing=False):
+    return ChatMessage("Bob", f"tin {i}", outgoing, "01/01/2024 10:00")
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MessageStore(str(tmp_path / "alice.db"))
+    yield store
+    store.close()
+
+
+def test_store_uses_wal_and_assigns_increasing_ids(store):
+    assert store._db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    ids = [store.append(_message(i)).id for i in range(3)]
+    assert ids == [1, 2, 3]
+    assert store.flush(2)
+    assert [m.text for m in store.messages()] == ["tin 0", "tin 1", "tin 2"]
+
+
+def test_group_commit_writes_burst_in_one_transaction(tmp_path):
+    store = MessageStore(str(tmp_path / "alice.db"), commit_window=0.05)
+    try:
+        batches = []
+        write_batch = store._write_batch
+        store._write_batch = lambda db, batch: batches.append(len(batch)) or write_batch(db, batch)
+        for i in range(50):
+            store.append(_message(i))
+        assert store.flush(2)
+        assert batches == [50]
+        assert store.count() == 50
+    finally:
+        store.close()
+
+
+def test_close_writes_pending_and_rejects_append(tmp_path):
+    path = str(tmp_path / "alice.db")
+    store = MessageStore(path, commit_window=0.05)
+    for i in range(5):
+        store.append(_message(i, outgoing=i % 2 == 0))
+    store.close()
+    with pytest.raises(RuntimeError):
+        store.append(_message(5))
+
+    reopened = MessageStore(path)
+    try:
+        messages = reopened.messages()
+        assert [m.text for m in messages] == [f"tin {i}" for i in range(5)]
+        assert [m.outgoing for m in messages] == [True, False, True, False, True]
+        assert reopened.append(_message(5)).id == 6
+    finally:
+        reopened.close()
+
+
+def test_failed_write_is_reported_to_flush_and_callback(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "WRITE_RETRY_DELAY", 0)
+    errors = []
+    store = MessageStore(str(tmp_path / "alice.db"), on_error=errors.append)
+    try:
+        store._db.execute("CREATE TRIGGER fail BEFORE INSERT ON messages BEGIN SELECT RAISE(ABORT, 'đĩa đầy'); END")
+        store._db.commit()
+        store.append(_message(0))
+        with pytest.raises(HistoryWriteError):
+            store.flush(2)
+        assert len(errors) == 1 and isinstance(store.last_error, sqlite3.Error)
+        assert store.count() == 0
+
+        store._db.execute("DROP TRIGGER fail")
+        store._db.commit()
+        store.append(_message(1))
+        assert store.flush(2)
+        assert [m.text for m in store.messages()] == ["tin 1"]
+    finally:
+        store.close()
+
+
+def test_migrates_exported_html(tmp_path):
+    legacy = tmp_path / "alice.html"
+    legacy.write_text(_export_history_html([_message(0, outgoing=True), ChatMessage("Bob", "<b>&</b>", False, "02/01/2024 11:00")]), encoding="utf-8")
+    store = MessageStore(str(tmp_path / "alice.db"), legacy_html=str(legacy))
+    try:
+        messages = store.messages()
+        assert [(m.id, m.text, m.outgoing, m.timestamp) for m in messages] == [
+            (1, "tin 0", True, "01/01/2024 10:00"),
+            (2, "<b>&</b>", False, "02/01/2024 11:00"),
+        ]
+        assert store.append(_message(2)).id == 3
+    finally:
+        store.close()
+    assert legacy.exists()
+
+
+def test_migrates_qtextbrowser_html_only_into_new_store(tmp_path):
+    legacy = tmp_path / "alice.html"
+    legacy.write_text(
+        '<p><span style="font-size:14px; color:#ffffff;">xin chào<br />dòng 2</span></p>'
+        '<p><span style="font-size:11px; color:#ffffff;">01/01/2024 10:00</span></p>'
+        '<p><span style="font-size:14px; color:#1c1e21;">a &amp; b</span></p>'
+        '<p><span style="font-size:11px; color:#65676b;">01/01/2024 10:01</span></p>',
+        encoding="utf-8",
+    )
+    path = str(tmp_path / "alice.db")
+    store = MessageStore(path, legacy_html=str(legacy))
+    store.close()
+    store = MessageStore(path, legacy_html=str(legacy))
+    try:
+        messages = store.messages()
+        assert [(m.text, m.outgoing, m.timestamp) for m in messages] == [
+            ("xin chào\ndòng 2", True, "01/01/2024 10:00"),
+            ("a & b", False, "01/01/2024 10:01"),
+        ]
+    finally:
+        store.close()
+
+
+def test_pages_by_id_cursor(store):
+    for i in range(10):
+        store.append(_message(i))
+    store.flush(2)
+    assert [m.id for m in store.latest(3)] == [8, 9, 10]
+    assert [m.id for m in store.latest(20)] == list(range(1, 11))
+    assert [m.id for m in store.before(8, 3)] == [5, 6, 7]
+    assert [m.id for m in store.before(3, 5)] == [1, 2]
+    assert store.before(1, 5) == []
+    assert [m.id for m in store.after(7, 2)] == [8, 9]
+    assert [m.id for m in store.after(8, 5)] == [9, 10]
+    assert store.after(10, 5) == []
+
+
+def test_before_and_after_include_messages_still_queued(tmp_path):
+    store = MessageStore(str(tmp_path / "alice.db"), commit_window=0.05)
+    try:
+        for i in range(4):
+            store.append(_message(i))
+        assert [m.id for m in store.after(2, 5)] == [3, 4]
+        store.append(_message(4))
+        assert [m.id for m in store.before(6, 5)] == [1, 2, 3, 4, 5]
+    finally:
+        store.close()
+
+
+def _legacy_bubble(sender, text, outgoing, ts):
+    """Bubble style inline trước khi chuyển sang template dựng sẵn (để so sánh)"""
+    justify = "flex-end" if outgoing else "flex-start"
+    bg = "#0084ff" if outgoing else "#e4e6ea"
+    fg = "#ffffff" if outgoing else "#1c1e21"
+    radius = "18px 18px 4px 18px" if outgoing else "18px 18px 18px 4px"
+    return (
+        f"<div style='display:flex; justify-content:{justify}; margin:2px 0; padding:0 12px;'>"
+        f"  <div style='max-width:70%; background:{bg}; color:{fg}; padding:10px 14px; border-radius:{radius}; font-size:14px; line-height:1.4; box-shadow:0 1px 2px rgba(0,0,0,0.1);'>"
+        f"    <div style='white-space:pre-wrap; margin-bottom:4px;'>{html.escape(text)}</div>"
+        f"    <div style='text-align:right; font-size:11px; opacity:.7; margin-top:4px; font-weight:normal;'>{ts}</div>"
+        f"  </div>"
+        f"</div>"
+    )
+
+
+def _declarations(style):
+    return {k.strip(): v.strip() for k, v in (d.split(":", 1) for d in style.split(";") if d.strip())}
+
+
+class _Rendered(HTMLParser):
+    """Gom style hiệu lực (inline hoặc theo class trong EXPORT_STYLESHEET) và text của từng div"""
+
+    def __init__(self, stylesheet):
+        super().__init__()
+        # Chỉ xét selector theo class (bubble không nằm trong thẻ body khi so sánh)
+        rules = [(sel.split(), _declarations(body)) for sel, body in re.findall(r"([^{}]+)\{([^{}]*)\}", stylesheet)]
+        self.rules = [(parts, decls) for parts, decls in rules if all(p.startswith(".") for p in parts)]
+        self.stack = []
+        self.divs = []
+
+    def _matches(self, compound, classes):
+        return set(compound.split(".")[1:]) <= classes
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").split())
+        style = {}
+        for parts, decls in self.rules:
+            if self._matches(parts[-1], classes) and all(any(self._matches(p, a) for a in self.stack) for p in parts[:-1]):
+                style.update(decls)
+        style.update(_declarations(attrs.get("style") or ""))
+        self.stack.append(classes)
+        self.divs.append([style, ""])
+        self._open = self.divs[-1]
+
+    def handle_endtag(self, tag):
+        self.stack.pop()
+
+    def handle_data(self, data):
+        if data.strip():
+            self._open[1] += data
+
+
+def _render(markup, stylesheet=""):
+    parser = _Rendered(stylesheet)
+    parser.feed(markup)
+    return parser.divs
+
+
+@pytest.mark.parametrize("outgoing", [True, False])
+def test_bubble_template_renders_like_inline_style(outgoing):
+    text = "a < b && c > d\n\"trích\" 'dẫn'"
+    new = _render(_format_bubble("Bạn → Bob", text, outgoing, "01/01/2024 10:00"), EXPORT_STYLESHEET)
+    old = _render(_legacy_bubble("Bạn → Bob", text, outgoing, "01/01/2024 10:00"))
+    assert new == old
+    assert new[2][1] == text and new[3][1] == "01/01/2024 10:00"
+
+
+def test_bubble_escapes_text_and_sender():
+    markup = _format_bubble('"><script>x</script>', "<img src=x onerror=alert(1)>&amp;", False, "t")
+    assert "<script>" not in markup and "<img" not in markup
+    assert 'title="&quot;&gt;&lt;script&gt;x&lt;/script&gt;"' in markup
+    assert "&lt;img src=x onerror=alert(1)&gt;&amp;amp;" in markup
+
+
+def test_sender_labels_are_memoized_and_bounded(monkeypatch):
+    monkeypatch.setattr(history, "_sender_labels", {})
+    monkeypatch.setattr(history, "SENDER_LABEL_CACHE", 2)
+    label = history._escape_sender("A & B")
+    assert label == "A &amp; B" and history._escape_sender("A & B") is label
+    history._escape_sender("C")
+    history._escape_sender("D")
+    assert list(history._sender_labels) == ["D"]
+
+
+def test_timestamp_is_reformatted_only_on_new_minute(monkeypatch):
+    calls = []
+    real = datetime.datetime
+
+    class Clock(real):
+        @classmethod
+        def fromtimestamp(cls, t, tz=None):
+            calls.append(t)
+            return real.fromtimestamp(t, tz)
+
+    now = [1_700_000_000.0]
+    minute = now[0] // 60 * 60
+    expected = real.fromtimestamp(minute).strftime("%d/%m/%Y %H:%M")
+    monkeypatch.setattr(history, "_timestamp_cache", (-1, ""))
+    monkeypatch.setattr(history.datetime, "datetime", Clock)
+    monkeypatch.setattr(history.time, "time", lambda: now[0])
+    first = history._format_timestamp()
+    assert first == expected
+    now[0] = minute + 59.9
+    assert history._format_timestamp() == first and len(calls) == 1
+    now[0] = minute + 60
+    assert history._format_timestamp() != first and len(calls) == 2
@@ -0,0 +1,145 @@
+"""Kiểm thử OfflineLog: khôi phục, nén log, ACK, khoá client và giới hạn bytes chờ"""
+
+import os
+
+from app.offline import SEGMENT_SUFFIX, OfflineLog
+
+
+def _segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+def test_take_returns_frames_in_send_order(tmp_path):
+    log = OfflineLog(str(tmp_path))
+    for i in range(5):
+        log.append("bob", b"frame-%d" % i)
+    log.append("alice", b"other")
+    assert log.pending("bob") == 5
+    assert log.take("bob") == [b"frame-%d" % i for i in range(5)]
+    assert log.pending("bob") == 0
+    assert log.take("bob") == []
+    assert log.pending("alice") == 1
+    log.close()
+
+
+def test_recover_after_restart(tmp_path):
+    log = OfflineLog(str(tmp_path))
+    log.append("bob", b"a")
+    log.append("bob", b"b")
+    log.append("carol", b"c")
+    assert log.take("carol") == [b"c"]
+    log.close()
+
+    log = OfflineLog(str(tmp_path))
+    assert log.pending("bob") == 2
+    assert log.pending("carol") == 0
+    assert log.take("bob") == [b"a", b"b"]
+    log.close()
+
+    log = OfflineLog(str(tmp_path))
+    assert log.pending("bob") == 0
+    log.close()
+
+
+def test_truncated_tail_record_is_dropped(tmp_path):
+    log = OfflineLog(str(tmp_path))
+    log.append("bob", b"complete")
+    log.append("bob", b"partial-frame")
+    log.close()
+    path = os.path.join(str(tmp_path), _segments(str(tmp_path))[-1])
+    os.truncate(path, os.path.getsize(path) - 3)
+
+    log = OfflineLog(str(tmp_path))
+    assert log.take("bob") == [b"complete"]
+    log.close()
+
+
+def test_compact_drops_delivered_segments(tmp_path):
+    log = OfflineLog(str(tmp_path), segment_bytes=64)
+    for i in range(10):
+        log.append("bob", b"x" * 40)
+    assert len(_segments(str(tmp_path))) > 1
+    log.take("bob")
+    assert log.compact() > 0
+    assert len(_segments(str(tmp_path))) == 1
+    log.close()
+
+
+def test_compact_then_take_then_reopen(tmp_path):
+    # Frame A nằm trong segment thưa bị chép sang segment đang ghi, sau frame B
+    # mới hơn: take() vẫn phải trả [A, B] và ACK cả hai
+    log = OfflineLog(str(tmp_path), segment_bytes=128)
+    log.append("bob", b"A")
+    for _ in range(4):
+        log.append("carol", b"c" * 40)
+    log.take("carol")
+    log.append("bob", b"B")
+    assert log.compact() > 0
+    assert log.take("bob") == [b"A", b"B"]
+    log.close()
+
+    log = OfflineLog(str(tmp_path), segment_bytes=128)
+    assert log.pending("bob") == 0
+    assert log.take("bob") == []
+    log.close()
+
+
+def test_recover_keeps_send_order_after_compact(tmp_path):
+    log = OfflineLog(str(tmp_path), segment_bytes=128)
+    log.append("bob", b"A")
+    for _ in range(4):
+        log.append("carol", b"c" * 40)
+    log.take("carol")
+    log.append("bob", b"B")
+    log.compact()
+    log.close()
+
+    log = OfflineLog(str(tmp_path), segment_bytes=128)
+    assert log.take("bob") == [b"A", b"B"]
+    log.close()
+
+
+def test_expired_frames_are_dropped(tmp_path):
+    log = OfflineLog(str(tmp_path), ttl=0.0)
+    log.append("bob", b"old")
+    log.compact()
+    assert log.pending("bob") == 0
+    log.close()
+
+
+def test_keys_survive_compaction_and_restart(tmp_path):
+    log = OfflineLog(str(tmp_path), segment_bytes=128)
+    log.remember("bob", b"k" * 32)
+    log.remember("carol", b"c" * 32)
+    for _ in range(4):
+        log.append("carol", b"c" * 40)
+    log.take("carol")
+    log.remember("carol", b"C" * 32)
+    assert log.compact() > 0
+    assert log.public_key("bob") == b"k" * 32
+    log.close()
+
+    log = OfflineLog(str(tmp_path), segment_bytes=128)
+    assert log.public_key("bob") == b"k" * 32
+    assert log.public_key("carol") == b"C" * 32
+    assert log.public_key("dave") is None
+    log.close()
+
+
+def test_pending_bytes_are_capped_per_recipient(tmp_path):
+    log = OfflineLog(str(tmp_path), max_pending_bytes=8)
+    assert log.append("bob", b"1234")
+    assert log.append("bob", b"5678")
+    assert not log.append("bob", b"9")
+    assert log.append("carol", b"1234")
+    assert log.take("bob") == [b"1234", b"5678"]
+    assert log.append("bob", b"9")
+    log.close()
+
+
+def test_expired_key_without_backlog_is_forgotten(tmp_path):
+    log = OfflineLog(str(tmp_path), ttl=0.0)
+    log.remember("bob", b"k" * 32)
+    log.compact()
+    assert log.public_key("bob") is None
+    log.close()
@@ -0,0 +1,99 @@
+"""Kiểm thử cửa sổ tin ChatMessageModel khi đọc lịch sử theo trang (không cần QApplication)"""
+
+import pytest
+
+pytest.importorskip("PySide6.QtWidgets")
+
+from app.history import ChatMessage, MessageStore  # noqa: E402
+from app.ui import CHAT_MAX_LOADED, CHAT_PAGE, CHAT_WINDOW, ChatMessageModel  # noqa: E402
+
+
+def _store(tmp_path, count):
+    store = MessageStore(str(tmp_path / "alice.db"), commit_window=0)
+    for i in range(count):
+        store.append(ChatMessage("Bob", f"tin {i}", i % 2 == 0, "01/01/2024 10:00"))
+    store.flush(5)
+    return store
+
+
+def _open(store):
+    model = ChatMessageModel()
+    page = store.latest(CHAT_WINDOW)
+    model.set_messages(page, has_older=len(page) == CHAT_WINDOW)
+    return model
+
+
+def _ids(model):
+    return [model.message_at(row).id for row in range(model.rowCount())]
+
+
+def _fetch(model, store, older):
+    page = store.before(model.first_id(), CHAT_PAGE) if older else store.after(model.last_id(), CHAT_PAGE)
+    return model.apply_page(page, older)
+
+
+def test_short_history_has_no_more_pages(tmp_path):
+    store = _store(tmp_path, 10)
+    try:
+        model = _open(store)
+        assert _ids(model) == list(range(1, 11))
+        assert not model.has_older and not model.has_newer
+    finally:
+        store.close()
+
+
+def test_scroll_to_start_and_back_keeps_window_contiguous(tmp_path):
+    total = CHAT_WINDOW + 4 * CHAT_PAGE + 7
+    store = _store(tmp_path, total)
+    try:
+        model = _open(store)
+        assert _ids(model) == list(range(total - CHAT_WINDOW + 1, total + 1))
+        assert model.has_older and not model.has_newer
+
+        while model.has_older:
+            first = model.first_id()
+            shift = _fetch(model, store, older=True)
+            ids = _ids(model)
+            assert ids == list(range(ids[0], ids[0] + len(ids)))
+            assert ids[shift] == first or shift == 0
+            assert len(ids) <= CHAT_MAX_LOADED
+        assert model.first_id() == 1
+        assert model.has_newer and model.last_id() < total
+        assert not model.append(ChatMessage("Bob", "mới", False, "01/01/2024 10:00"))
+
+        while model.has_newer:
+            last = model.last_id()
+            shift = _fetch(model, store, older=False)
+            ids = _ids(model)
+            assert ids == list(range(ids[0], ids[0] + len(ids)))
+            assert ids[ids.index(last) + 1] == last + 1 and shift <= 0
+            assert len(ids) <= CHAT_MAX_LOADED
+        assert model.last_id() == total and model.has_older
+    finally:
+        store.close()
+
+
+def test_full_last_page_clears_flag_on_next_empty_read(tmp_path):
+    store = _store(tmp_path, CHAT_WINDOW + CHAT_PAGE)
+    try:
+        model = _open(store)
+        assert _fetch(model, store, older=True) == CHAT_PAGE
+        assert model.first_id() == 1 and model.has_older
+        assert _fetch(model, store, older=True) == 0
+        assert not model.has_older
+        assert _ids(model) == list(range(1, CHAT_WINDOW + CHAT_PAGE + 1))
+    finally:
+        store.close()
+
+
+def test_append_and_trim_at_bottom(tmp_path):
+    store = _store(tmp_path, CHAT_WINDOW)
+    try:
+        model = _open(store)
+        for i in range(CHAT_PAGE + 1):
+            assert model.append(store.append(ChatMessage("Bob", f"mới {i}", False, "01/01/2024 10:00")))
+        model.trim()
+        assert model.rowCount() == CHAT_WINDOW and model.has_older
+        assert model.last_id() == CHAT_WINDOW + CHAT_PAGE + 1
+    finally:
+        store.close()
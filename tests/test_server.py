@@ -0,0 +1,175 @@
+"""Kiểm thử BrokerServer qua RemoteBroker thật (socket TCP cục bộ)"""
+
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from app.server import BrokerServer
+from app.transport import BrokerError, RemoteBroker
+from app.wire import OP_JOIN_ROOM, OP_REGISTER, OP_SEND, OP_SEND_ROOM, encode_frame, pack_message
+
+
+@pytest.fixture
+def server_url():
+    ready = threading.Event()
+    urls = []
+    state = {}
+
+    def run():
+        async def go():
+            server = BrokerServer()
+            await server.start("tcp://127.0.0.1:0")
+            urls.extend(server.addresses)
+            state["loop"] = asyncio.get_running_loop()
+            state["stop"] = asyncio.Event()
+            ready.set()
+            await state["stop"].wait()
+            await server.close()
+
+        asyncio.run(go())
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait(5)
+    yield urls[0]
+    state["loop"].call_soon_threadsafe(state["stop"].set)
+    thread.join(5)
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_register_rejects_client_id_live_on_other_connection(server_url):
+    owner = RemoteBroker(server_url)
+    thief = RemoteBroker(server_url)
+    try:
+        client_id = owner.register_client("A", b"a" * 32, lambda frame: None)
+        with pytest.raises(BrokerError):
+            thief.register_client("B", b"b" * 32, lambda frame: None, client_id=client_id)
+        assert owner.list_clients()[client_id].display_name == "A"
+    finally:
+        thief.close()
+        owner.close()
+
+
+def test_disconnect_releases_only_owned_registration(server_url):
+    first = RemoteBroker(server_url)
+    client_id = first.register_client("A", b"a" * 32, lambda frame: None)
+    thief = RemoteBroker(server_url)
+    with pytest.raises(BrokerError):
+        thief.register_client("B", b"b" * 32, lambda frame: None, client_id=client_id)
+    thief.close()
+    observer = RemoteBroker(server_url)
+    try:
+        time.sleep(0.1)
+        assert client_id in observer.list_clients()
+        first.close()
+        assert _wait_for(lambda: client_id not in observer.list_clients())
+        again = RemoteBroker(server_url)
+        try:
+            assert again.register_client("A", b"a" * 32, lambda frame: None, client_id=client_id) == client_id
+        finally:
+            again.close()
+    finally:
+        observer.close()
+
+
+def test_send_drops_frame_with_spoofed_sender(server_url):
+    alice = RemoteBroker(server_url)
+    mallory = RemoteBroker(server_url)
+    try:
+        got = []
+        alice_id = alice.register_client("A", b"a" * 32, got.append)
+        mallory_id = mallory.register_client("M", b"m" * 32, lambda frame: None)
+        bob_id = alice.register_client("B", b"b" * 32, got.append)
+        mallory.send_ciphertext(bob_id, alice_id, b"m" * 32, b"n" * 12, b"spoofed")
+        mallory.send_ciphertext_many(bob_id, [alice_id], b"m" * 32, b"n" * 12, b"spoofed")
+        mallory.send_ciphertext(mallory_id, alice_id, b"m" * 32, b"n" * 12, b"honest")
+        assert _wait_for(lambda: len(got) == 1)
+        time.sleep(0.1)
+        assert len(got) == 1 and bytes(got[0]).endswith(b"honest")
+    finally:
+        mallory.close()
+        alice.close()
+
+
+def test_malformed_messages_get_error_and_keep_connection(server_url):
+    broker = RemoteBroker(server_url)
+    try:
+        with pytest.raises(BrokerError):
+            broker._request(OP_REGISTER, b"only-name")
+        with pytest.raises(BrokerError):
+            broker._request(OP_JOIN_ROOM, b"\xff\xfe", b"x")
+        broker._send(pack_message(OP_SEND, b"\xff"))
+        broker._send(pack_message(OP_SEND_ROOM))
+        client_id = broker.register_client("A", b"a" * 32, lambda frame: None)
+        assert client_id in broker.list_clients()
+    finally:
+        broker.close()
+
+
+def test_room_join_and_send_require_ownership_and_membership(server_url):
+    alice = RemoteBroker(server_url)
+    mallory = RemoteBroker(server_url)
+    try:
+        got = []
+        alice_id = alice.register_client("A", b"a" * 32, got.append)
+        bob_id = alice.register_client("B", b"b" * 32, got.append)
+        mallory_id = mallory.register_client("M", b"m" * 32, lambda frame: None)
+        room = alice.create_room("nhóm")
+        alice.join_room(room, alice_id)
+        alice.join_room(room, bob_id)
+        with pytest.raises(BrokerError):
+            mallory.join_room(room, mallory_id + "-khác")
+        with pytest.raises(BrokerError):
+            mallory.leave_room(room, bob_id)
+        assert sorted(mallory.room_members(room)) == sorted([alice_id, bob_id])
+
+        with pytest.raises(BrokerError):
+            mallory.send_to_room(room, bytes(encode_frame(mallory_id, b"m" * 32, b"n" * 12, b"spam")))
+        assert alice.send_to_room(room, bytes(encode_frame(alice_id, b"a" * 32, b"n" * 12, b"hello")), exclude=alice_id) == 1
+        assert _wait_for(lambda: len(got) == 1)
+        time.sleep(0.1)
+        assert len(got) == 1 and bytes(got[0]).endswith(b"hello")
+    finally:
+        mallory.close()
+        alice.close()
+
+
+def test_raising_deliver_callback_keeps_reader_alive(server_url):
+    alice = RemoteBroker(server_url)
+    try:
+        got = []
+
+        def deliver(frame):
+            got.append(bytes(frame))
+            if len(got) == 1:
+                raise RuntimeError("lỗi của UI")
+
+        alice_id = alice.register_client("A", b"a" * 32, deliver)
+        for text in (b"first", b"second"):
+            alice.send_ciphertext(alice_id, alice_id, b"a" * 32, b"n" * 12, text)
+        assert _wait_for(lambda: len(got) == 2)
+        assert alice_id in alice.list_clients()
+    finally:
+        alice.close()
+
+
+def test_request_timeout_raises_broker_error():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    broker = RemoteBroker("tcp://127.0.0.1:%d" % listener.getsockname()[1], timeout=0.2)
+    try:
+        with pytest.raises(BrokerError):
+            broker.list_clients()
+    finally:
+        broker.close()
+        listener.close()
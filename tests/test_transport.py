@@ -0,0 +1,197 @@
+"""Kiểm thử registry client, hàng đợi giao frame và InMemoryBroker (app.transport)"""
+
+import threading
+
+import pytest
+
+from app.offline import OfflineLog
+from app.transport import (
+    BrokerError,
+    BrokerMetrics,
+    ClientRegistration,
+    ClientRegistry,
+    DeliveryQueue,
+    InMemoryBroker,
+    OverflowPolicy,
+    QueueFull,
+)
+from app.wire import encode_frame
+
+NONCE = bytes(12)
+
+
+class _ManualPool:
+    """Pool giữ tác vụ lại cho test tự chạy (frame nằm trong hàng đợi tới khi run)"""
+
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, fn, *args):
+        self.tasks.append((fn, args))
+
+    def run(self):
+        while self.tasks:
+            fn, args = self.tasks.pop(0)
+            fn(*args)
+
+
+def _registration(client_id):
+    return ClientRegistration(client_id, client_id.upper(), b"k" * 32, lambda frame: None)
+
+
+def test_registry_add_get_pop():
+    registry = ClientRegistry(shards=3)
+    alice = _registration("alice")
+    assert registry.add(alice) is None
+    assert registry.add(_registration("bob")) is None
+    assert len(registry) == 2 and "alice" in registry and "carol" not in registry
+    assert registry.get("alice") is alice
+    assert registry.id_of(alice.handle) == "alice"
+    assert registry.by_handle(alice.handle) is alice
+
+    replacement = _registration("alice")
+    assert registry.add(replacement) is alice
+    assert replacement.handle == alice.handle and len(registry) == 2
+
+    assert registry.pop("alice") is replacement
+    assert registry.pop("alice") is None
+    assert registry.get("alice") is None and len(registry) == 1
+    assert sorted(registry.snapshot()) == ["bob"]
+
+
+def test_registry_handles_are_refcounted_and_reused_fifo():
+    registry = ClientRegistry()
+    alice = _registration("alice")
+    registry.add(alice)
+    handle = registry.intern("alice")  # Tham chiếu thứ 2 (vd: thành viên phòng)
+    assert handle == alice.handle
+    registry.pop("alice")
+    assert registry.handle_of("alice") == handle and registry.id_of(handle) == "alice"
+    registry.release(handle)
+    assert registry.handle_of("alice") is None and registry.id_of(handle) is None
+
+    other = _registration("bob")
+    registry.add(other)
+    newer = _registration("carol")
+    registry.add(newer)
+    assert other.handle == handle and newer.handle != handle
+
+
+def test_queue_reject_raises_when_full():
+    pool = _ManualPool()
+    delivered = []
+    queue = DeliveryQueue(delivered.append, pool, 2, OverflowPolicy.REJECT)
+    queue.put(b"1")
+    queue.put(b"2")
+    with pytest.raises(QueueFull):
+        queue.put(b"3")
+    pool.run()
+    assert delivered == [b"1", b"2"] and queue.dropped == 0
+
+
+def test_queue_drop_oldest_keeps_newest_and_counts():
+    pool = _ManualPool()
+    delivered = []
+    metrics = BrokerMetrics()
+    queue = DeliveryQueue(delivered.append, pool, 2, OverflowPolicy.DROP_OLDEST, metrics=metrics, client_id="bob")
+    for frame in (b"1", b"2", b"3", b"4"):
+        queue.put(frame)
+    assert len(queue) == 2 and queue.dropped == 2
+    pool.run()
+    assert delivered == [b"3", b"4"]
+    stats = metrics.snapshot()
+    assert stats.dropped == 2 and stats.per_client["bob"]["dropped"] == 2
+
+
+def test_queue_block_times_out_then_succeeds_after_drain():
+    pool = _ManualPool()
+    delivered = []
+    queue = DeliveryQueue(delivered.append, pool, 1, OverflowPolicy.BLOCK, block_timeout=0.05)
+    queue.put(b"1")
+    with pytest.raises(QueueFull):
+        queue.put(b"2")
+
+    queue.block_timeout = 5.0
+    sender = threading.Thread(target=queue.put, args=(b"3",))
+    sender.start()
+    sender.join(0.05)
+    assert sender.is_alive()
+    pool.run()  # Giải phóng chỗ: người gửi đang chờ được đưa frame vào
+    sender.join(5)
+    pool.run()
+    assert delivered == [b"1", b"3"]
+
+
+def test_broker_defaults_to_reject():
+    assert InMemoryBroker().overflow is OverflowPolicy.REJECT
+
+
+def test_broker_unknown_recipient_and_offline_backlog(tmp_path):
+    metrics = BrokerMetrics()
+    assert InMemoryBroker(metrics=metrics).send_frame("nobody", b"frame") is False
+    assert metrics.unknown_recipient == 1
+
+    log = OfflineLog(str(tmp_path))
+    broker = InMemoryBroker(queue_size=0, offline=log)
+    broker.unregister_client(broker.register_client("Bob", b"k" * 32, lambda frame: None, client_id="bob"))
+    assert broker.send_frame("bob", b"a") is True
+    assert broker.send_frame("bob", b"b") is True
+    received = []
+    client_id = broker.register_client("Bob", b"k" * 32, received.append, client_id="bob")
+    assert client_id == "bob"
+    assert [bytes(frame) for frame in received] == [b"a", b"b"]
+    assert log.pending("bob") == 0
+    log.close()
+
+
+def test_offline_backlog_needs_known_recipient_and_same_key(tmp_path):
+    metrics = BrokerMetrics()
+    log = OfflineLog(str(tmp_path), max_pending_bytes=10)
+    broker = InMemoryBroker(queue_size=0, offline=log, metrics=metrics)
+    assert broker.send_frame("stranger", b"spam") is False
+    assert log.pending("stranger") == 0 and metrics.unknown_recipient == 1
+
+    broker.unregister_client(broker.register_client("Bob", b"k" * 32, lambda frame: None, client_id="bob"))
+    assert broker.send_frame("bob", b"12345") is True
+    assert broker.send_frame("bob", b"67890") is True
+    assert broker.send_frame("bob", b"x") is False
+    assert metrics.offline_stored == 2 and metrics.offline_dropped == 1
+
+    with pytest.raises(BrokerError):
+        broker.register_client("Mallory", b"m" * 32, lambda frame: None, client_id="bob")
+    assert log.pending("bob") == 2
+    received = []
+    broker.register_client("Bob", b"k" * 32, received.append, client_id="bob")
+    assert [bytes(frame) for frame in received] == [b"12345", b"67890"]
+    log.close()
+
+    log = OfflineLog(str(tmp_path))
+    assert log.public_key("bob") == b"k" * 32 and log.public_key("stranger") is None
+    log.close()
+
+
+def test_broker_send_frame_many_skips_excluded():
+    broker = InMemoryBroker(queue_size=0)
+    inbox = {}
+    ids = [broker.register_client(name, b"k" * 32, inbox.setdefault(name, []).append) for name in "abc"]
+    assert broker.send_frame_many(ids, b"frame", exclude=ids[0]) == 2
+    assert inbox == {"a": [], "b": [b"frame"], "c": [b"frame"]}
+
+
+def test_room_requires_registered_member_sender():
+    broker = InMemoryBroker(queue_size=0)
+    inbox = {}
+    alice, bob, mallory = (broker.register_client(name, b"k" * 32, inbox.setdefault(name, []).append) for name in ("alice", "bob", "mallory"))
+    room = broker.create_room("nhóm")
+    broker.join_room(room, alice)
+    broker.join_room(room, bob)
+    with pytest.raises(BrokerError):
+        broker.join_room(room, "chưa-đăng-ký")
+
+    with pytest.raises(BrokerError):
+        broker.send_to_room(room, bytes(encode_frame(mallory, b"k" * 32, NONCE, b"spam")))
+    assert inbox == {"alice": [], "bob": [], "mallory": []}
+
+    frame = bytes(encode_frame(alice, b"k" * 32, NONCE, b"hi"))
+    assert broker.send_to_room(room, frame, exclude=alice) == 1
+    assert inbox["bob"] == [frame]
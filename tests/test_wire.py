@@ -0,0 +1,94 @@
+"""Kiểm thử định dạng frame và giao thức điều khiển (app.wire)"""
+
+import struct
+
+import pytest
+
+from app.wire import (
+    FLAG_GROUP,
+    FRAME_VERSION,
+    HEADER_BYTES,
+    MAX_MESSAGE_BYTES,
+    OP_REGISTER,
+    OP_SEND,
+    FrameError,
+    decode_frame,
+    encode_frame,
+    frame_size,
+    pack_message,
+    read_message_length,
+    unpack_message,
+)
+
+NONCE = bytes(range(12))
+
+
+def test_frame_roundtrip_without_copy():
+    data = encode_frame("người-gửi", b"k" * 32, NONCE, b"ciphertext", FLAG_GROUP)
+    frame = decode_frame(data)
+    assert frame.version == FRAME_VERSION
+    assert frame.flags == FLAG_GROUP
+    assert frame.sender_id == "người-gửi"
+    assert bytes(frame.key_id) == b"k" * 32
+    assert bytes(frame.nonce) == NONCE
+    assert bytes(frame.ciphertext) == b"ciphertext"
+    assert frame.ciphertext.obj is data
+
+
+def test_encode_into_caller_buffer():
+    size = frame_size(b"a", b"k", b"xyz")
+    out = bytearray(size + 10)
+    view = encode_frame("a", b"k", NONCE, b"xyz", out=out)
+    assert len(view) == size and view.obj is out
+    assert bytes(decode_frame(view).ciphertext) == b"xyz"
+    with pytest.raises(FrameError):
+        encode_frame("a", b"k", NONCE, b"xyz", out=bytearray(size - 1))
+
+
+@pytest.mark.parametrize(
+    "sender, key_id, nonce",
+    [("a" * 256, b"k", NONCE), ("a", b"k" * 256, NONCE), ("a", b"k", b"short")],
+)
+def test_encode_rejects_invalid_fields(sender, key_id, nonce):
+    with pytest.raises(FrameError):
+        encode_frame(sender, key_id, nonce, b"")
+
+
+def test_decode_rejects_malformed_frames():
+    good = bytes(encode_frame("a", b"k", NONCE, b"payload"))
+    with pytest.raises(FrameError):
+        decode_frame(good[:HEADER_BYTES - 1])
+    with pytest.raises(FrameError):
+        decode_frame(b"XX" + good[2:])
+    with pytest.raises(FrameError):
+        decode_frame(good[:2] + bytes([FRAME_VERSION + 1]) + good[3:])
+    with pytest.raises(FrameError):
+        decode_frame(good[:-1])
+    with pytest.raises(FrameError):
+        decode_frame(good + b"!")
+
+
+def test_message_roundtrip():
+    message = pack_message(OP_SEND, b"bob", b"", b"frame")
+    assert read_message_length(message[:4]) == len(message) - 4
+    op, fields = unpack_message(message[4:])
+    assert op == OP_SEND
+    assert [bytes(f) for f in fields] == [b"bob", b"", b"frame"]
+    op, fields = unpack_message(pack_message(OP_REGISTER)[4:])
+    assert op == OP_REGISTER and fields == []
+
+
+def test_unpack_rejects_malformed_messages():
+    body = pack_message(OP_SEND, b"bob", b"frame")[4:]
+    with pytest.raises(FrameError):
+        unpack_message(b"")
+    with pytest.raises(FrameError):
+        unpack_message(body[:-1])
+    with pytest.raises(FrameError):
+        unpack_message(body[:3])
+
+
+@pytest.mark.parametrize("length", [0, MAX_MESSAGE_BYTES + 1])
+def test_read_message_length_bounds(length):
+    with pytest.raises(FrameError):
+        read_message_length(struct.pack(">I", length))